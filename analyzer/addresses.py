@@ -0,0 +1,73 @@
+import socket
+import struct
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Iterable, Tuple, Union
+
+
+IPV4_BITS = 32
+IPV4_STRUCT = struct.Struct('!I')
+
+
+@lru_cache(maxsize=65536)
+def ipv4_to_int(ip_address: str) -> int:
+    return IPV4_STRUCT.unpack(socket.inet_aton(ip_address))[0]
+
+
+def parse_ipv4_network(network: str) -> Tuple[int, int]:
+    address, _, prefix_length = network.strip().partition('/')
+    start = IPV4_STRUCT.unpack(socket.inet_aton(address))[0]
+    prefix_length = int(prefix_length) if prefix_length else IPV4_BITS
+
+    host_bits = IPV4_BITS - prefix_length
+    start = (start >> host_bits) << host_bits
+    return start, start + (1 << host_bits) - 1
+
+
+class IPv4RangeSet:
+
+    def __init__(self, networks: Iterable[str] = ()):
+        self._starts = array('I')
+        self._ends = array('I')
+        self.extend(networks)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'IPv4RangeSet':
+        with open(path, 'r') as f:
+            return cls(
+                line.split('#', 1)[0] for line in f if line.split('#', 1)[0].strip()
+            )
+
+    def extend(self, networks: Iterable[str]):
+        ranges = list(zip(self._starts, self._ends))
+        for network in networks:
+            try:
+                ranges.append(parse_ipv4_network(network))
+            except (OSError, ValueError):
+                continue
+
+        # Пересекающиеся и соседние диапазоны сливаются, остаются отсортированные непересекающиеся интервалы
+        ranges.sort()
+        starts, ends = array('I'), array('I')
+        for start, end in ranges:
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+
+        self._starts, self._ends = starts, ends
+
+    def __contains__(self, ip_address: Union[int, str]) -> bool:
+        if isinstance(ip_address, str):
+            try:
+                ip_address = ipv4_to_int(ip_address)
+            except OSError:
+                return False
+
+        index = bisect_right(self._starts, ip_address) - 1
+        return index >= 0 and ip_address <= self._ends[index]
+
+    def __len__(self) -> int:
+        return len(self._starts)
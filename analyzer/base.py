@@ -1,25 +1,146 @@
 import abc
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureExtractor(metaclass=abc.ABCMeta):
+
+    # Группа признаков пакета: колонки (имя, dtype), которые она заполняет, и имена извлекателей,
+    # чей результат в общем контексте пакета ей нужен. Извлекатель без колонок только готовит контекст
+    NAME = ''
+    COLUMNS: Tuple[Tuple[str, str], ...] = ()
+    REQUIRES: Tuple[str, ...] = ()
+
+    @abc.abstractmethod
+    def extract(self, pkt, context: dict, pkt_data: dict):
+        raise NotImplementedError
+
+
+class ExtractorPipeline:
+
+    # Нужные извлекатели собираются в один список шагов: пакет проходит их за один раз,
+    # слои ищутся однажды и передаются через контекст, признаки пишутся сразу в итоговый dict
+    def __init__(self, extractors: Sequence[FeatureExtractor], features: Optional[Iterable[str]] = None):
+        self.extractors = self.resolve(extractors, features)
+        self._steps = tuple(extractor.extract for extractor in self.extractors)
+
+    @staticmethod
+    def resolve(extractors: Sequence[FeatureExtractor],
+                features: Optional[Iterable[str]] = None) -> List[FeatureExtractor]:
+        # Без списка признаков - все извлекатели. Иначе - дающие хотя бы одну нужную колонку и все,
+        # от кого они зависят. Порядок регистрации сохраняется, зависимость обязана быть зарегистрирована раньше
+        registered = {}
+        for extractor in extractors:
+            missing = [name for name in extractor.REQUIRES if name not in registered]
+            if missing:
+                raise ValueError(f'Extractor {extractor.NAME} requires unregistered extractors: {missing}')
+            registered[extractor.NAME] = extractor
+
+        if features is None:
+            return list(extractors)
+
+        features = set(features)
+        selected = set()
+        for extractor in extractors:
+            if features.intersection(column for column, _ in extractor.COLUMNS):
+                selected.add(extractor.NAME)
+                selected.update(ExtractorPipeline._get_dependencies(extractor, registered))
+
+        return [extractor for extractor in extractors if extractor.NAME in selected]
+
+    @staticmethod
+    def _get_dependencies(extractor: FeatureExtractor, registered: dict) -> set:
+        dependencies = set()
+        for name in extractor.REQUIRES:
+            dependencies.add(name)
+            dependencies.update(ExtractorPipeline._get_dependencies(registered[name], registered))
+
+        return dependencies
+
+    @property
+    def names(self) -> List[str]:
+        return [extractor.NAME for extractor in self.extractors]
+
+    @property
+    def columns(self) -> List[str]:
+        return [column for extractor in self.extractors for column, _ in extractor.COLUMNS]
+
+    def extract(self, pkt, context: Optional[dict] = None) -> dict:
+        context, pkt_data = context or {}, {}
+        for step in self._steps:
+            step(pkt, context, pkt_data)
+
+        return pkt_data
 
 
 class BaseAnalyzer:
 
+    # Фиксированная схема колонок: (имя признака, dtype). Необязательные признаки хранятся
+    # как float64, отсутствующее значение - NaN (так же его видит pandas при чтении датасета)
+    FEATURES: Tuple[Tuple[str, str], ...] = ()
+    # Увеличивается при любом изменении извлекаемых признаков - по ней инвалидируется кэш признаков
+    SCHEMA_VERSION = 1
+    # Суффикс датасета и модели: признаки разных анализаторов обучаются и хранятся отдельно
+    DATASET_VARIANT: Optional[str] = None
+    # Извлекатели признаков пакета по порядку выполнения; схема FEATURES может строиться из их колонок
+    EXTRACTORS: Tuple[FeatureExtractor, ...] = ()
+
     @abc.abstractmethod
     def analyze(self, *args, **kwargs):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def iter_analyze(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def iter_analyze_columnar(self, *args, **kwargs) -> Iterator[pd.DataFrame]:
+        features = self.get_selected_feature_names()
+        for batch in self.iter_analyze(*args, **kwargs):
+            yield self.to_columnar(batch, features=features)
+
+    def analyze_columnar(self, *args, **kwargs) -> pd.DataFrame:
+        batches = list(self.iter_analyze_columnar(*args, **kwargs))
+        if not batches:
+            return self.to_columnar([], features=self.get_selected_feature_names())
+
+        return pd.concat(batches, ignore_index=True)
+
+    @classmethod
+    def get_feature_names(cls) -> List[str]:
+        return [feature for feature, _ in cls.FEATURES]
+
+    def get_selected_feature_names(self) -> List[str]:
+        # Колонки, которые этот экземпляр действительно извлекает; по умолчанию - вся схема
+        return self.get_feature_names()
+
+    @staticmethod
+    def get_extractor_features(extractors: Sequence[FeatureExtractor]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(column for extractor in extractors for column in extractor.COLUMNS)
+
+    @classmethod
+    def to_columnar(cls, rows: List[dict], features: Optional[List[str]] = None) -> pd.DataFrame:
+        columns = {}
+        for feature, dtype in cls.FEATURES:
+            if features is not None and feature not in features:
+                continue
+            default = np.nan if dtype == 'float64' else 0
+            values = (row.get(feature) for row in rows)
+            columns[feature] = np.fromiter(
+                (default if value is None else value for value in values), dtype=dtype, count=len(rows)
+            )
+
+        return pd.DataFrame(columns)
 
-def dump_analysis(results: List[dict], dataset_path: str, is_malicious: int = 1, append: bool = False):
-    features = set()
-    for result in results:
-        features.update(set(result.keys()))
 
-    features_sorted = sorted(list(features))
-    mode = 'w' if not append else 'r+'
-    with open(dataset_path, mode) as f:
-        if not append:
-            f.write(';'.join(features_sorted) + ';is_malicious' + '\n')
+def dump_analysis(results: Union[List[dict], pd.DataFrame], dataset_path: str, is_malicious: int = 1,
+                  append: bool = False, features: Optional[List[str]] = None):
+    # Текстовый CSV-датасет для совместимости, обучение читает колоночное хранилище core.ml.store
+    if not isinstance(results, pd.DataFrame):
+        results = pd.DataFrame(results)
 
-        for result in results:
-            result_row = ';'.join([str(result.get(feature, '')) for feature in features_sorted])
-            f.write(result_row + f';{is_malicious}' + '\n')
+    features_sorted = features or sorted(results.columns)
+    results.reindex(columns=features_sorted).assign(is_malicious=is_malicious).to_csv(
+        dataset_path, sep=';', index=False, header=not append, mode='a' if append else 'w'
+    )
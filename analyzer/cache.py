@@ -0,0 +1,80 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core.analyzer.base import BaseAnalyzer
+
+
+class FeatureCache:
+
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, cache_dir: str, analyzer: BaseAnalyzer):
+        self._analyzer = analyzer
+        self._cache_root = Path(cache_dir)
+        self._features = analyzer.get_selected_feature_names()
+        # Версия схемы входит в путь: после ее изменения старые записи просто перестают находиться.
+        # Анализатор с урезанным набором признаков пишет в отдельный каталог и не портит полные записи
+        cache_name = f'{type(analyzer).__name__}-v{analyzer.SCHEMA_VERSION}'
+        if self._features != analyzer.get_feature_names():
+            cache_name += '-' + hashlib.sha1(','.join(self._features).encode()).hexdigest()[:12]
+        self._cache_dir = self._cache_root / cache_name
+
+    @classmethod
+    def get_content_hash(cls, pcap_file_path: str) -> str:
+        content_hash = hashlib.sha256()
+        with open(pcap_file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.HASH_CHUNK_SIZE), b''):
+                content_hash.update(chunk)
+
+        return content_hash.hexdigest()
+
+    def analyze(self, pcap_file_path: str) -> pd.DataFrame:
+        content_hash = self.get_content_hash(pcap_file_path)
+
+        result = self.get(content_hash)
+        if result is None:
+            result = self._analyzer.analyze_columnar(pcap_file_path)
+            self.put(content_hash, result)
+
+        return result
+
+    def get(self, content_hash: str) -> Optional[pd.DataFrame]:
+        entry_path = self._get_entry_path(content_hash)
+        if not entry_path.exists():
+            return None
+
+        with np.load(entry_path) as entry:
+            columns = {feature: entry[feature] for feature in self._features}
+
+        return pd.DataFrame(columns)
+
+    def put(self, content_hash: str, result: pd.DataFrame):
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+
+        columns = {feature: result[feature].to_numpy() for feature in self._features}
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmp_path, self._get_entry_path(content_hash))
+
+    def prune(self):
+        if not self._cache_root.exists():
+            return
+
+        # Удаляются только записи других версий схемы, каталоги других наборов признаков той же версии остаются
+        prefix = f'{type(self._analyzer).__name__}-v'
+        for path in self._cache_root.iterdir():
+            if not (path.is_dir() and path.name.startswith(prefix)):
+                continue
+            if path.name[len(prefix):].split('-')[0] != str(self._analyzer.SCHEMA_VERSION):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _get_entry_path(self, content_hash: str) -> Path:
+        return self._cache_dir / f'{content_hash}.npz'
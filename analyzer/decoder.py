@@ -0,0 +1,399 @@
+import mmap
+import re
+import struct
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Iterator, Optional
+
+from scapy.config import conf
+from scapy.utils import RawPcapReader
+
+from core.analyzer.payload import get_payload_features
+
+
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 10 ** -6),
+    b'\xa1\xb2\xc3\xd4': ('>', 10 ** -6),
+    b'\x4d\x3c\xb2\xa1': ('<', 10 ** -9),
+    b'\xa1\xb2\x3c\x4d': ('>', 10 ** -9),
+}
+PCAP_GLOBAL_HEADER_LENGTH = 24
+PCAP_RECORD_HEADER_LENGTH = 16
+
+LINKTYPE_ETHERNET = 1
+
+ETHER_TYPE_IPV4 = 0x0800
+ETHER_TYPE_IPV6 = 0x86dd
+ETHER_TYPES_VLAN = (0x8100, 0x88a8)
+# Значения <= 1500 в поле типа - это длина кадра 802.3, scapy разбирает такие кадры как Dot3, а не Ether
+ETHER_MAX_LENGTH = 1500
+
+IP_PROTO_IPV4 = 4
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+IP_PROTO_IPV6 = 41
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+HTTP_PORTS = (80, 8080)
+HTTP_RESPONSE_LINE = re.compile(rb'^HTTP/\d\.\d \d\d\d .*$')
+
+ETHER_HEADER = struct.Struct('!IHIHH')
+VLAN_HEADER = struct.Struct('!HH')
+IPV4_HEADER = struct.Struct('!BBHHHBBHII')
+IPV6_HEADER = struct.Struct('!IHBB16s16s')
+TCP_HEADER = struct.Struct('!HHIIBBHHH')
+UDP_HEADER = struct.Struct('!HHHH')
+
+
+Frame = namedtuple('Frame', ['linktype', 'timestamp', 'buffer', 'start', 'end'])
+FlowPacket = namedtuple('FlowPacket', [
+    'timestamp', 'src', 'dst', 'src_port', 'dest_port', 'proto', 'length', 'payload_length', 'tcp_flags',
+])
+
+
+class PcapFrameReader:
+
+    def __init__(self, pcap_file):
+        self._pcap_file = pcap_file
+
+    def __iter__(self) -> Iterator[Frame]:
+        if isinstance(self._pcap_file, (str, Path)):
+            with open(self._pcap_file, 'rb') as f:
+                if not Path(self._pcap_file).stat().st_size:
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    if buffer[:4] in PCAP_MAGICS:
+                        yield from self._iter_buffer(buffer)
+                        return
+            yield from self._iter_scapy(self._pcap_file)
+        else:
+            magic = self._pcap_file.read(4)
+            if magic in PCAP_MAGICS:
+                yield from self._iter_stream(self._pcap_file, magic)
+            else:
+                self._pcap_file.seek(0)
+                yield from self._iter_scapy(self._pcap_file)
+
+    @staticmethod
+    def _iter_buffer(buffer) -> Iterator[Frame]:
+        # Заголовки записей читаются прямо из отображенного в память файла, данные пакета не копируются
+        endian, ts_resolution = PCAP_MAGICS[buffer[:4]]
+        linktype = struct.unpack_from(endian + 'I', buffer, 20)[0] & 0x0fffffff
+        record_header = struct.Struct(endian + 'IIII')
+
+        offset = PCAP_GLOBAL_HEADER_LENGTH
+        size = len(buffer)
+        while offset + PCAP_RECORD_HEADER_LENGTH <= size:
+            sec, subsec, caplen, _ = record_header.unpack_from(buffer, offset)
+            start = offset + PCAP_RECORD_HEADER_LENGTH
+            end = start + caplen
+            if end > size:
+                break
+
+            yield Frame(linktype, sec + subsec * ts_resolution, buffer, start, end)
+            offset = end
+
+    @staticmethod
+    def _iter_stream(stream, magic: bytes) -> Iterator[Frame]:
+        endian, ts_resolution = PCAP_MAGICS[magic]
+        global_header = magic + stream.read(PCAP_GLOBAL_HEADER_LENGTH - 4)
+        if len(global_header) < PCAP_GLOBAL_HEADER_LENGTH:
+            return
+
+        linktype = struct.unpack_from(endian + 'I', global_header, 20)[0] & 0x0fffffff
+        record_header = struct.Struct(endian + 'IIII')
+
+        while True:
+            header = stream.read(PCAP_RECORD_HEADER_LENGTH)
+            if len(header) < PCAP_RECORD_HEADER_LENGTH:
+                break
+
+            sec, subsec, caplen, _ = record_header.unpack(header)
+            data = stream.read(caplen)
+            if len(data) < caplen:
+                break
+
+            yield Frame(linktype, sec + subsec * ts_resolution, data, 0, caplen)
+
+    @staticmethod
+    def _iter_scapy(pcap_file) -> Iterator[Frame]:
+        # pcapng и сжатые файлы читаем через сырой ридер scapy - без разбора пакетов
+        with RawPcapReader(pcap_file) as reader:
+            for data, metadata in reader:
+                linktype = getattr(metadata, 'linktype', None)
+                if linktype is None:
+                    linktype = reader.linktype
+                    timestamp = metadata.sec + metadata.usec * 10 ** -6
+                else:
+                    timestamp = ((metadata.tshigh << 32) + metadata.tslow) / metadata.tsresol
+
+                yield Frame(linktype, timestamp, data, 0, len(data))
+
+
+class PcapTailReader:
+
+    # Чтение растущего pcap-файла (как tail -f): неполная запись дожидается дописывания
+    def __init__(self, pcap_file_path: str, poll_interval: float = 0.2, idle_timeout: Optional[float] = None):
+        self._pcap_file_path = pcap_file_path
+        self._poll_interval = poll_interval
+        self._idle_timeout = idle_timeout
+
+    def __iter__(self) -> Iterator[Frame]:
+        with open(self._pcap_file_path, 'rb') as f:
+            global_header = self._read_exact(f, PCAP_GLOBAL_HEADER_LENGTH)
+            if global_header is None or global_header[:4] not in PCAP_MAGICS:
+                return
+
+            endian, ts_resolution = PCAP_MAGICS[global_header[:4]]
+            linktype = struct.unpack_from(endian + 'I', global_header, 20)[0] & 0x0fffffff
+            record_header = struct.Struct(endian + 'IIII')
+
+            while True:
+                header = self._read_exact(f, PCAP_RECORD_HEADER_LENGTH)
+                if header is None:
+                    return
+
+                sec, subsec, caplen, _ = record_header.unpack(header)
+                data = self._read_exact(f, caplen)
+                if data is None:
+                    return
+
+                yield Frame(linktype, sec + subsec * ts_resolution, data, 0, caplen)
+
+    def _read_exact(self, f, size: int) -> Optional[bytes]:
+        data = b''
+        idle_since = time.monotonic()
+        while len(data) < size:
+            chunk = f.read(size - len(data))
+            if chunk:
+                data += chunk
+                idle_since = time.monotonic()
+                continue
+
+            if self._idle_timeout is not None and time.monotonic() - idle_since >= self._idle_timeout:
+                return None
+            time.sleep(self._poll_interval)
+
+        return data
+
+
+class InterfaceFrameReader:
+
+    def __init__(self, iface: str):
+        self._iface = iface
+
+    def __iter__(self) -> Iterator[Frame]:
+        # Сырой сокет scapy: кадры не разбираются в объекты Packet, разбор делает RawPacketDecoder
+        sock = conf.L2listen(iface=self._iface)
+        try:
+            while True:
+                _, data, timestamp = sock.recv_raw()
+                if data:
+                    yield Frame(LINKTYPE_ETHERNET, timestamp or time.time(), data, 0, len(data))
+        finally:
+            sock.close()
+
+
+class RawPacketDecoder:
+
+    # Проверка, переданная как None, пропускается вместе со своими признаками; with_payload - то же для нагрузки
+    def __init__(self, mac_oui_checker, private_ip_checker, suspicious_ip_checker, with_payload: bool = True):
+        self._is_authorized_mac_oui = mac_oui_checker
+        self._is_private_ip = private_ip_checker
+        self._is_suspicious_ip = suspicious_ip_checker
+        self._with_payload = with_payload
+
+    def decode(self, frame: Frame) -> Optional[dict]:
+        buffer, offset, end = frame.buffer, frame.start, frame.end
+        if frame.linktype != LINKTYPE_ETHERNET or end - offset < ETHER_HEADER.size:
+            # Битый пакет - пропускаем
+            return None
+
+        dst_high, dst_low, src_high, src_low, ether_type = ETHER_HEADER.unpack_from(buffer, offset)
+        dst, src = (dst_high << 16) | dst_low, (src_high << 16) | src_low
+        if ether_type <= ETHER_MAX_LENGTH:
+            return None
+
+        pkt_data = {}
+        if self._is_authorized_mac_oui is not None:
+            pkt_data['ether_src'] = self._is_authorized_mac_oui(src >> 24)
+            pkt_data['ether_dst'] = self._is_authorized_mac_oui(dst >> 24)
+        offset += ETHER_HEADER.size
+
+        while ether_type in ETHER_TYPES_VLAN and end - offset >= VLAN_HEADER.size:
+            _, ether_type = VLAN_HEADER.unpack_from(buffer, offset)
+            offset += VLAN_HEADER.size
+
+        if ether_type == ETHER_TYPE_IPV4:
+            self._decode_ipv4(buffer, offset, end, pkt_data, with_network_lvl=True)
+        elif ether_type == ETHER_TYPE_IPV6:
+            self._decode_ipv6(buffer, offset, end, pkt_data)
+
+        pkt_data.update({
+            'packet_length': frame.end - frame.start,
+            'has_file_payload': pkt_data.pop('has_file_payload', False),
+        })
+
+        return pkt_data
+
+    def _decode_ipv4(self, buffer, offset: int, end: int, pkt_data: dict, with_network_lvl: bool = False):
+        if end - offset < IPV4_HEADER.size:
+            return
+
+        version_ihl, tos, length, ip_id, flags_frag, ttl, proto, chksum, src, dst = IPV4_HEADER.unpack_from(
+            buffer, offset
+        )
+        ihl = version_ihl & 0x0f
+        frag = flags_frag & 0x1fff
+
+        if with_network_lvl:
+            pkt_data.update(dict(
+                version=version_ihl >> 4,
+                ihl=ihl,
+                tos=tos,
+                len=length,
+                id=ip_id,
+                frag=frag,
+                ttl=ttl,
+                proto=proto,
+                chksum=chksum,
+            ))
+            if self._is_private_ip is not None:
+                pkt_data['is_src_ip_private'] = self._is_private_ip(src)
+                pkt_data['is_dest_ip_private'] = self._is_private_ip(dst)
+            if self._is_suspicious_ip is not None:
+                pkt_data['is_src_suspicious'] = self._is_suspicious_ip(src)
+                pkt_data['is_dst_suspicious'] = self._is_suspicious_ip(dst)
+
+        payload_offset = offset + ihl * 4
+        if length >= ihl * 4:
+            end = min(end, offset + length)
+        if frag != 0 or payload_offset > end:
+            return
+
+        self._decode_ip_payload(buffer, payload_offset, end, proto, pkt_data)
+
+    def _decode_ipv6(self, buffer, offset: int, end: int, pkt_data: dict):
+        if end - offset < IPV6_HEADER.size:
+            return
+
+        _, payload_length, next_header, _, _, _ = IPV6_HEADER.unpack_from(buffer, offset)
+        offset += IPV6_HEADER.size
+        end = min(end, offset + payload_length)
+
+        while next_header in IPV6_EXTENSION_HEADERS and end - offset >= 2:
+            next_header, ext_length = buffer[offset], buffer[offset + 1]
+            offset += (ext_length + 1) * 8
+
+        if offset > end:
+            return
+
+        self._decode_ip_payload(buffer, offset, end, next_header, pkt_data)
+
+    def _decode_ip_payload(self, buffer, offset: int, end: int, proto: int, pkt_data: dict):
+        if proto == IP_PROTO_TCP:
+            self._decode_tcp(buffer, offset, end, pkt_data)
+        elif proto == IP_PROTO_UDP:
+            self._decode_udp(buffer, offset, end, pkt_data)
+        elif proto == IP_PROTO_IPV4:
+            # Scapy берет сетевые признаки из первого заголовка IPv4, в том числе вложенного в IPv6
+            self._decode_ipv4(buffer, offset, end, pkt_data, with_network_lvl='version' not in pkt_data)
+        elif proto == IP_PROTO_IPV6:
+            self._decode_ipv6(buffer, offset, end, pkt_data)
+
+    def _decode_tcp(self, buffer, offset: int, end: int, pkt_data: dict):
+        if end - offset < TCP_HEADER.size:
+            return
+
+        src_port, dest_port, seq, ack, dataofs_reserved, _, window, chksum, urgptr = TCP_HEADER.unpack_from(
+            buffer, offset
+        )
+        dataofs = dataofs_reserved >> 4
+        pkt_data.update(dict(
+            src_port=src_port,
+            dest_port=dest_port,
+            seq=seq,
+            ack=ack,
+            dataofs=dataofs,
+            reserved=(dataofs_reserved >> 1) & 0x07,
+            window=window,
+            tcp_chksum=chksum,
+            urgptr=urgptr,
+        ))
+        if self._with_payload:
+            pkt_data.update(get_payload_features(buffer, offset + dataofs * 4, end))
+
+        if src_port in HTTP_PORTS or dest_port in HTTP_PORTS:
+            pkt_data['has_file_payload'] = self._has_http_response_body(buffer, offset + dataofs * 4, end)
+
+    def _decode_udp(self, buffer, offset: int, end: int, pkt_data: dict):
+        if end - offset < UDP_HEADER.size:
+            return
+
+        src_port, dest_port, length, chksum = UDP_HEADER.unpack_from(buffer, offset)
+        pkt_data.update(dict(
+            src_port=src_port,
+            dest_port=dest_port,
+            udp_len=length,
+            udp_chksum=chksum,
+        ))
+        if self._with_payload:
+            pkt_data.update(get_payload_features(buffer, offset + UDP_HEADER.size, end))
+
+    @staticmethod
+    def _has_http_response_body(buffer, offset: int, end: int) -> bool:
+        # Повторяет логику scapy: строка статуса HTTP-ответа и непустое тело после заголовков
+        line_end = buffer.find(b'\r\n', offset, end)
+        if line_end == -1 or not HTTP_RESPONSE_LINE.match(buffer[offset:line_end]):
+            return False
+
+        headers_end = buffer.find(b'\r\n\r\n', offset, end)
+        return headers_end != -1 and headers_end + 4 < end
+
+
+# Для агрегации в потоки нужны только адреса, порты, длины и флаги TCP - остальные поля не разбираются
+class FlowPacketDecoder:
+
+    def decode(self, frame: Frame) -> Optional[FlowPacket]:
+        buffer, offset, end = frame.buffer, frame.start, frame.end
+        if frame.linktype != LINKTYPE_ETHERNET or end - offset < ETHER_HEADER.size:
+            return None
+
+        ether_type = ETHER_HEADER.unpack_from(buffer, offset)[-1]
+        offset += ETHER_HEADER.size
+        while ether_type in ETHER_TYPES_VLAN and end - offset >= VLAN_HEADER.size:
+            _, ether_type = VLAN_HEADER.unpack_from(buffer, offset)
+            offset += VLAN_HEADER.size
+
+        if ether_type == ETHER_TYPE_IPV4 and end - offset >= IPV4_HEADER.size:
+            version_ihl, _, length, _, flags_frag, _, proto, _, src, dst = IPV4_HEADER.unpack_from(buffer, offset)
+            ihl = (version_ihl & 0x0f) * 4
+            if length >= ihl:
+                end = min(end, offset + length)
+            is_first_fragment = flags_frag & 0x1fff == 0
+            offset += ihl
+        elif ether_type == ETHER_TYPE_IPV6 and end - offset >= IPV6_HEADER.size:
+            _, payload_length, proto, _, src, dst = IPV6_HEADER.unpack_from(buffer, offset)
+            offset += IPV6_HEADER.size
+            end = min(end, offset + payload_length)
+            while proto in IPV6_EXTENSION_HEADERS and end - offset >= 2:
+                proto, ext_length = buffer[offset], buffer[offset + 1]
+                offset += (ext_length + 1) * 8
+            is_first_fragment = True
+        else:
+            return None
+
+        src_port = dest_port = tcp_flags = 0
+        payload_offset = offset
+        if is_first_fragment and proto == IP_PROTO_TCP and end - offset >= TCP_HEADER.size:
+            src_port, dest_port, _, _, dataofs_reserved, tcp_flags, _, _, _ = TCP_HEADER.unpack_from(buffer, offset)
+            payload_offset = offset + (dataofs_reserved >> 4) * 4
+        elif is_first_fragment and proto == IP_PROTO_UDP and end - offset >= UDP_HEADER.size:
+            src_port, dest_port, _, _ = UDP_HEADER.unpack_from(buffer, offset)
+            payload_offset = offset + UDP_HEADER.size
+
+        return FlowPacket(
+            frame.timestamp, src, dst, src_port, dest_port, proto,
+            frame.end - frame.start, max(end - payload_offset, 0), tcp_flags,
+        )
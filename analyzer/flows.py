@@ -0,0 +1,258 @@
+import math
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+from core.analyzer.base import BaseAnalyzer
+from core.analyzer.decoder import FlowPacket, FlowPacketDecoder, PcapFrameReader
+from core.analyzer.network import NetworkUtilsService
+
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+TCP_URG = 0x20
+
+
+class Flow:
+
+    __slots__ = (
+        'src', 'dst', 'src_port', 'dest_port', 'proto', 'first_seen', 'last_seen',
+        'fwd_packets', 'bwd_packets', 'fwd_bytes', 'bwd_bytes', 'payload_bytes', 'payload_packets',
+        'iat_sum', 'iat_sq_sum', 'iat_min', 'iat_max',
+        'syn_count', 'fin_count', 'rst_count', 'psh_count', 'ack_count', 'urg_count',
+    )
+
+    def __init__(self, packet: FlowPacket):
+        # Инициатор потока - отправитель первого увиденного пакета
+        self.src, self.dst = packet.src, packet.dst
+        self.src_port, self.dest_port = packet.src_port, packet.dest_port
+        self.proto = packet.proto
+        self.first_seen = self.last_seen = packet.timestamp
+
+        self.fwd_packets = self.bwd_packets = 0
+        self.fwd_bytes = self.bwd_bytes = 0
+        self.payload_bytes = self.payload_packets = 0
+        self.iat_sum = self.iat_sq_sum = 0.0
+        self.iat_min = math.inf
+        self.iat_max = 0.0
+        self.syn_count = self.fin_count = self.rst_count = 0
+        self.psh_count = self.ack_count = self.urg_count = 0
+
+    def update(self, packet: FlowPacket):
+        if self.fwd_packets or self.bwd_packets:
+            iat = max(packet.timestamp - self.last_seen, 0.0)
+            self.iat_sum += iat
+            self.iat_sq_sum += iat * iat
+            self.iat_min = min(self.iat_min, iat)
+            self.iat_max = max(self.iat_max, iat)
+        self.last_seen = max(self.last_seen, packet.timestamp)
+
+        if packet.src == self.src and packet.src_port == self.src_port:
+            self.fwd_packets += 1
+            self.fwd_bytes += packet.length
+        else:
+            self.bwd_packets += 1
+            self.bwd_bytes += packet.length
+
+        if packet.payload_length:
+            self.payload_bytes += packet.payload_length
+            self.payload_packets += 1
+
+        flags = packet.tcp_flags
+        if flags:
+            self.syn_count += bool(flags & TCP_SYN)
+            self.fin_count += bool(flags & TCP_FIN)
+            self.rst_count += bool(flags & TCP_RST)
+            self.psh_count += bool(flags & TCP_PSH)
+            self.ack_count += bool(flags & TCP_ACK)
+            self.urg_count += bool(flags & TCP_URG)
+
+    def to_features(self) -> dict:
+        packet_count = self.fwd_packets + self.bwd_packets
+        byte_count = self.fwd_bytes + self.bwd_bytes
+        iat_count = packet_count - 1
+
+        flow_data = dict(
+            proto=self.proto,
+            src_port=self.src_port,
+            dest_port=self.dest_port,
+            duration=self.last_seen - self.first_seen,
+            packet_count=packet_count,
+            byte_count=byte_count,
+            fwd_packet_count=self.fwd_packets,
+            bwd_packet_count=self.bwd_packets,
+            fwd_byte_count=self.fwd_bytes,
+            bwd_byte_count=self.bwd_bytes,
+            mean_packet_length=byte_count / packet_count,
+            payload_byte_count=self.payload_bytes,
+            payload_packet_count=self.payload_packets,
+            payload_ratio=self.payload_bytes / byte_count if byte_count else 0.0,
+            syn_count=self.syn_count,
+            fin_count=self.fin_count,
+            rst_count=self.rst_count,
+            psh_count=self.psh_count,
+            ack_count=self.ack_count,
+            urg_count=self.urg_count,
+        )
+
+        if iat_count > 0:
+            iat_mean = self.iat_sum / iat_count
+            flow_data.update(
+                iat_mean=iat_mean,
+                iat_std=math.sqrt(max(self.iat_sq_sum / iat_count - iat_mean * iat_mean, 0.0)),
+                iat_min=self.iat_min,
+                iat_max=self.iat_max,
+            )
+
+        # Признаки адресов считаются только для IPv4, для IPv6 остаются пустыми
+        if isinstance(self.src, int):
+            flow_data.update(
+                is_src_ip_private=NetworkUtilsService.is_private_ip(self.src),
+                is_dest_ip_private=NetworkUtilsService.is_private_ip(self.dst),
+                is_src_suspicious=NetworkUtilsService.is_suspicious_ip(self.src),
+                is_dst_suspicious=NetworkUtilsService.is_suspicious_ip(self.dst),
+            )
+
+        return flow_data
+
+
+class FlowTable:
+
+    def __init__(self, idle_timeout: float, active_timeout: float, max_flows: int):
+        self._idle_timeout = idle_timeout
+        self._active_timeout = active_timeout
+        self._max_flows = max_flows
+        # Порядок словаря - порядок последней активности, самый давно молчащий поток всегда первый
+        self._flows: 'OrderedDict[Tuple, Flow]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._flows)
+
+    @staticmethod
+    def get_flow_key(packet: FlowPacket) -> Tuple:
+        # Ключ не зависит от направления: запрос и ответ попадают в один поток
+        src, dst = (packet.src, packet.src_port), (packet.dst, packet.dest_port)
+        if dst < src:
+            src, dst = dst, src
+        return packet.proto, src, dst
+
+    def add(self, packet: FlowPacket) -> List[Flow]:
+        finished = self.expire(packet.timestamp)
+
+        key = self.get_flow_key(packet)
+        flow = self._flows.get(key)
+        if flow is not None and packet.timestamp - flow.first_seen >= self._active_timeout:
+            # Долгий поток делится на части, чтобы признаки появлялись без ожидания его конца
+            finished.append(self._flows.pop(key))
+            flow = None
+
+        if flow is None:
+            flow = self._flows[key] = Flow(packet)
+            if len(self._flows) > self._max_flows:
+                finished.append(self._flows.popitem(last=False)[1])
+        else:
+            self._flows.move_to_end(key)
+
+        flow.update(packet)
+        return finished
+
+    def expire(self, now: float) -> List[Flow]:
+        finished = []
+        while self._flows:
+            flow = next(iter(self._flows.values()))
+            if now - flow.last_seen <= self._idle_timeout:
+                break
+            finished.append(self._flows.popitem(last=False)[1])
+
+        return finished
+
+    def flush(self) -> List[Flow]:
+        finished = list(self._flows.values())
+        self._flows.clear()
+        return finished
+
+
+class FlowAnalyzer(BaseAnalyzer):
+
+    DATASET_VARIANT = 'flow'
+
+    SCHEMA_VERSION = 1
+    FEATURES = (
+        ('proto', 'int64'),
+        ('src_port', 'int64'),
+        ('dest_port', 'int64'),
+        ('duration', 'float64'),
+        ('packet_count', 'int64'),
+        ('byte_count', 'int64'),
+        ('fwd_packet_count', 'int64'),
+        ('bwd_packet_count', 'int64'),
+        ('fwd_byte_count', 'int64'),
+        ('bwd_byte_count', 'int64'),
+        ('mean_packet_length', 'float64'),
+        ('payload_byte_count', 'int64'),
+        ('payload_packet_count', 'int64'),
+        ('payload_ratio', 'float64'),
+        ('iat_mean', 'float64'),
+        ('iat_std', 'float64'),
+        ('iat_min', 'float64'),
+        ('iat_max', 'float64'),
+        ('syn_count', 'int64'),
+        ('fin_count', 'int64'),
+        ('rst_count', 'int64'),
+        ('psh_count', 'int64'),
+        ('ack_count', 'int64'),
+        ('urg_count', 'int64'),
+        ('is_src_ip_private', 'float64'),
+        ('is_dest_ip_private', 'float64'),
+        ('is_src_suspicious', 'float64'),
+        ('is_dst_suspicious', 'float64'),
+    )
+
+    DEFAULT_BATCH_SIZE = 10000
+    DEFAULT_IDLE_TIMEOUT = 60.0
+    DEFAULT_ACTIVE_TIMEOUT = 600.0
+    DEFAULT_MAX_FLOWS = 100000
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 active_timeout: float = DEFAULT_ACTIVE_TIMEOUT, max_flows: int = DEFAULT_MAX_FLOWS):
+        self._batch_size = batch_size
+        self._idle_timeout = idle_timeout
+        self._active_timeout = active_timeout
+        self._max_flows = max_flows
+
+    def analyze(self, pcap_file) -> List[dict]:
+        stats = []
+        for batch in self.iter_analyze(pcap_file):
+            stats.extend(batch)
+
+        return stats
+
+    def iter_analyze(self, pcap_file, batch_size: Optional[int] = None) -> Iterator[List[dict]]:
+        # Потоки отдаются по мере завершения (таймаут или вытеснение), а не в конце файла
+        batch_size = batch_size or self._batch_size
+        flow_table = FlowTable(self._idle_timeout, self._active_timeout, self._max_flows)
+        decoder = FlowPacketDecoder()
+
+        batch = []
+        for frame in PcapFrameReader(pcap_file):
+            packet = decoder.decode(frame)
+            if packet is None:
+                continue
+
+            for flow in flow_table.add(packet):
+                batch.append(flow.to_features())
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        for flow in flow_table.flush():
+            batch.append(flow.to_features())
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
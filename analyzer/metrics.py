@@ -0,0 +1,60 @@
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from core.ml.memory import get_peak_rss_mb
+
+
+STAGE_PARSE = 'parse'
+STAGE_EXTRACT = 'extract'
+STAGE_MODEL_LOAD = 'model_load'
+STAGE_PREDICT = 'predict'
+STAGE_SERIALIZE = 'serialize'
+STAGE_DB_INSERT = 'db_insert'
+STAGES = (STAGE_PARSE, STAGE_EXTRACT, STAGE_MODEL_LOAD, STAGE_PREDICT, STAGE_SERIALIZE, STAGE_DB_INSERT)
+
+COUNTER_PACKETS_PARSED = 'packets_parsed'
+COUNTER_PACKETS_SKIPPED = 'packets_skipped'
+COUNTER_BYTES_PARSED = 'bytes_parsed'
+COUNTER_ROWS_PREDICTED = 'rows_predicted'
+COUNTER_ANALYSES_REUSED = 'analyses_reused'
+COUNTERS = (COUNTER_PACKETS_PARSED, COUNTER_PACKETS_SKIPPED, COUNTER_BYTES_PARSED, COUNTER_ROWS_PREDICTED,
+            COUNTER_ANALYSES_REUSED)
+
+
+class PipelineMetrics:
+
+    # Время по стадиям одного анализа: wall - по часам, cpu - процессорное время текущего потока
+    def __init__(self):
+        self.wall_seconds = defaultdict(float)
+        self.cpu_seconds = defaultdict(float)
+        self.counters = Counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add_time(self, name: str, wall_seconds: float, cpu_seconds: float):
+        self.wall_seconds[name] += wall_seconds
+        self.cpu_seconds[name] += cpu_seconds
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def to_dict(self) -> dict:
+        return {
+            'stages': {
+                name: {
+                    'wall_seconds': round(self.wall_seconds[name], 6),
+                    'cpu_seconds': round(self.cpu_seconds[name], 6),
+                }
+                for name in self.wall_seconds
+            },
+            'counters': dict(self.counters),
+            # Пик RSS процесса-воркера за все время его жизни, а не только этого анализа
+            'peak_rss_mb': round(get_peak_rss_mb(), 1),
+        }
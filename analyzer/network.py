@@ -1,207 +1,450 @@
-import base64
+import os
+import time
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Union
 
 from scapy.layers.http import HTTPResponse
 from scapy.layers.inet import IP, UDP, TCP
 from scapy.layers.l2 import Ether
 from scapy.packet import Packet, Raw
-from scapy.utils import rdpcap
+from scapy.utils import PcapReader
+
+from core.analyzer.addresses import IPv4RangeSet
+from core.analyzer.base import BaseAnalyzer, ExtractorPipeline, FeatureExtractor
+from core.analyzer.decoder import Frame, PcapFrameReader, RawPacketDecoder
+from core.analyzer.metrics import (
+    COUNTER_BYTES_PARSED, COUNTER_PACKETS_PARSED, COUNTER_PACKETS_SKIPPED, STAGE_EXTRACT, STAGE_PARSE, PipelineMetrics,
+)
+from core.analyzer.payload import PAYLOAD_FEATURES, get_payload_features
+from core.analyzer.vendors import MacVendorIndex
+
+
+MAC_VENDOR_INDEX = None
+
+PRIVATE_IP_RANGES = IPv4RangeSet([
+    '10.0.0.0/8',
+    '127.0.0.0/8',
+    '172.16.0.0/12',
+    '192.168.0.0/16',
+])
+RESERVED_IP_RANGES = IPv4RangeSet([
+    '0.0.0.0/8',
+    '100.64.0.0/10',
+    '169.254.0.0/16',
+    '192.0.0.0/24',
+    '192.0.2.0/24',
+    '198.18.0.0/15',
+    '198.51.100.0/24',
+    '203.0.113.0/24',
+    '224.0.0.0/4',
+    '240.0.0.0/4',
+])
+SUSPICIOUS_IP_RANGES = None
 
-from core.analyzer.base import BaseAnalyzer
 
+class NetworkUtilsService:
 
-MAC_ADDRESSES = ''
-
+    # Список угроз - файл с IP-адресами или CIDR-блоками по одному в строке, '#' начинает комментарий
+    SUSPICIOUS_IP_LIST_PATH = os.environ.get(
+        'SUSPICIOUS_IP_LIST_PATH', (Path(__file__).parent / 'suspicious-ip.txt').resolve().as_posix()
+    )
 
-class NetworkUtilsService:
+    # Необязательный бинарный кэш индекса OUI для быстрого старта процесса
+    MAC_VENDOR_CACHE_PATH = os.environ.get('MAC_VENDOR_CACHE_PATH')
 
     @staticmethod
-    def is_private_ip(ip_address: str):
-        if ip_address.startswith('127.0.0.'):
-            return True
-        if ip_address.startswith('10.'):
-            return True
-        if ip_address.startswith('172.1') or ip_address.startswith('172.2') or ip_address.startswith('172.3'):
-            return True
-        if ip_address.startswith('192.168.'):
-            return True
-
-        return False
+    @lru_cache(maxsize=65536)
+    def is_private_ip(ip_address: Union[int, str]):
+        return ip_address in PRIVATE_IP_RANGES
 
     @staticmethod
-    def is_public_ip(ip_address: str):
+    def is_public_ip(ip_address: Union[int, str]):
         return not NetworkUtilsService.is_private_ip(ip_address)
 
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def is_reserved_ip(ip_address: Union[int, str]):
+        return ip_address in RESERVED_IP_RANGES
+
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def is_suspicious_ip(ip_address: Union[int, str]):
+        return ip_address in NetworkUtilsService.get_suspicious_ip_ranges()
+
+    @staticmethod
+    def get_suspicious_ip_ranges() -> IPv4RangeSet:
+        global SUSPICIOUS_IP_RANGES
+
+        if SUSPICIOUS_IP_RANGES is None:
+            SUSPICIOUS_IP_RANGES = IPv4RangeSet.from_file(NetworkUtilsService.SUSPICIOUS_IP_LIST_PATH)
+
+        return SUSPICIOUS_IP_RANGES
+
+    @staticmethod
+    def load_suspicious_ip_list(path: str):
+        global SUSPICIOUS_IP_RANGES
+
+        SUSPICIOUS_IP_RANGES = IPv4RangeSet.from_file(path)
+        NetworkUtilsService.is_suspicious_ip.cache_clear()
+
     @staticmethod
     def get_suspicious_ip_list():
-        return [
-            '103.251.167.20',
-            '104.192.3.74',
-            '107.1.241.169',
-            '109.70.100.6',
-            '109.70.100.70',
-            '12.23.16.117',
-            '12.237.159.13',
-            '136.158.8.40',
-            '136.35.64.112',
-            '142.79.75.74',
-            '150.221.171.57',
-            '178.20.55.16',
-            '184.81.56.182',
-            '185.181.61.115',
-            '185.220.100.251',
-            '185.220.102.252',
-            '185.220.103.114',
-            '185.233.100.23',
-            '185.243.218.204',
-            '192.42.116.175',
-            '192.42.116.180',
-            '192.42.116.181',
-            '192.42.116.182',
-            '192.42.116.183',
-            '192.42.116.185',
-            '192.42.116.186',
-            '192.42.116.187',
-            '192.42.116.188',
-            '192.42.116.191',
-            '192.42.116.193',
-            '192.42.116.216',
-            '192.42.116.218',
-            '195.176.3.20',
-            '198.96.155.3',
-            '209.163.98.28',
-            '23.137.251.61',
-            '35.142.132.202',
-            '38.97.116.244',
-            '45.134.225.36',
-            '45.141.215.21',
-            '47.147.249.100',
-            '47.36.117.128',
-            '67.197.64.67',
-            '69.162.231.243',
-            '69.245.177.224',
-            '71.15.71.18',
-            '71.239.208.188',
-            '71.80.114.24',
-            '73.95.1.137',
-            '76.198.90.121',
-            '76.34.17.67',
-        ]
+        with open(NetworkUtilsService.SUSPICIOUS_IP_LIST_PATH, 'r') as f:
+            return [line.split('#', 1)[0].strip() for line in f if line.split('#', 1)[0].strip()]
 
     @staticmethod
-    def is_authorized_mac_oui(mac_address: str):
-        global MAC_ADDRESSES
+    def get_mac_vendor_index() -> MacVendorIndex:
+        global MAC_VENDOR_INDEX
 
-        if not MAC_ADDRESSES:
+        if MAC_VENDOR_INDEX is None:
             path = (Path(__file__).parent / 'mac-vendor.txt').resolve().as_posix()
-            with open(path, 'r') as f:
-                MAC_ADDRESSES = f.read()
+            MAC_VENDOR_INDEX = MacVendorIndex.load(path, cache_path=NetworkUtilsService.MAC_VENDOR_CACHE_PATH)
 
-        return mac_address in MAC_ADDRESSES
+        return MAC_VENDOR_INDEX
 
+    @staticmethod
+    def is_authorized_mac_oui(mac_address: Union[str, bytes, int]):
+        return mac_address in NetworkUtilsService.get_mac_vendor_index()
 
-class NetworkAnalyzer(BaseAnalyzer):
+    @staticmethod
+    def get_mac_vendor(mac_address: Union[str, bytes, int]) -> Optional[str]:
+        return NetworkUtilsService.get_mac_vendor_index().get_vendor(mac_address)
 
-    def analyze(self, pcap_file_path: str):
-        packets = rdpcap(pcap_file_path)
 
-        stats = []
+class EtherExtractor(FeatureExtractor):
 
-        for pkt in packets:
-            pkt_data = {}
+    NAME = 'ether'
+    COLUMNS = (
+        ('ether_src', 'bool'),
+        ('ether_dst', 'bool'),
+    )
 
-            ether_data = self._load_link_lvl(pkt)
-            if not ether_data:
-                # Битый пакет - пропускаем
-                continue
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        ether_pkt = context['ether']
+        pkt_data['ether_src'] = NetworkUtilsService.is_authorized_mac_oui(str(ether_pkt.src))
+        pkt_data['ether_dst'] = NetworkUtilsService.is_authorized_mac_oui(str(ether_pkt.dst))
+
+
+class LayersExtractor(FeatureExtractor):
+
+    # Слои ищутся один раз на пакет, остальные извлекатели берут их из контекста
+    NAME = 'layers'
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        context['ip'] = pkt.getlayer(IP)
+        context['tcp'] = pkt.getlayer(TCP)
+        context['udp'] = pkt.getlayer(UDP) if context['tcp'] is None else None
+
+
+class IpHeaderExtractor(FeatureExtractor):
+
+    NAME = 'ip_header'
+    COLUMNS = (
+        ('version', 'float64'),
+        ('ihl', 'float64'),
+        ('tos', 'float64'),
+        ('len', 'float64'),
+        ('id', 'float64'),
+        ('frag', 'float64'),
+        ('ttl', 'float64'),
+        ('proto', 'float64'),
+        ('chksum', 'float64'),
+    )
+    REQUIRES = ('layers',)
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        ip_pkt = context['ip']
+        if ip_pkt is None:
+            return
+
+        pkt_data.update(
+            version=ip_pkt.version,
+            ihl=ip_pkt.ihl,
+            tos=ip_pkt.tos,
+            len=ip_pkt.len,
+            id=ip_pkt.id,
+            frag=ip_pkt.frag,
+            ttl=ip_pkt.ttl,
+            proto=ip_pkt.proto,
+            chksum=ip_pkt.chksum,
+        )
+
+
+class IpAddressesExtractor(FeatureExtractor):
+
+    NAME = 'ip_addresses'
+    REQUIRES = ('layers',)
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        ip_pkt = context['ip']
+        context['ip_addresses'] = (str(ip_pkt.src), str(ip_pkt.dst)) if ip_pkt is not None else None
+
+
+class IpPrivateExtractor(FeatureExtractor):
+
+    NAME = 'ip_private'
+    COLUMNS = (
+        ('is_src_ip_private', 'float64'),
+        ('is_dest_ip_private', 'float64'),
+    )
+    REQUIRES = ('ip_addresses',)
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        if context['ip_addresses'] is not None:
+            src, dst = context['ip_addresses']
+            pkt_data['is_src_ip_private'] = NetworkUtilsService.is_private_ip(src)
+            pkt_data['is_dest_ip_private'] = NetworkUtilsService.is_private_ip(dst)
+
+
+class IpSuspiciousExtractor(FeatureExtractor):
+
+    NAME = 'ip_suspicious'
+    COLUMNS = (
+        ('is_src_suspicious', 'float64'),
+        ('is_dst_suspicious', 'float64'),
+    )
+    REQUIRES = ('ip_addresses',)
 
-            network_data = self._load_network_lvl(pkt)
-            transport_data = self._load_transport_lvl(pkt)
-            application_data = self._load_application_lvl(pkt)
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        if context['ip_addresses'] is not None:
+            src, dst = context['ip_addresses']
+            pkt_data['is_src_suspicious'] = NetworkUtilsService.is_suspicious_ip(src)
+            pkt_data['is_dst_suspicious'] = NetworkUtilsService.is_suspicious_ip(dst)
+
+
+class PortsExtractor(FeatureExtractor):
+
+    NAME = 'ports'
+    COLUMNS = (
+        ('src_port', 'float64'),
+        ('dest_port', 'float64'),
+    )
+    REQUIRES = ('layers',)
 
-            has_payload = bool(application_data.get('payload'))
-            if has_payload:
-                application_data.pop('payload')
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        transport_pkt = context['tcp'] or context['udp']
+        if transport_pkt is not None:
+            pkt_data['src_port'] = transport_pkt.sport
+            pkt_data['dest_port'] = transport_pkt.dport
 
-            pkt_data.update(ether_data)
-            pkt_data.update(network_data)
-            pkt_data.update(transport_data)
-            pkt_data.update(application_data)
 
-            pkt_data.update({
-                'packet_length': len(pkt),
-                'has_file_payload': has_payload,
-            })
+class TcpHeaderExtractor(FeatureExtractor):
+
+    NAME = 'tcp_header'
+    COLUMNS = (
+        ('seq', 'float64'),
+        ('ack', 'float64'),
+        ('dataofs', 'float64'),
+        ('reserved', 'float64'),
+        ('window', 'float64'),
+        ('tcp_chksum', 'float64'),
+        ('urgptr', 'float64'),
+    )
+    REQUIRES = ('layers',)
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        tcp_pkt = context['tcp']
+        if tcp_pkt is None:
+            return
+
+        pkt_data.update(
+            seq=tcp_pkt.seq,
+            ack=tcp_pkt.ack,
+            dataofs=tcp_pkt.dataofs,
+            reserved=tcp_pkt.reserved,
+            window=tcp_pkt.window,
+            tcp_chksum=tcp_pkt.chksum,
+            urgptr=tcp_pkt.urgptr,
+        )
 
-            stats.append(pkt_data)
+
+class UdpHeaderExtractor(FeatureExtractor):
+
+    NAME = 'udp_header'
+    COLUMNS = (
+        ('udp_len', 'float64'),
+        ('udp_chksum', 'float64'),
+    )
+    REQUIRES = ('layers',)
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        udp_pkt = context['udp']
+        if udp_pkt is not None:
+            pkt_data['udp_len'] = udp_pkt.len
+            pkt_data['udp_chksum'] = udp_pkt.chksum
+
+
+class LengthExtractor(FeatureExtractor):
+
+    NAME = 'length'
+    COLUMNS = (
+        ('packet_length', 'int64'),
+    )
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        pkt_data['packet_length'] = len(pkt)
+
+
+class HttpFileExtractor(FeatureExtractor):
+
+    NAME = 'http_file'
+    COLUMNS = (
+        ('has_file_payload', 'bool'),
+    )
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        response = pkt.getlayer(HTTPResponse)
+        pkt_data['has_file_payload'] = Raw in pkt and response is not None and bool(response.load)
+
+
+class PayloadExtractor(FeatureExtractor):
+
+    # Нагрузка берется из исходных байт транспортного уровня, которые scapy хранит после разбора
+    NAME = 'payload'
+    COLUMNS = PAYLOAD_FEATURES
+    REQUIRES = ('layers',)
+
+    def extract(self, pkt: Packet, context: dict, pkt_data: dict):
+        if context['tcp'] is not None:
+            tcp_pkt = context['tcp']
+            pkt_data.update(get_payload_features(tcp_pkt.original, tcp_pkt.dataofs * 4, len(tcp_pkt.original)))
+        elif context['udp'] is not None:
+            udp_pkt = context['udp']
+            pkt_data.update(get_payload_features(udp_pkt.original, 8, len(udp_pkt.original)))
+
+
+class NetworkAnalyzer(BaseAnalyzer):
+
+    ENGINE_SCAPY = 'scapy'
+    ENGINE_RAW = 'raw'
+    ENGINES = (ENGINE_SCAPY, ENGINE_RAW)
+
+    SCHEMA_VERSION = 4
+    EXTRACTORS = (
+        EtherExtractor(),
+        LayersExtractor(),
+        IpHeaderExtractor(),
+        IpAddressesExtractor(),
+        IpPrivateExtractor(),
+        IpSuspiciousExtractor(),
+        PortsExtractor(),
+        TcpHeaderExtractor(),
+        UdpHeaderExtractor(),
+        LengthExtractor(),
+        HttpFileExtractor(),
+        PayloadExtractor(),
+    )
+    FEATURES = BaseAnalyzer.get_extractor_features(EXTRACTORS)
+
+    DEFAULT_BATCH_SIZE = 10000
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, engine: str = ENGINE_SCAPY,
+                 features: Optional[Iterable[str]] = None):
+        if engine not in self.ENGINES:
+            raise ValueError(f'Unknown analyzer engine: {engine}')
+
+        self._batch_size = batch_size
+        self._engine = engine
+        # features - признаки, которые нужны потребителю (например, модели): извлекатели остальных не запускаются
+        self._extractor_pipeline = ExtractorPipeline(self.EXTRACTORS, features)
+
+    def get_selected_feature_names(self) -> List[str]:
+        selected = set(self._extractor_pipeline.columns)
+        return [feature for feature in self.get_feature_names() if feature in selected]
+
+    def get_raw_decoder(self) -> RawPacketDecoder:
+        # Движок raw разбирает заголовки одним unpack, пропускаются только дорогие части: поиск по таблицам
+        # OUI и IP-диапазонов и разбор нагрузки. Лишние колонки заголовков отбрасывает to_columnar
+        names = self._extractor_pipeline.names
+        return RawPacketDecoder(
+            mac_oui_checker=NetworkUtilsService.is_authorized_mac_oui if 'ether' in names else None,
+            private_ip_checker=NetworkUtilsService.is_private_ip if 'ip_private' in names else None,
+            suspicious_ip_checker=NetworkUtilsService.is_suspicious_ip if 'ip_suspicious' in names else None,
+            with_payload='payload' in names,
+        )
+
+    def analyze(self, pcap_file) -> List[dict]:
+        stats = []
+        for batch in self.iter_analyze(pcap_file):
+            stats.extend(batch)
 
         return stats
 
-    def _load_link_lvl(self, pkt: Packet) -> dict:
-        link_lvl_data = {}
-
-        if Ether in pkt:
-            ether_pkt = pkt[Ether]
-            link_lvl_data.update(dict(
-                ether_src=NetworkUtilsService.is_authorized_mac_oui(str(ether_pkt.src)[:8]),
-                ether_dst=NetworkUtilsService.is_authorized_mac_oui(str(ether_pkt.dst)[:8]),
-            ))
-
-        return link_lvl_data
-
-    def _load_network_lvl(self, pkt: Packet) -> dict:
-        network_lvl_data = {}
-
-        if IP in pkt:
-            ip_pkt = pkt[IP]
-            network_lvl_data.update(dict(
-                version=ip_pkt.version,
-                ihl=ip_pkt.ihl,
-                tos=ip_pkt.tos,
-                len=ip_pkt.len,
-                id=ip_pkt.id,
-                frag=ip_pkt.frag,
-                ttl=ip_pkt.ttl,
-                proto=ip_pkt.proto,
-                chksum=ip_pkt.chksum,
-                is_src_ip_private=NetworkUtilsService.is_private_ip(str(ip_pkt.src)),
-                is_dest_ip_private=NetworkUtilsService.is_private_ip(str(ip_pkt.dst)),
-            ))
-
-        return network_lvl_data
-
-    def _load_transport_lvl(self, pkt: Packet) -> dict:
-        transport_lvl_data = {}
-
-        if TCP in pkt:
-            tcp_pkt = pkt[TCP]
-            transport_lvl_data.update(dict(
-                src_port=tcp_pkt.sport,
-                dest_port=tcp_pkt.dport,
-                seq=tcp_pkt.seq,
-                ack=tcp_pkt.ack,
-                dataofs=tcp_pkt.dataofs,
-                reserved=tcp_pkt.reserved,
-                window=tcp_pkt.window,
-                tcp_chksum=tcp_pkt.chksum,
-                urgptr=tcp_pkt.urgptr,
-            ))
-        elif UDP in pkt:
-            udp_pkt = pkt[UDP]
-            transport_lvl_data.update(dict(
-                src_port=udp_pkt.sport,
-                dest_port=udp_pkt.dport,
-                udp_len=udp_pkt.len,
-                udp_chksum=udp_pkt.chksum,
-            ))
-
-        return transport_lvl_data
-
-    def _load_application_lvl(self, pkt: Packet) -> dict:
-        application_lvl_data = {}
-
-        if Raw in pkt and HTTPResponse in pkt:
-            payload = pkt[HTTPResponse].load
-            application_lvl_data['payload'] = base64.b64encode(payload)
-
-        return application_lvl_data
+    def iter_analyze(self, pcap_file, batch_size: Optional[int] = None,
+                     metrics: Optional[PipelineMetrics] = None) -> Iterator[List[dict]]:
+        # pcap_file может быть путем или файловым объектом (например, загруженный файл Django).
+        # PcapReader читает пакеты по одному и сам определяет формат pcap/pcapng
+        batch_size = batch_size or self._batch_size
+
+        batch = []
+        for pkt_data in self._iter_packets_data(pcap_file, metrics):
+            if pkt_data is None:
+                continue
+
+            batch.append(pkt_data)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _iter_packets_data(self, pcap_file, metrics: Optional[PipelineMetrics] = None) -> Iterator[Optional[dict]]:
+        if self._engine == self.ENGINE_RAW:
+            decoder = self.get_raw_decoder()
+            yield from self._iter_extracted(PcapFrameReader(pcap_file), decoder.decode, self._get_frame_size, metrics)
+        else:
+            with PcapReader(pcap_file) as packets:
+                yield from self._iter_extracted(packets, self._analyze_packet, len, metrics)
+
+    @staticmethod
+    def _get_frame_size(frame: Frame) -> int:
+        return frame.end - frame.start
+
+    @staticmethod
+    def _iter_extracted(packets: Iterable, extract: Callable, get_size: Callable,
+                        metrics: Optional[PipelineMetrics] = None) -> Iterator[Optional[dict]]:
+        if metrics is None:
+            for packet in packets:
+                yield extract(packet)
+            return
+
+        # Разбор и извлечение признаков чередуются попакетно, время стадий копится отдельно.
+        # Время потребителя между yield не учитывается
+        parse_wall = parse_cpu = extract_wall = extract_cpu = 0.0
+        parsed = skipped = size = 0
+        packets = iter(packets)
+        try:
+            while True:
+                wall, cpu = time.perf_counter(), time.thread_time()
+                packet = next(packets, None)
+                parsed_wall, parsed_cpu = time.perf_counter(), time.thread_time()
+                parse_wall += parsed_wall - wall
+                parse_cpu += parsed_cpu - cpu
+                if packet is None:
+                    break
+
+                pkt_data = extract(packet)
+                extract_wall += time.perf_counter() - parsed_wall
+                extract_cpu += time.thread_time() - parsed_cpu
+
+                parsed += 1
+                size += get_size(packet)
+                if pkt_data is None:
+                    skipped += 1
+                yield pkt_data
+        finally:
+            metrics.add_time(STAGE_PARSE, parse_wall, parse_cpu)
+            metrics.add_time(STAGE_EXTRACT, extract_wall, extract_cpu)
+            metrics.count(COUNTER_PACKETS_PARSED, parsed)
+            metrics.count(COUNTER_PACKETS_SKIPPED, skipped)
+            metrics.count(COUNTER_BYTES_PARSED, size)
+
+    def _analyze_packet(self, pkt: Packet) -> Optional[dict]:
+        ether_pkt = pkt.getlayer(Ether)
+        if ether_pkt is None:
+            # Битый пакет - пропускаем
+            return None
+
+        return self._extractor_pipeline.extract(pkt, {'ether': ether_pkt})
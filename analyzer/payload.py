@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+
+
+# Сколько байт полезной нагрузки пакета разбирается на энтропию и долю печатных символов
+PAYLOAD_INSPECT_BYTES = 512
+
+MAGIC_NONE = 0
+# Сигнатуры типов файлов по первым байтам: код сохраняется в признак payload_magic
+MAGIC_SIGNATURES = (
+    (b'MZ', 1),  # исполняемый файл Windows
+    (b'\x7fELF', 2),
+    (b'%PDF', 3),
+    (b'PK\x03\x04', 4),  # zip, jar, документы Office
+    (b'\x1f\x8b', 5),  # gzip
+    (b'\x89PNG', 6),
+    (b'\xff\xd8\xff', 7),  # jpeg
+    (b'GIF8', 8),
+    (b'#!', 9),  # скрипт
+    (b'\xca\xfe\xba\xbe', 10),  # класс Java
+    (b'Rar!', 11),
+    (b'7z\xbc\xaf', 12),
+)
+MAGIC_SIGNATURES_BY_FIRST_BYTE = {}
+for _signature, _magic in MAGIC_SIGNATURES:
+    MAGIC_SIGNATURES_BY_FIRST_BYTE.setdefault(_signature[0], []).append((_signature, _magic))
+
+HTTP_RESPONSE_PREFIX = b'HTTP/'
+HTTP_HEADERS_END = b'\r\n\r\n'
+
+PRINTABLE_BYTES = np.zeros(256, dtype=np.int64)
+PRINTABLE_BYTES[32:127] = 1
+PRINTABLE_BYTES[[9, 10, 13]] = 1
+
+PAYLOAD_FEATURES = (
+    ('payload_length', 'int64'),
+    ('payload_entropy', 'float64'),
+    ('payload_printable_ratio', 'float64'),
+    ('payload_magic', 'int64'),
+)
+
+
+def _get_count_log_table(max_bytes: int) -> np.ndarray:
+    counts = np.arange(max_bytes + 1, dtype=np.float64)
+    counts[0] = 1
+    return counts * np.log2(counts)
+
+
+COUNT_LOG_TABLE = _get_count_log_table(PAYLOAD_INSPECT_BYTES)
+
+
+def get_payload_features(buffer, offset: int, end: int) -> dict:
+    # buffer - байты кадра целиком (bytes или mmap файла захвата): нагрузка не копируется,
+    # numpy смотрит на тот же буфер, гистограмма байт считается за один проход
+    length = max(end - offset, 0)
+    if not length:
+        return {'payload_length': 0}
+
+    inspected = min(length, PAYLOAD_INSPECT_BYTES)
+    counts = np.bincount(np.frombuffer(buffer, dtype=np.uint8, count=inspected, offset=offset), minlength=256)
+
+    # H = log2(n) - sum(c * log2(c)) / n, значения c * log2(c) посчитаны заранее
+    entropy = math.log2(inspected) - float(COUNT_LOG_TABLE.take(counts).sum()) / inspected
+    return {
+        'payload_length': length,
+        'payload_entropy': max(entropy, 0.0),
+        'payload_printable_ratio': int(counts.dot(PRINTABLE_BYTES)) / inspected,
+        'payload_magic': get_magic(buffer, offset, offset + inspected),
+    }
+
+
+def get_magic(buffer, offset: int, end: int) -> int:
+    if offset >= end:
+        return MAGIC_NONE
+
+    # В HTTP-ответе файл начинается после заголовков
+    if buffer[offset] == HTTP_RESPONSE_PREFIX[0] and _starts_with(buffer, offset, end, HTTP_RESPONSE_PREFIX):
+        headers_end = buffer.find(HTTP_HEADERS_END, offset, end)
+        if headers_end == -1 or headers_end + len(HTTP_HEADERS_END) >= end:
+            return MAGIC_NONE
+        offset = headers_end + len(HTTP_HEADERS_END)
+
+    # По первому байту отбираются сигнатуры-кандидаты, обычно их нет ни одной
+    for signature, magic in MAGIC_SIGNATURES_BY_FIRST_BYTE.get(buffer[offset], ()):
+        if _starts_with(buffer, offset, end, signature):
+            return magic
+
+    return MAGIC_NONE
+
+
+def _starts_with(buffer, offset: int, end: int, prefix: bytes) -> bool:
+    # find вместо среза: у bytes и mmap он работает без копирования
+    return buffer.find(prefix, offset, min(end, offset + len(prefix))) == offset
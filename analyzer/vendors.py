@@ -0,0 +1,71 @@
+import marshal
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+
+MAC_SEPARATORS = str.maketrans('', '', ':-. ')
+
+
+class MacVendorIndex:
+
+    def __init__(self, vendors: Dict[int, str]):
+        # Ключ - 24-битный OUI (первые три байта MAC-адреса) в виде числа
+        self._vendors = vendors
+
+    @staticmethod
+    def to_oui(mac_address: Union[str, bytes, int]) -> Optional[int]:
+        if isinstance(mac_address, int):
+            return mac_address
+        if isinstance(mac_address, (bytes, bytearray, memoryview)):
+            return int.from_bytes(mac_address[:3], 'big') if len(mac_address) >= 3 else None
+
+        oui = mac_address.translate(MAC_SEPARATORS)[:6]
+        try:
+            return int(oui, 16) if len(oui) == 6 else None
+        except ValueError:
+            return None
+
+    @classmethod
+    def from_file(cls, path: str) -> 'MacVendorIndex':
+        vendors = {}
+        with open(path, 'r') as f:
+            for line in f:
+                oui, _, vendor = line.rstrip('\n').partition('\t')
+                oui = cls.to_oui(oui.strip())
+                if oui is not None:
+                    vendors[oui] = vendor.strip()
+
+        return cls(vendors)
+
+    @classmethod
+    def load(cls, path: str, cache_path: Optional[str] = None) -> 'MacVendorIndex':
+        if cache_path and Path(cache_path).exists() and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with open(cache_path, 'rb') as f:
+                return cls(marshal.load(f))
+
+        index = cls.from_file(path)
+        if cache_path:
+            index.dump_cache(cache_path)
+
+        return index
+
+    def dump_cache(self, cache_path: str):
+        # marshal - самый быстрый для загрузки формат словаря int -> str из стандартной библиотеки
+        cache_dir = Path(cache_path).parent
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(self._vendors, f)
+        os.replace(tmp_path, cache_path)
+
+    def get_vendor(self, mac_address: Union[str, bytes, int]) -> Optional[str]:
+        return self._vendors.get(self.to_oui(mac_address))
+
+    def __contains__(self, mac_address: Union[str, bytes, int]) -> bool:
+        return self.to_oui(mac_address) in self._vendors
+
+    def __len__(self) -> int:
+        return len(self._vendors)
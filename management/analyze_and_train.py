@@ -1,64 +1,153 @@
+import argparse
+import os
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
+from typing import List, Optional, Tuple
 
+import pandas as pd
 from sklearn.metrics import accuracy_score
 
 from core import DatasetType
-from core.analyzer import base, network
+from core.analyzer import network
+from core.analyzer.cache import FeatureCache
+from core.analyzer.flows import FlowAnalyzer
+from core.ml.dataset import DataSetMixin
+from core.ml.evaluation import Evaluator
+from core.ml.registry import ModelRegistry
+from core.ml.store import DatasetStore
 from core.ml.trainer import Trainer
 from core.ml.predictor import Predictor
 
 
-# Load datasets
-base_path = Path() / 'core' / 'dataset' / 'network'
-
-malicious_path = (base_path / 'malicious').resolve()
-benign_path = (base_path / 'benign').resolve()
-
-malicious_paths = []
-for path in malicious_path.iterdir():
-    malicious_paths.append(str(path.resolve().as_posix()))
-
-benign_paths = []
-for path in benign_path.iterdir():
-    benign_paths.append(str(path.resolve().as_posix()))
-
-# Analyze
-analyzer = network.NetworkAnalyzer()
-
-malicious_results = []
-for path in malicious_paths:
-    result = analyzer.analyze(path)
-    malicious_results.extend(result)
-
-benign_results = []
-for path in benign_paths:
-    print('path', path)
-    try:
-        result = analyzer.analyze(path)
-        benign_results.extend(result)
-    except Exception as exc:
-        print('exc', exc)
-
-# Dump
-dataset_path = str(DatasetType.get_dataset_path(DatasetType.NETWORK).as_posix())
-base.dump_analysis(malicious_results, dataset_path, is_malicious=1, append=False)
-
-base.dump_analysis(benign_results, dataset_path, is_malicious=0, append=True)
-
-
-# Train
-trainer = Trainer(DatasetType.NETWORK, output_feature='is_malicious')
-trainer.train()
-
-# Predict
-network_analyzer = network.NetworkAnalyzer()
-
-pcap_file_path = (Path() / 'core' / 'dataset' / 'network' / 'malicious_example.pcap').resolve()
-analysis = network_analyzer.analyze(str(pcap_file_path.as_posix()))
-
-predictor = Predictor(DatasetType.NETWORK, output_feature='is_malicious')
-prediction = predictor.predict(analysis)
-
-# Make assurance and estimate clarity of prediction
-accuracy = accuracy_score([1] * len(analysis), prediction)
-print(accuracy)
+# Пакетный режим - строка на каждый пакет, потоковый - строка на каждый поток (5-tuple)
+ANALYZERS = {
+    'packet': network.NetworkAnalyzer,
+    'flow': FlowAnalyzer,
+}
+
+
+def collect_captures(base_path: Path) -> List[Tuple[str, int]]:
+    captures = []
+    for directory, is_malicious in (('malicious', 1), ('benign', 0)):
+        paths = sorted((base_path / directory).resolve().iterdir())
+        captures.extend((str(path.resolve().as_posix()), is_malicious) for path in paths)
+
+    return captures
+
+
+def analyze_capture(path: str, cache_dir: Optional[str] = None, mode: str = 'packet') -> pd.DataFrame:
+    analyzer = ANALYZERS[mode]()
+    if cache_dir:
+        return FeatureCache(cache_dir, analyzer).analyze(path)
+
+    return analyzer.analyze_columnar(path)
+
+
+def build_dataset(captures: List[Tuple[str, int]], dataset_path: str, workers: Optional[int] = None,
+                  cache_dir: Optional[str] = None, mode: str = 'packet') -> List[str]:
+    analyzer_class = ANALYZERS[mode]
+    dtypes = dict(analyzer_class.FEATURES)
+    store = DatasetStore(DatasetStore.get_store_path(dataset_path))
+    store.create(
+        [(feature, dtypes[feature]) for feature in sorted(dtypes)] + [('is_malicious', 'int8')],
+        schema_version=analyzer_class.SCHEMA_VERSION,
+    )
+
+    if cache_dir:
+        FeatureCache(cache_dir, analyzer_class()).prune()
+
+    failed_paths = []
+    # В работе и в ожидании записи не больше окна файлов: признаки в родителе не копятся без предела
+    window = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor, store.writer() as writer:
+        futures = {}
+        finished = {}
+        next_submit = next_index = 0
+        while next_index < len(captures):
+            while next_submit < len(captures) and next_submit < next_index + window:
+                path, _ = captures[next_submit]
+                futures[executor.submit(analyze_capture, path, cache_dir, mode)] = next_submit
+                next_submit += 1
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                path, _ = captures[index]
+                try:
+                    finished[index] = future.result()
+                    print('analyzed', path)
+                except Exception:  # noqa
+                    print('failed', path)
+                    traceback.print_exc()
+                    failed_paths.append(path)
+                    finished[index] = None
+                # Future держит DataFrame в себе - без ссылки на него результат освобождается после записи
+                del futures[future]
+
+            # Результаты пишутся в порядке списка файлов, а не завершения задач - датасет детерминирован
+            while next_index in finished:
+                result = finished.pop(next_index)
+                if result is not None:
+                    _, is_malicious = captures[next_index]
+                    writer.write(result, is_malicious=is_malicious)
+                next_index += 1
+
+    return failed_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze network captures, build the dataset and train the model')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of analysis processes')
+    parser.add_argument('--cache-dir', default=str(Path() / 'core' / 'dataset' / 'cache'),
+                        help='Directory of cached capture features')
+    parser.add_argument('--no-cache', action='store_true', help='Analyze every capture from scratch')
+    parser.add_argument('--mode', choices=sorted(ANALYZERS), default='packet',
+                        help='Classify single packets or aggregated flows')
+    parser.add_argument('--classifier', choices=Trainer.CLASSIFIERS, default=Trainer.CLASSIFIER_TREE,
+                        help='Decision tree, random forest or incrementally trained linear model')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='Training memory budget in MB, larger datasets are subsampled')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Cores used to train the random forest')
+    args = parser.parse_args()
+    analyzer_class = ANALYZERS[args.mode]
+    variant = analyzer_class.DATASET_VARIANT
+
+    # Load datasets
+    base_path = Path() / 'core' / 'dataset' / 'network'
+    captures = collect_captures(base_path)
+
+    # Analyze and dump
+    dataset_path = str(DataSetMixin.get_dataset_path(DatasetType.NETWORK, variant).as_posix())
+    cache_dir = None if args.no_cache else args.cache_dir
+    failed_paths = build_dataset(captures, dataset_path, workers=args.workers, cache_dir=cache_dir, mode=args.mode)
+    if failed_paths:
+        print('failed captures', len(failed_paths), failed_paths)
+
+    # Train
+    trainer = Trainer(DatasetType.NETWORK, output_feature='is_malicious', variant=variant, classifier=args.classifier,
+                      memory_budget_mb=args.memory_budget, n_jobs=args.n_jobs)
+    report = trainer.train()
+    print('trained', report)
+    if report['over_budget']:
+        print(f'peak memory {report["peak_memory_mb"]} MB exceeds the budget {report["memory_budget_mb"]} MB')
+
+    # Evaluate on the held-out split
+    artifact = ModelRegistry.get(DatasetType.NETWORK, output_feature='is_malicious', variant=variant)
+    evaluator = Evaluator(DatasetType.NETWORK, output_feature='is_malicious', variant=variant)
+    print('held-out', evaluator.evaluate(artifact.model, artifact.features))
+
+    # Predict
+    pcap_file_path = (base_path / 'malicious_example.pcap').resolve()
+    analysis = analyzer_class().analyze_columnar(str(pcap_file_path.as_posix()))
+
+    predictor = Predictor(DatasetType.NETWORK, output_feature='is_malicious', variant=variant)
+    prediction = predictor.predict(analysis)
+
+    # Make assurance and estimate clarity of prediction
+    accuracy = accuracy_score([1] * len(analysis), prediction)
+    print(accuracy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import random
+import timeit
+from pathlib import Path
+
+from core.analyzer import network
+from core.analyzer.vendors import MacVendorIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare MAC OUI lookup cost of substring scan and indexed lookup')
+    parser.add_argument('--packets', type=int, default=2000, help='Number of simulated packets')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = Path(network.__file__).parent / 'mac-vendor.txt'
+
+    rng = random.Random(args.seed)
+    macs = ['%02x:%02x:%02x:%02x:%02x:%02x' % tuple(rng.randrange(256) for _ in range(6)) for _ in range(args.packets)]
+
+    with open(path, 'r') as f:
+        mac_addresses = f.read()
+    # Прежняя реализация: поиск подстроки по всему файлу, по два вызова на пакет
+    substring_time = timeit.timeit(lambda: [mac[:8] in mac_addresses for mac in macs for _ in range(2)], number=1)
+
+    load_time = timeit.timeit(lambda: MacVendorIndex.from_file(str(path)), number=1)
+    index = MacVendorIndex.from_file(str(path))
+    index_time = timeit.timeit(lambda: [mac in index for mac in macs for _ in range(2)], number=10) / 10
+
+    print('entries', len(index))
+    print('index load, s', round(load_time, 4))
+    print('substring scan per packet, us', round(substring_time / args.packets * 10 ** 6, 3))
+    print('indexed lookup per packet, us', round(index_time / args.packets * 10 ** 6, 3))
+
+
+if __name__ == '__main__':
+    main()
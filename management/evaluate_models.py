@@ -0,0 +1,46 @@
+import argparse
+
+import pandas as pd
+
+from core import DatasetType
+from core.ml.evaluation import Evaluator
+from core.ml.trainer import Trainer
+
+
+# Признаки, которые зависят от конкретного пакета, а не от поведения устройства
+PACKET_IDENTITY_FEATURES = ('chksum', 'tcp_chksum', 'udp_chksum', 'id', 'seq', 'ack')
+
+
+def get_candidates(features: list, memory_budget_mb: float = None, n_jobs: int = -1) -> dict:
+    options = dict(memory_budget_mb=memory_budget_mb, random_state=0)
+    behavior_features = [feature for feature in features if feature not in PACKET_IDENTITY_FEATURES]
+
+    return {
+        'tree': dict(classifier=Trainer.CLASSIFIER_TREE, **options),
+        'tree-behavior': dict(classifier=Trainer.CLASSIFIER_TREE, features=behavior_features, **options),
+        'forest': dict(classifier=Trainer.CLASSIFIER_FOREST, n_jobs=n_jobs, **options),
+        'sgd': dict(classifier=Trainer.CLASSIFIER_SGD, **options),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare candidate models on the persisted held-out split')
+    parser.add_argument('--variant', default=None, help='Dataset variant, e.g. flow')
+    parser.add_argument('--candidates', nargs='*', help='Candidate names to evaluate, all by default')
+    parser.add_argument('--memory-budget', type=float, default=None, help='Training memory budget in MB')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Cores used to train the random forest')
+    args = parser.parse_args()
+
+    evaluator = Evaluator(DatasetType.NETWORK, output_feature='is_malicious', variant=args.variant)
+    candidates = get_candidates(evaluator.get_input_features(), args.memory_budget, args.n_jobs)
+    if args.candidates:
+        candidates = {name: candidates[name] for name in args.candidates}
+
+    results = evaluator.compare(candidates)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results.to_string(index=False))
+    print('results appended to', evaluator.get_results_path())
+
+
+if __name__ == '__main__':
+    main()
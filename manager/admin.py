@@ -4,3 +4,6 @@ from . import models
 
 admin.site.register(models.Device)
 admin.site.register(models.DeviceAnalyzeHistory)
+admin.site.register(models.DeviceAnalysisStats)
+admin.site.register(models.AnalysisJob)
+admin.site.register(models.PipelineMetric)
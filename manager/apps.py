@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'manager'
+
+    def ready(self):
+        from manager import signals  # noqa
+
+        # Для серверов, которые импортируют приложение до fork воркеров (gunicorn --preload):
+        # прогретые модули и таблицы достаются всем воркерам
+        if getattr(settings, 'MANAGER_WARM_UP', False):
+            from manager import pipeline
+            pipeline.warm_up()
@@ -0,0 +1,353 @@
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from sklearn import tree
+
+from core import DatasetType
+from core.analyzer.base import dump_analysis
+from core.analyzer.network import NetworkAnalyzer
+from core.analyzer.synthetic import SyntheticPcapWriter
+from core.ml.compiled import CompiledTreeModel
+from core.ml.dataset import DataSetMixin
+from core.ml.memory import get_peak_rss_mb
+from core.ml.predictor import Predictor
+from core.ml.registry import ModelArtifact
+from core.ml.store import DatasetStore
+from manager.models import Device, DeviceAnalysisStats, DeviceAnalyzeHistory
+
+
+BENCHMARK_FORMAT_VERSION = 1
+REGRESSION_THRESHOLD = 0.2
+
+# Запускается в свежем интерпретаторе: замеряется холодный старт, а не процесс бенчмарка с уже загруженными модулями
+STARTUP_SCRIPT = '''
+import io, json, time
+started_at = time.perf_counter()
+import django
+django.setup()
+from django.core.management import call_command
+call_command('check', stdout=io.StringIO())
+check_seconds = time.perf_counter() - started_at
+
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from manager import pipeline
+heavy_modules = pipeline.get_loaded_heavy_modules()
+setup_test_environment()
+started_at = time.perf_counter()
+status_code = Client().get(reverse('manager:login_page')).status_code
+first_request_seconds = time.perf_counter() - started_at
+print(json.dumps({
+    'check_seconds': check_seconds, 'first_request_seconds': first_request_seconds,
+    'status_code': status_code, 'heavy_modules': heavy_modules,
+}))
+'''
+
+# Направление сравнения с базовой линией определяется по суффиксу метрики
+HIGHER_IS_BETTER = ('_per_second',)
+LOWER_IS_BETTER = ('_seconds', '_ms', '_mb', '_queries')
+
+
+def _run_measured(func, *args):
+    return func(*args), get_peak_rss_mb()
+
+
+def run_isolated(func, *args):
+    # Каждый этап - в отдельном процессе, иначе ru_maxrss покажет пик самого прожорливого из предыдущих этапов
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        return pool.apply(_run_measured, (func,) + args)
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(max(repeat, 1)):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+
+    return min(timings)
+
+
+def bench_analyzer(pcap_path: str, engine: str) -> dict:
+    started_at = time.perf_counter()
+    analysis = NetworkAnalyzer(engine=engine).analyze_columnar(pcap_path)
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        'packets': len(analysis),
+        'analyze_seconds': round(elapsed, 4),
+        'packets_per_second': round(len(analysis) / elapsed, 1),
+    }
+
+
+def bench_predictor(analysis: pd.DataFrame, repeat: int) -> dict:
+    # Модель обучается тут же на синтетической разметке: бенчмарк не зависит от обученной модели на диске
+    features = NetworkAnalyzer.get_feature_names()
+    data = DataSetMixin.to_feature_matrix(analysis, features)
+    labels = (analysis['packet_length'] > analysis['packet_length'].median()).astype(int).to_numpy()
+    model = tree.DecisionTreeClassifier(max_depth=12, random_state=0).fit(np.nan_to_num(data, nan=0), labels)
+
+    predictor = Predictor(
+        DatasetType.NETWORK, output_feature='is_malicious',
+        artifact=ModelArtifact(model, features, 'is_malicious', 'benchmark', None),
+    )
+    elapsed = best_of(lambda: predictor.predict(analysis), repeat)
+
+    compiled = Predictor(
+        DatasetType.NETWORK, output_feature='is_malicious',
+        artifact=ModelArtifact(CompiledTreeModel.from_sklearn(model), features, 'is_malicious', 'benchmark', None),
+    )
+    compiled_elapsed = best_of(lambda: compiled.predict(analysis), repeat)
+
+    return {
+        'rows': len(analysis),
+        'predict_seconds': round(elapsed, 4),
+        'rows_per_second': round(len(analysis) / elapsed, 1),
+        'compiled_predict_seconds': round(compiled_elapsed, 4),
+        'compiled_rows_per_second': round(len(analysis) / compiled_elapsed, 1),
+    }
+
+
+def bench_predictor_rows(analysis: pd.DataFrame, rows: int, legacy_rows: int = 10000) -> dict:
+    # Пакетный путь на миллионе строк против построчного (pd.Series на каждую строку) до векторизации.
+    # Построчный путь слишком медленный для всего объема - меряется на части строк
+    features = NetworkAnalyzer.get_feature_names()
+    data = DataSetMixin.to_feature_matrix(analysis, features)
+    labels = (analysis['packet_length'] > analysis['packet_length'].median()).astype(int).to_numpy()
+    model = tree.DecisionTreeClassifier(max_depth=12, random_state=0).fit(np.nan_to_num(data, nan=0), labels)
+    predictor = Predictor(
+        DatasetType.NETWORK, output_feature='is_malicious',
+        artifact=ModelArtifact(model, features, 'is_malicious', 'benchmark', None),
+    )
+
+    large = analysis.iloc[np.arange(rows) % len(analysis)].reset_index(drop=True)
+    started_at = time.perf_counter()
+    predictor.predict_batch(large)
+    batch_elapsed = time.perf_counter() - started_at
+
+    records = large.head(legacy_rows).to_dict('records')
+    started_at = time.perf_counter()
+    model.predict(DataSetMixin.to_feature_matrix(pd.DataFrame([pd.Series(record) for record in records]), features))
+    legacy_elapsed = time.perf_counter() - started_at
+
+    batch_rows_per_second = rows / batch_elapsed
+    legacy_rows_per_second = len(records) / legacy_elapsed
+    return {
+        'rows': rows,
+        'batch_seconds': round(batch_elapsed, 4),
+        'batch_rows_per_second': round(batch_rows_per_second, 1),
+        'legacy_rows_per_second': round(legacy_rows_per_second, 1),
+        'speedup': round(batch_rows_per_second / legacy_rows_per_second, 1),
+    }
+
+
+def bench_dataset(analysis: pd.DataFrame, repeat: int) -> dict:
+    rows = len(analysis)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = str(Path(tmp_dir) / 'network.csv')
+        csv_write = best_of(lambda: dump_analysis(analysis, csv_path, is_malicious=1), repeat)
+        csv_read = best_of(
+            lambda: DataSetMixin(DatasetType.NETWORK, 'is_malicious', dataset_path=csv_path)._data, repeat
+        )
+
+        store_path = Path(tmp_dir) / 'store' / 'network.csv'
+        store = DatasetStore(DatasetStore.get_store_path(store_path))
+        schema = [(column, str(dtype)) for column, dtype in analysis.dtypes.items()] + [('is_malicious', 'int8')]
+
+        def write_store():
+            store.create(schema)
+            with store.writer() as writer:
+                writer.write(analysis, is_malicious=1)
+
+        store_write = best_of(write_store, repeat)
+        store_read = best_of(
+            lambda: DataSetMixin(DatasetType.NETWORK, 'is_malicious', dataset_path=str(store_path))._data, repeat
+        )
+
+    return {
+        'rows': rows,
+        'csv_write_rows_per_second': round(rows / csv_write, 1),
+        'csv_read_rows_per_second': round(rows / csv_read, 1),
+        'store_write_rows_per_second': round(rows / store_write, 1),
+        'store_read_rows_per_second': round(rows / store_read, 1),
+    }
+
+
+def measure_startup() -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    started_at = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    stats = json.loads(output.strip().splitlines()[-1])
+    stats['process_seconds'] = time.perf_counter() - started_at
+
+    if stats['status_code'] != 200:
+        raise RuntimeError(f'First request responded with {stats["status_code"]}')
+    return stats
+
+
+def bench_startup(repeat: int) -> dict:
+    # Лучший из запусков по каждой метрике: холодный старт сильно зависит от кеша файловой системы
+    runs = [measure_startup() for _ in range(max(repeat, 1))]
+    return {
+        'process_seconds': round(min(run['process_seconds'] for run in runs), 4),
+        'check_seconds': round(min(run['check_seconds'] for run in runs), 4),
+        'first_request_ms': round(min(run['first_request_seconds'] for run in runs) * 1000, 2),
+        # Список, а не число: в сравнение с базовой линией не попадает, но показывает, что затянул старт
+        'heavy_modules': runs[-1]['heavy_modules'],
+    }
+
+
+def seed_history(devices: int, history: int, seed: int = 0):
+    # Без сигналов и записи признаков на диск: страницам нужны только строки истории и агрегаты
+    rng = np.random.default_rng(seed)
+    device_objs = Device.objects.bulk_create([
+        Device(name=f'benchmark-{index}', ipv4=f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}')
+        for index in range(devices)
+    ])
+
+    for device in device_objs:
+        scores = rng.random(history)
+        payloads = rng.integers(0, 50, history)
+        volumes = rng.integers(10 ** 4, 10 ** 8, history)
+        DeviceAnalyzeHistory.objects.bulk_create([
+            DeviceAnalyzeHistory(
+                device=device, packet_count=int(volumes[index] // 500), bytes_total=int(volumes[index]),
+                payload_count=int(payloads[index]), prediction_score=float(scores[index]),
+                score_histogram=[int(scores[index] * 10)],
+            )
+            for index in range(history)
+        ], batch_size=1000)
+        DeviceAnalysisStats.objects.create(
+            device=device, analysis_count=history, prediction_score_sum=float(scores.sum()),
+            prediction_score_count=history, payload_count=int(payloads.sum()), bytes_total=int(volumes.sum()),
+        )
+
+    return device_objs
+
+
+def bench_page(client: Client, url: str, repeat: int) -> dict:
+    client.get(url)  # прогрев шаблонов и кешей
+
+    latencies = []
+    for _ in range(max(repeat, 1)):
+        with CaptureQueriesContext(connection) as queries:
+            started_at = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - started_at)
+
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} responded with {response.status_code}')
+
+    return {
+        'latency_p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'latency_max_ms': round(max(latencies) * 1000, 2),
+        'page_queries': len(queries),
+    }
+
+
+def bench_views(devices: int, history: int, repeat: int) -> dict:
+    device_objs = seed_history(devices, history)
+    client = Client()
+
+    return {
+        'devices': devices,
+        'history_per_device': history,
+        'dashboard_page': bench_page(client, reverse('manager:dashboard_page'), repeat),
+        'device_page': bench_page(client, reverse('manager:device_page', kwargs={'pk': device_objs[0].pk}), repeat),
+    }
+
+
+def run_pipeline_benchmarks(packets: int, protocol_mix: Optional[Dict[str, float]] = None, seed: int = 0,
+                            repeat: int = 3, predictor_rows: int = 1000000) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pcap_path = str(Path(tmp_dir) / 'synthetic.pcap')
+        pcap_size = SyntheticPcapWriter(protocol_mix=protocol_mix, seed=seed).write(pcap_path, packets)
+        results['capture'] = {'packets': packets, 'size_bytes': pcap_size}
+
+        for engine in NetworkAnalyzer.ENGINES:
+            stats, peak_rss_mb = run_isolated(bench_analyzer, pcap_path, engine)
+            results[f'analyzer_{engine}'] = dict(stats, peak_rss_mb=round(peak_rss_mb, 1))
+
+        analysis = NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_RAW).analyze_columnar(pcap_path)
+
+    stats, peak_rss_mb = run_isolated(bench_predictor, analysis, repeat)
+    results['predictor'] = dict(stats, peak_rss_mb=round(peak_rss_mb, 1))
+
+    if predictor_rows:
+        stats, peak_rss_mb = run_isolated(bench_predictor_rows, analysis, predictor_rows)
+        results['predictor_large'] = dict(stats, peak_rss_mb=round(peak_rss_mb, 1))
+
+    stats, peak_rss_mb = run_isolated(bench_dataset, analysis, repeat)
+    results['dataset'] = dict(stats, peak_rss_mb=round(peak_rss_mb, 1))
+
+    return results
+
+
+def get_run_metadata(options: dict) -> dict:
+    return {
+        'format_version': BENCHMARK_FORMAT_VERSION,
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': options,
+    }
+
+
+def flatten(results: dict, prefix: str = '') -> Dict[str, float]:
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[f'{prefix}{key}'] = value
+
+    return metrics
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    # Сравниваются только метрики с известным направлением; размеры входных данных не сравниваются
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for metric, value in current.items():
+        base_value = previous.get(metric)
+        if not base_value:
+            continue
+
+        change = (value - base_value) / base_value
+        if metric.endswith(HIGHER_IS_BETTER) and change < -threshold:
+            regressions.append(f'{metric}: {base_value} -> {value} ({change:+.0%})')
+        elif metric.endswith(LOWER_IS_BETTER) and change > threshold:
+            regressions.append(f'{metric}: {base_value} -> {value} ({change:+.0%})')
+
+    return regressions
+
+
+def load_report(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def dump_report(report: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
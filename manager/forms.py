@@ -13,6 +13,7 @@ class DeviceForm(forms.ModelForm):
 class AnalysisForm(forms.Form):
 
     pcap_file = forms.FileField()
+    profile = forms.BooleanField(required=False)
 
     class Meta:
         fields = '__all__'
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+
+from core import DatasetType
+from core.analyzer.metrics import COUNTER_ANALYSES_REUSED
+from manager import pipeline
+from manager.models import AnalysisJob, DeviceAnalyzeHistory, PipelineMetric
+
+
+SPOOL_DIR = 'analysis_spool'
+CHUNK_SIZE = 1024 ** 2
+SPOOL_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+
+def get_spool_dir() -> Path:
+    return Path(settings.MEDIA_ROOT) / SPOOL_DIR
+
+
+def spool_upload(uploaded_file: UploadedFile) -> Tuple[str, str]:
+    # Загрузка копируется на диск кусками, хэш считается по ходу копирования - второго прохода нет.
+    # Имя файла - хэш содержимого, повторная загрузка того же захвата не занимает места
+    spool_dir = get_spool_dir()
+    spool_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=spool_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in uploaded_file.chunks(CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+
+        content_hash = digest.hexdigest()
+        os.replace(tmp_path, spool_dir / f'{content_hash}.pcap')
+    except:  # noqa
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    return f'{SPOOL_DIR}/{content_hash}.pcap', content_hash
+
+
+def cleanup_spool(max_age: Optional[float] = None) -> List[Path]:
+    # Захваты нужны только до конца анализа: файлы задач в очереди и в работе не трогаем при любом возрасте
+    if max_age is None:
+        max_age = getattr(settings, 'ANALYSIS_SPOOL_RETENTION_SECONDS', SPOOL_RETENTION_SECONDS)
+
+    spool_dir = get_spool_dir()
+    if not spool_dir.exists():
+        return []
+
+    in_use = set(AnalysisJob.objects.filter(
+        state__in=[AnalysisJob.STATE_QUEUED, AnalysisJob.STATE_RUNNING], pcap_file__startswith=f'{SPOOL_DIR}/'
+    ).values_list('pcap_file', flat=True))
+
+    removed = []
+    expire_before = time.time() - max_age
+    for path in spool_dir.iterdir():
+        if f'{SPOOL_DIR}/{path.name}' in in_use or path.stat().st_mtime >= expire_before:
+            continue
+        path.unlink(missing_ok=True)
+        removed.append(path)
+
+    return removed
+
+
+def get_model_version() -> Optional[str]:
+    try:
+        return pipeline.ModelRegistry.get_version(DatasetType.NETWORK)
+    except (FileNotFoundError, OSError):
+        return None
+
+
+def find_reusable_history(content_hash: str, model_version: Optional[str]) -> Optional[DeviceAnalyzeHistory]:
+    # У модели старого формата версия не меняется при переобучении - результаты с ней не переиспользуются
+    if not (content_hash and model_version) or model_version == pipeline.ModelRegistry.LEGACY_VERSION:
+        return None
+
+    return DeviceAnalyzeHistory.objects.filter(
+        content_hash=content_hash, model_version=model_version
+    ).exclude(features_path='').order_by('-pk').first()
+
+
+def submit_capture(device_id: int, uploaded_file: UploadedFile, profile: bool = False) -> AnalysisJob:
+    pcap_path, content_hash = spool_upload(uploaded_file)
+    job = AnalysisJob(device_id=device_id, pcap_file=pcap_path, content_hash=content_hash, profile=profile)
+
+    # Захват уже анализировался текущей моделью - результат привязывается к устройству без очереди.
+    # Задача с профилированием всегда выполняется заново
+    source = None if profile else find_reusable_history(content_hash, get_model_version())
+    if source is None:
+        job.save()
+        return job
+
+    # Без задачи запись истории осталась бы ничьей
+    with transaction.atomic():
+        job.history = DeviceAnalyzeHistory.create_from_history(source, device_id)
+        job.state = AnalysisJob.STATE_DONE
+        job.progress = 100
+        job.save()
+        PipelineMetric.apply_metrics({'counters': {COUNTER_ANALYSES_REUSED: 1}})
+
+    return job
@@ -0,0 +1,155 @@
+import logging
+import os
+import time
+import traceback
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core import DatasetType
+from core.analyzer.metrics import (
+    COUNTER_ANALYSES_REUSED, COUNTER_ROWS_PREDICTED, STAGE_MODEL_LOAD, STAGE_PREDICT, STAGE_SERIALIZE, PipelineMetrics,
+)
+from manager import pipeline, storage
+from manager.ingest import find_reusable_history
+from manager.metrics import capture_profile
+from manager.models import AnalysisJob, DeviceAnalyzeHistory, PipelineMetric
+
+
+logger = logging.getLogger(__name__)
+JOB_LEASE_SECONDS = 30 * 60
+
+
+def requeue_stale_jobs() -> int:
+    # updated_date работает как аренда: воркер, умерший посреди задачи, перестает ее продлевать
+    lease = getattr(settings, 'ANALYSIS_JOB_LEASE_SECONDS', JOB_LEASE_SECONDS)
+    return AnalysisJob.objects.filter(
+        state=AnalysisJob.STATE_RUNNING, updated_date__lt=timezone.now() - timedelta(seconds=lease)
+    ).update(state=AnalysisJob.STATE_QUEUED, progress=0, updated_date=timezone.now())
+
+
+def claim_next_job() -> Optional[AnalysisJob]:
+    requeue_stale_jobs()
+
+    queued_ids = AnalysisJob.objects.filter(
+        state=AnalysisJob.STATE_QUEUED
+    ).order_by('pk').values_list('pk', flat=True)[:10]
+
+    for job_id in queued_ids:
+        # Задачу забирает тот воркер, чей UPDATE первым сменил состояние - без блокировок и брокера
+        claimed = AnalysisJob.objects.filter(pk=job_id, state=AnalysisJob.STATE_QUEUED).update(
+            state=AnalysisJob.STATE_RUNNING, updated_date=timezone.now()
+        )
+        if claimed:
+            return AnalysisJob.objects.get(pk=job_id)
+
+    return None
+
+
+def process_job(job: AnalysisJob):
+    try:
+        history = run_analysis(job)
+    except:  # noqa
+        logger.exception('analysis job %s failed', job.pk)
+        job.state = AnalysisJob.STATE_FAILED
+        job.error = traceback.format_exc()
+        job.save(update_fields=['state', 'error', 'updated_date'])
+        return
+
+    job.state = AnalysisJob.STATE_DONE
+    job.progress = 100
+    job.history = history
+    job.save(update_fields=['state', 'progress', 'history', 'updated_date'])
+
+
+def run_analysis(job: AnalysisJob) -> DeviceAnalyzeHistory:
+    metrics = PipelineMetrics()
+    with capture_profile(enabled=job.profile) as profile:
+        history = _analyze_job(job, metrics)
+
+    history.metrics = dict(history.metrics, **metrics.to_dict())
+    if profile.profile_path:
+        history.metrics['profile_path'] = profile.profile_path
+        history.metrics['profile_top'] = profile.top_functions
+    history.save(update_fields=['metrics'])
+
+    with transaction.atomic():
+        PipelineMetric.apply_metrics(history.metrics)
+
+    return history
+
+
+def _analyze_job(job: AnalysisJob, metrics: PipelineMetrics) -> DeviceAnalyzeHistory:
+    with metrics.stage(STAGE_MODEL_LOAD):
+        predictor = pipeline.Predictor(DatasetType.NETWORK, output_feature='is_malicious')
+
+    # Пока задача ждала в очереди, тот же захват могли проанализировать той же моделью
+    source = None if job.profile else find_reusable_history(job.content_hash, predictor.model_version)
+    if source is not None:
+        metrics.count(COUNTER_ANALYSES_REUSED)
+        return DeviceAnalyzeHistory.create_from_history(source, job.device_id)
+
+    analyzer = pipeline.NetworkAnalyzer(features=storage.get_stored_features(predictor.get_required_features()))
+
+    # Каждый батч сразу предсказывается и дописывается в файл признаков, от него остаются только счетчики сводки:
+    # память воркера не растет с размером захвата
+    writer = storage.FeatureWriter()
+    summary = storage.SummaryAccumulator()
+    try:
+        with job.pcap_file.open('rb') as pcap_file:
+            file_size = max(job.pcap_file.size, 1)
+
+            for batch in analyzer.iter_analyze_columnar(pcap_file, metrics=metrics):
+                with metrics.stage(STAGE_PREDICT):
+                    predictions, probabilities = predictor.predict_batch(batch)
+                metrics.count(COUNTER_ROWS_PREDICTED, len(batch))
+
+                with metrics.stage(STAGE_SERIALIZE):
+                    writer.write(batch)
+                    summary.add(batch, predictions, probabilities)
+                # Ридер закрывает файл, дочитав его до конца
+                _update_progress(job, 1 if pcap_file.closed else pcap_file.tell() / file_size)
+
+        if not summary.packet_count:
+            raise ValueError('No packets to analyze in the capture')
+
+        with metrics.stage(STAGE_SERIALIZE):
+            features_path = writer.close()
+    except:  # noqa
+        writer.discard()
+        raise
+
+    return DeviceAnalyzeHistory.create_from_summary(
+        job.device_id, features_path, summary.result(), model_version=predictor.model_version, metrics=metrics,
+        content_hash=job.content_hash,
+    )
+
+
+def run_worker(poll_interval: float = 1.0, exit_when_idle: bool = False):
+    while True:
+        job = claim_next_job()
+        if job is None:
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        logger.info('[%s] processing %s', os.getpid(), job)
+        process_job(job)
+
+
+def start_worker_process(poll_interval: float, exit_when_idle: bool):
+    # Соединения с БД, унаследованные от родительского процесса, использовать нельзя
+    connections.close_all()
+    run_worker(poll_interval=poll_interval, exit_when_idle=exit_when_idle)
+
+
+def _update_progress(job: AnalysisJob, done_ratio: float):
+    # Оставляем запас до 100% на предсказание и сохранение результата
+    progress = min(int(done_ratio * 90), 90)
+    if progress != job.progress:
+        job.progress = progress
+        AnalysisJob.objects.filter(pk=job.pk).update(progress=progress, updated_date=timezone.now())
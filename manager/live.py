@@ -0,0 +1,310 @@
+import queue
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.utils import timezone
+
+from core import DatasetType
+from core.analyzer.addresses import ipv4_to_int
+from core.analyzer.decoder import FlowPacketDecoder, Frame
+from core.analyzer.network import NetworkAnalyzer
+from core.ml.predictor import Predictor
+from manager import storage
+from manager.models import Device, DeviceAnalyzeHistory
+
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_SAMPLE = 'sample'
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_SAMPLE)
+# Отметка в metrics записи истории, созданной монитором по окну трафика
+LIVE_WINDOW_METRIC = 'live_window'
+
+
+class DeviceWindow:
+
+    def __init__(self, window: float, step: float):
+        self._window = window
+        self._step = step
+        self._timestamps = np.empty(0)
+        self._analysis = NetworkAnalyzer.to_columnar([])
+        self._predictions = np.empty(0)
+        self._probabilities = np.empty(0)
+        self.window_end = None
+
+    def add(self, timestamps: np.ndarray, analysis: pd.DataFrame, predictions: np.ndarray,
+            probabilities: np.ndarray):
+        if self.window_end is None:
+            self.window_end = float(timestamps.min()) + self._window
+
+        self._timestamps = np.concatenate([self._timestamps, timestamps])
+        self._analysis = pd.concat([self._analysis, analysis], ignore_index=True)
+        self._predictions = np.concatenate([self._predictions, predictions])
+        self._probabilities = np.concatenate([self._probabilities, probabilities])
+
+    def pop_ready(self, now: float, flush: bool = False) -> List[tuple]:
+        # Окно закрывается, когда время захвата ушло за его конец; при step < window окна перекрываются
+        ready = []
+        while self.window_end is not None and (now >= self.window_end or flush):
+            in_window = (self._timestamps >= self.window_end - self._window) & (self._timestamps < self.window_end)
+
+            if in_window.any():
+                ready.append((
+                    self._analysis[in_window].reset_index(drop=True),
+                    self._predictions[in_window],
+                    self._probabilities[in_window],
+                ))
+
+            # Строки, которые не попадут в следующие окна, больше не храним
+            keep = self._timestamps >= self.window_end + self._step - self._window
+            self._timestamps = self._timestamps[keep]
+            self._analysis = self._analysis[keep].reset_index(drop=True)
+            self._predictions = self._predictions[keep]
+            self._probabilities = self._probabilities[keep]
+
+            if not len(self._timestamps):
+                self.window_end = None
+            elif in_window.any():
+                self.window_end += self._step
+            else:
+                # После паузы пустые окна не перебираем - сразу к первому окну сетки, где есть строки
+                gap = float(self._timestamps.min()) - self.window_end
+                self.window_end += max(1, np.floor(gap / self._step) + 1) * self._step
+
+        return ready
+
+
+class LiveStats:
+
+    def __init__(self):
+        self.received = 0
+        self.scored = 0
+        self.unrouted = 0
+        self.dropped = 0
+        self.windows = 0
+        self.expired = 0
+        self._latencies = []
+        # Счетчики меняют и поток чтения, и основной поток: += без блокировки теряет обновления
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def add_latencies(self, latencies: np.ndarray):
+        self._latencies.append(latencies)
+
+    def pop_report(self) -> str:
+        latencies = np.concatenate(self._latencies) * 1000 if self._latencies else np.zeros(1)
+        self._latencies = []
+        with self._lock:
+            counters = (
+                f'received={self.received} scored={self.scored} unrouted={self.unrouted} dropped={self.dropped} '
+                f'windows={self.windows} expired={self.expired}'
+            )
+        return (
+            f'{counters} latency_ms p50={np.percentile(latencies, 50):.1f} '
+            f'p95={np.percentile(latencies, 95):.1f} max={latencies.max():.1f}'
+        )
+
+
+class LiveMonitor:
+
+    DEVICES_REFRESH_INTERVAL = 30.0
+
+    def __init__(self, frames: Iterable[Frame], window: float = 10.0, step: Optional[float] = None,
+                 batch_size: int = 512, max_delay: float = 0.2, max_latency: float = 2.0, queue_size: int = 50000,
+                 overflow: str = OVERFLOW_DROP, sample_rate: int = 10, report_interval: float = 10.0,
+                 predictor: Optional[Predictor] = None, retention: Optional[float] = None, report=print):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+
+        self._frames = frames
+        self._window = window
+        self._step = step or window
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._max_latency = max_latency
+        self._overflow = overflow
+        self._sample_rate = max(sample_rate, 1)
+        self._report_interval = report_interval
+        self._retention = retention
+        self._report = report
+
+        self._predictor = predictor or Predictor(DatasetType.NETWORK, output_feature='is_malicious')
+        self._route_decoder = FlowPacketDecoder()
+        # Колонки, не нужные модели и сводке, остаются пустыми: их проверки и разбор нагрузки не выполняются
+        self._feature_decoder = NetworkAnalyzer(
+            features=storage.get_stored_features(self._predictor.get_required_features())
+        ).get_raw_decoder()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._windows: Dict[int, DeviceWindow] = {}
+        self._devices: Dict[int, int] = {}
+        self._devices_loaded_at = None
+        self._stale_count = 0
+        self._clock = 0.0
+        self.stats = LiveStats()
+
+    def run(self):
+        reader = threading.Thread(target=self._read_frames, daemon=True)
+        reader.start()
+
+        reported_at = time.monotonic()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+
+                if batch:
+                    self._score_batch(batch)
+                self._persist_windows()
+
+                if time.monotonic() - reported_at >= self._report_interval:
+                    self._expire_history()
+                    self._report(self.stats.pop_report())
+                    reported_at = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            self._persist_windows(flush=True)
+            self._expire_history()
+            self._report(self.stats.pop_report())
+
+    def stop(self):
+        self._stop.set()
+
+    def _read_frames(self):
+        # Захват не должен ждать модель: при переполненной очереди кадр отбрасывается
+        for frame in self._frames:
+            if self._stop.is_set():
+                break
+
+            self.stats.count('received')
+            if not isinstance(frame.buffer, bytes):
+                # Кадр из отображенного в память файла действителен только до следующей итерации ридера
+                frame = Frame(frame.linktype, frame.timestamp, frame.buffer[frame.start:frame.end], 0,
+                              frame.end - frame.start)
+            try:
+                self._queue.put_nowait((time.monotonic(), frame))
+            except queue.Full:
+                self.stats.count('dropped')
+
+        self._queue.put(None)
+
+    def _next_batch(self) -> Optional[list]:
+        # Микропакет копится не дольше max_delay, чтобы ограничить задержку при слабом трафике
+        if self._stop.is_set():
+            return None
+
+        batch = []
+        deadline = time.monotonic() + self._max_delay
+        while len(batch) < self._batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is None:
+                if not batch:
+                    return None
+                # Кадры закончились: последний микропакет обрабатывается, следующий вызов завершит цикл
+                self._queue.put(None)
+                break
+
+            if self._is_shed(item[0]):
+                self.stats.count('dropped')
+                continue
+            batch.append(item)
+
+        return batch
+
+    def _is_shed(self, arrived_at: float) -> bool:
+        # Модель отстает: устаревшие кадры отбрасываются целиком или прореживаются
+        if time.monotonic() - arrived_at <= self._max_latency:
+            return False
+
+        if self._overflow == OVERFLOW_DROP:
+            return True
+
+        self._stale_count += 1
+        return self._stale_count % self._sample_rate != 0
+
+    def _get_devices(self) -> Dict[int, int]:
+        now = time.monotonic()
+        if self._devices_loaded_at is None or now - self._devices_loaded_at >= self.DEVICES_REFRESH_INTERVAL:
+            self._devices = {
+                ipv4_to_int(ipv4): device_id for device_id, ipv4 in Device.objects.values_list('pk', 'ipv4')
+            }
+            self._devices_loaded_at = now
+
+        return self._devices
+
+    def _score_batch(self, batch: list):
+        devices = self._get_devices()
+
+        rows, device_ids, timestamps, arrivals = [], [], [], []
+        for arrived_at, frame in batch:
+            packet = self._route_decoder.decode(frame)
+            device_id = None
+            if packet is not None:
+                device_id = devices.get(packet.src) or devices.get(packet.dst)
+
+            pkt_data = self._feature_decoder.decode(frame) if device_id is not None else None
+            if pkt_data is None:
+                self.stats.count('unrouted')
+                continue
+
+            rows.append(pkt_data)
+            device_ids.append(device_id)
+            timestamps.append(frame.timestamp)
+            arrivals.append(arrived_at)
+
+        if not rows:
+            return
+
+        analysis = NetworkAnalyzer.to_columnar(rows)
+        predictions, probabilities = self._predictor.predict_batch(analysis)
+        self.stats.add_latencies(time.monotonic() - np.asarray(arrivals))
+        self.stats.count('scored', len(rows))
+
+        device_ids = np.asarray(device_ids)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        self._clock = max(self._clock, float(timestamps.max()))
+        for device_id in np.unique(device_ids):
+            in_device = device_ids == device_id
+            window = self._windows.setdefault(int(device_id), DeviceWindow(self._window, self._step))
+            window.add(
+                timestamps[in_device], analysis[in_device].reset_index(drop=True),
+                predictions[in_device], probabilities[in_device],
+            )
+
+    def _persist_windows(self, flush: bool = False):
+        for device_id, window in self._windows.items():
+            for analysis, predictions, probabilities in window.pop_ready(self._clock, flush=flush):
+                DeviceAnalyzeHistory.create_from_analysis(
+                    device_id, analysis, predictions, probabilities, model_version=self._predictor.model_version,
+                    history_metrics={LIVE_WINDOW_METRIC: True},
+                )
+                self.stats.count('windows')
+
+    def _expire_history(self):
+        # Монитор пишет запись с файлом признаков на каждое окно: старые окна удаляются вместе с файлами
+        # (сигнал post_delete), записи загруженных вручную захватов не трогаются
+        if not self._retention:
+            return
+
+        expired = DeviceAnalyzeHistory.objects.filter(
+            **{f'metrics__{LIVE_WINDOW_METRIC}': True},
+            created_date__lt=timezone.now() - timedelta(seconds=self._retention),
+        )
+        deleted = expired.delete()[1].get(DeviceAnalyzeHistory._meta.label, 0)
+        if deleted:
+            self.stats.count('expired', deleted)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from manager import storage
+from manager.models import DeviceAnalyzeHistory
+
+
+class Command(BaseCommand):
+    help = ('Delete stored packet feature files that no analysis history record references. '
+            'Files younger than the grace period are kept, an analysis may still be writing them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age-hours', type=float, default=storage.FEATURES_GRACE_SECONDS / 3600,
+                            help='Keep unreferenced files younger than this')
+
+    def handle(self, *args, **options):
+        referenced = set(DeviceAnalyzeHistory.objects.exclude(features_path='').values_list('features_path', flat=True))
+        removed = storage.cleanup_features(referenced, max_age=options['min_age_hours'] * 3600)
+        self.stdout.write(f'Removed {len(removed)} unreferenced feature files')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from manager import ingest
+
+
+class Command(BaseCommand):
+    help = ('Delete spooled pcap uploads older than the retention period. '
+            'Captures of queued and running analysis jobs are kept')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=float, default=None,
+                            help='Override ANALYSIS_SPOOL_RETENTION_SECONDS')
+
+    def handle(self, *args, **options):
+        max_age = None if options['max_age_hours'] is None else options['max_age_hours'] * 3600
+        removed = ingest.cleanup_spool(max_age=max_age)
+        self.stdout.write(f'Removed {len(removed)} spooled files')
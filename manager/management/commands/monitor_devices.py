@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.analyzer.decoder import InterfaceFrameReader, PcapTailReader
+from manager.live import LiveMonitor, OVERFLOW_POLICIES
+
+
+class Command(BaseCommand):
+    help = 'Score live traffic of known devices in sliding windows and store window scores to device history'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--interface', help='Capture interface name')
+        source.add_argument('--pcap', help='Growing pcap file to follow (tail mode)')
+        parser.add_argument('--exit-when-idle', type=float, default=None,
+                            help='Stop following the pcap file after this many seconds without new data')
+        parser.add_argument('--window', type=float, default=10.0, help='Window length, seconds of capture time')
+        parser.add_argument('--step', type=float, default=None, help='Window step, defaults to the window length')
+        parser.add_argument('--batch-size', type=int, default=512, help='Max packets scored at once')
+        parser.add_argument('--max-delay', type=float, default=0.2, help='Max seconds to collect a micro-batch')
+        parser.add_argument('--max-latency', type=float, default=2.0,
+                            help='Packets waiting longer than this are shed by the overflow policy')
+        parser.add_argument('--queue-size', type=int, default=50000, help='Max packets waiting for scoring')
+        parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_POLICIES[0],
+                            help='Drop all late packets or keep every --sample-rate-th of them')
+        parser.add_argument('--sample-rate', type=int, default=10)
+        parser.add_argument('--retention-hours', type=float, default=7 * 24,
+                            help='Delete window history records older than this, 0 keeps them forever')
+        parser.add_argument('--report-interval', type=float, default=10.0, help='Seconds between stats reports')
+
+    def handle(self, *args, **options):
+        if options['step'] is not None and not 0 < options['step'] <= options['window']:
+            raise CommandError('--step must be positive and not longer than --window')
+
+        if options['interface']:
+            frames = InterfaceFrameReader(options['interface'])
+        else:
+            frames = PcapTailReader(options['pcap'], idle_timeout=options['exit_when_idle'])
+
+        monitor = LiveMonitor(
+            frames,
+            window=options['window'],
+            step=options['step'],
+            batch_size=options['batch_size'],
+            max_delay=options['max_delay'],
+            max_latency=options['max_latency'],
+            queue_size=options['queue_size'],
+            overflow=options['overflow'],
+            sample_rate=options['sample_rate'],
+            report_interval=options['report_interval'],
+            retention=options['retention_hours'] * 3600,
+            report=self.stdout.write,
+        )
+        monitor.run()
@@ -0,0 +1,41 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+
+from manager import jobs, pipeline
+
+
+class Command(BaseCommand):
+    help = 'Process queued pcap analysis jobs with a pool of local worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between queue checks')
+        parser.add_argument('--exit-when-idle', action='store_true', help='Stop once the queue is empty')
+        parser.add_argument('--no-warm-up', action='store_true',
+                            help='Do not pre-load the model and lookup tables before taking jobs')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        # Прогрев до fork: воркеры получают загруженные модули, модель и таблицы готовыми
+        if not options['no_warm_up']:
+            timings = pipeline.warm_up()
+            self.stderr.write('Warmed up: ' + ', '.join(
+                f'{name} {seconds:.3f}s' if seconds is not None else f'{name} skipped'
+                for name, seconds in timings.items()
+            ))
+
+        if workers == 1:
+            jobs.run_worker(poll_interval=options['poll_interval'], exit_when_idle=options['exit_when_idle'])
+            return
+
+        processes = [
+            multiprocessing.Process(
+                target=jobs.start_worker_process, args=(options['poll_interval'], options['exit_when_idle'])
+            )
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
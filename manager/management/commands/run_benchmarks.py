@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.analyzer.synthetic import parse_protocol_mix
+from manager import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the analyzer, predictor, dataset storage and dashboard pages on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--packets', type=int, default=20000, help='Packets in the synthetic capture')
+        parser.add_argument('--mix', default=None, help='Protocol mix, e.g. tcp=0.5,udp=0.3,http=0.2')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--devices', type=int, default=50, help='Devices seeded for the page benchmarks')
+        parser.add_argument('--history', type=int, default=200, help='History records seeded per device')
+        parser.add_argument('--predictor-rows', type=int, default=1000000,
+                            help='Rows in the large batch inference benchmark, 0 to skip it')
+        parser.add_argument('--repeat', type=int, default=5, help='Repetitions per measurement')
+        parser.add_argument('--skip-views', action='store_true', help='Do not benchmark the dashboard pages')
+        parser.add_argument('--skip-startup', action='store_true',
+                            help='Do not benchmark manage.py check and the first request in a fresh process')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--baseline', help='Compare with a stored JSON report and fail on regressions')
+        parser.add_argument('--threshold', type=float, default=benchmarks.REGRESSION_THRESHOLD,
+                            help='Relative change treated as a regression')
+
+    def handle(self, *args, **options):
+        try:
+            protocol_mix = parse_protocol_mix(options['mix']) if options['mix'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        results = benchmarks.run_pipeline_benchmarks(
+            options['packets'], protocol_mix=protocol_mix, seed=options['seed'], repeat=options['repeat'],
+            predictor_rows=options['predictor_rows'],
+        )
+
+        if not options['skip_startup']:
+            results['startup'] = benchmarks.bench_startup(options['repeat'])
+
+        if not options['skip_views']:
+            # Страницы меряются на отдельной тестовой БД, рабочая база не заполняется синтетикой
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results['views'] = benchmarks.bench_views(options['devices'], options['history'], options['repeat'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'meta': benchmarks.get_run_metadata({
+                key: options[key]
+                for key in ('packets', 'mix', 'seed', 'devices', 'history', 'repeat', 'predictor_rows')
+            }),
+            'results': results,
+        }
+        if options['output']:
+            benchmarks.dump_report(report, options['output'])
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        if options['baseline']:
+            baseline = benchmarks.load_report(options['baseline'])
+            regressions = benchmarks.find_regressions(results, baseline['results'], options['threshold'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stderr.write('No regressions against the baseline')
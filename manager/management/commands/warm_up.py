@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from manager import pipeline
+
+
+class Command(BaseCommand):
+    help = ('Pre-load the analysis stack, model, OUI and IP tables and report how long each took. '
+            'With MAC_VENDOR_CACHE_PATH set the OUI cache is written for the next process start')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-model', action='store_true')
+        parser.add_argument('--skip-mac-vendors', action='store_true')
+        parser.add_argument('--skip-ip-tables', action='store_true')
+
+    def handle(self, *args, **options):
+        timings = pipeline.warm_up(
+            model=not options['skip_model'], mac_vendors=not options['skip_mac_vendors'],
+            ip_tables=not options['skip_ip_tables'],
+        )
+        for name, seconds in timings.items():
+            if seconds is None:
+                self.stdout.write(f'{name}: not available')
+            else:
+                self.stdout.write(f'{name}: {seconds * 1000:.1f} ms')
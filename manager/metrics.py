@@ -0,0 +1,93 @@
+import cProfile
+import io
+import pstats
+from contextlib import contextmanager
+from typing import List
+
+from django.db.models import Count
+
+from core.analyzer.metrics import COUNTERS
+from manager import storage
+from manager.models import AnalysisJob, PipelineMetric
+
+
+METRIC_PREFIX = 'iot_analysis'
+PROFILE_TOP_FUNCTIONS = 20
+
+# Имя в PipelineMetric -> (имя в экспозиции, тип, описание)
+EXPOSED_METRICS = {
+    'analysis': ('total', 'counter', 'Finished pcap analyses'),
+    'stage_wall_seconds': ('stage_wall_seconds_total', 'counter', 'Wall time spent in a pipeline stage'),
+    'stage_cpu_seconds': ('stage_cpu_seconds_total', 'counter', 'CPU time spent in a pipeline stage'),
+    'peak_rss_mb': ('worker_peak_rss_megabytes', 'gauge', 'Max peak RSS of an analysis worker'),
+}
+EXPOSED_METRICS.update({
+    name: (f'{name}_total', 'counter', name.replace('_', ' ').capitalize()) for name in COUNTERS
+})
+
+
+class AnalysisProfile:
+
+    def __init__(self):
+        self.profile_path = ''
+        self.top_functions = []
+
+
+@contextmanager
+def capture_profile(enabled: bool = True):
+    # cProfile замедляет анализ в разы, поэтому включается только для отдельной задачи
+    result = AnalysisProfile()
+    if not enabled:
+        yield result
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        result.profile_path = storage.save_profile(profiler)
+        result.top_functions = get_top_functions(profiler)
+
+
+def get_top_functions(profiler: cProfile.Profile, limit: int = PROFILE_TOP_FUNCTIONS) -> List[dict]:
+    stats = pstats.Stats(profiler, stream=io.StringIO()).sort_stats(pstats.SortKey.CUMULATIVE)
+    top_functions = []
+    for func in stats.fcn_list[:limit]:
+        calls, _, total_time, cumulative_time, _ = stats.stats[func]
+        top_functions.append({
+            'function': pstats.func_std_string(func),
+            'calls': calls,
+            'total_seconds': round(total_time, 6),
+            'cumulative_seconds': round(cumulative_time, 6),
+        })
+
+    return top_functions
+
+
+def render_prometheus() -> str:
+    lines = []
+    described = set()
+    for metric in PipelineMetric.objects.order_by('name', 'stage'):
+        exposed_name, metric_type, description = EXPOSED_METRICS.get(
+            metric.name, (metric.name, 'untyped', metric.name)
+        )
+        exposed_name = f'{METRIC_PREFIX}_{exposed_name}'
+        if exposed_name not in described:
+            lines.append(f'# HELP {exposed_name} {description}')
+            lines.append(f'# TYPE {exposed_name} {metric_type}')
+            described.add(exposed_name)
+
+        labels = f'{{stage="{metric.stage}"}}' if metric.stage else ''
+        lines.append(f'{exposed_name}{labels} {metric.value!r}')
+
+    # Очередь задач считается на момент запроса
+    jobs_name = f'{METRIC_PREFIX}_jobs'
+    lines.append(f'# HELP {jobs_name} Analysis jobs by state')
+    lines.append(f'# TYPE {jobs_name} gauge')
+    job_counts = dict(AnalysisJob.objects.values_list('state').annotate(count=Count('pk')).order_by())
+    for state, _ in AnalysisJob.STATES:
+        lines.append(f'{jobs_name}{{state="{state}"}} {job_counts.get(state, 0)}')
+
+    return '\n'.join(lines) + '\n'
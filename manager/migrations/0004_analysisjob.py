@@ -0,0 +1,40 @@
+# Generated by Django 4.2.6 on 2026-10-17 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0003_deviceanalyzehistory_created_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pcap_file', models.FileField(upload_to='analysis_jobs/', verbose_name='PCAP file')),
+                ('state', models.CharField(
+                    choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+                    db_index=True, default='queued', max_length=10, verbose_name='State',
+                )),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='Progress, %')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='Create datetime')),
+                ('updated_date', models.DateTimeField(auto_now=True, verbose_name='Update datetime')),
+                ('device', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, to='manager.device', verbose_name='Device',
+                )),
+                ('history', models.ForeignKey(
+                    blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                    to='manager.deviceanalyzehistory', verbose_name='Analysis result',
+                )),
+            ],
+            options={
+                'verbose_name': 'IoT Network Analysis Job',
+                'verbose_name_plural': 'IoT Network Analysis Jobs',
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.6 on 2026-10-17 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0004_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='bytes_total',
+            field=models.BigIntegerField(default=0, verbose_name='Traffic volume, bytes'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='features_path',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Packet features file'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='model_version',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Model version'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='packet_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Packet count'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='payload_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='File payload count'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='port_breakdown',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Destination port breakdown'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='prediction_score',
+            field=models.FloatField(blank=True, db_index=True, null=True, verbose_name='Prediction score'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='protocol_breakdown',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Protocol breakdown'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='score_histogram',
+            field=models.JSONField(blank=True, default=list, verbose_name='Prediction score histogram'),
+        ),
+        migrations.AlterField(
+            model_name='deviceanalyzehistory',
+            name='result',
+            field=models.TextField(blank=True, default='', verbose_name='Analysis result'),
+        ),
+        migrations.AddIndex(
+            model_name='deviceanalyzehistory',
+            index=models.Index(fields=['device', 'created_date'], name='manager_dev_device__2f7ab1_idx'),
+        ),
+    ]
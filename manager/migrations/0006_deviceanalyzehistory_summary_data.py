@@ -0,0 +1,131 @@
+import json
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import migrations
+
+
+# Копия manager.storage на момент миграции: дальнейшие изменения хранилища не должны менять ее результат
+TOP_PORTS_COUNT = 10
+PROTOCOL_NAMES = {1: 'icmp', 6: 'tcp', 17: 'udp'}
+
+
+def get_storage_dir() -> Path:
+    return Path(getattr(settings, 'ANALYSIS_STORAGE_DIR', Path(settings.MEDIA_ROOT) / 'analysis'))
+
+
+def save_features(analysis: pd.DataFrame) -> str:
+    storage_dir = get_storage_dir()
+    storage_dir.mkdir(parents=True, exist_ok=True)
+
+    features_path = f'{uuid.uuid4().hex}.npz'
+    with open(storage_dir / features_path, 'wb') as f:
+        np.savez_compressed(f, **{column: analysis[column].to_numpy() for column in analysis.columns})
+
+    return features_path
+
+
+def load_features(features_path: str) -> pd.DataFrame:
+    with np.load(get_storage_dir() / features_path) as features:
+        return pd.DataFrame({column: features[column] for column in features.files})
+
+
+def summarize(analysis: pd.DataFrame) -> dict:
+    summary = {
+        'packet_count': len(analysis),
+        'bytes_total': int(analysis['packet_length'].sum()) if 'packet_length' in analysis else 0,
+        'payload_count': int(analysis['has_file_payload'].sum()) if 'has_file_payload' in analysis else 0,
+        'protocol_breakdown': {},
+        'port_breakdown': {},
+        'score_histogram': [],
+    }
+
+    if 'proto' in analysis:
+        protocols = analysis['proto'].value_counts(dropna=False)
+        summary['protocol_breakdown'] = {
+            'non_ip' if pd.isna(proto) else PROTOCOL_NAMES.get(int(proto), str(int(proto))): int(count)
+            for proto, count in protocols.items()
+        }
+
+    if 'dest_port' in analysis:
+        ports = analysis['dest_port'].value_counts().head(TOP_PORTS_COUNT)
+        summary['port_breakdown'] = {str(int(port)): int(count) for port, count in ports.items()}
+
+    return summary
+
+
+def dump_result(analysis: pd.DataFrame, prediction_score, model_version) -> str:
+    # Формат DeviceAnalyzeHistory.dump_result до миграции: {"analysis": {"feature": [values, ...]}, ...}
+    columns = ', '.join(
+        f'{json.dumps(column)}: {analysis[column].to_json(orient="values")}' for column in analysis.columns
+    )
+    return (
+        f'{{"analysis": {{{columns}}}, "prediction_score": {json.dumps(prediction_score)}, '
+        f'"model_version": {json.dumps(model_version or None)}}}'
+    )
+
+
+def convert_results(apps, schema_editor):
+    DeviceAnalyzeHistory = apps.get_model('manager', 'DeviceAnalyzeHistory')
+
+    histories = DeviceAnalyzeHistory.objects.exclude(result='').only('pk', 'result')
+    for history in histories.iterator(chunk_size=100):
+        try:
+            result_json = json.loads(history.result)
+        except ValueError:
+            continue
+
+        # Старые записи хранят список словарей по пакетам, более новые - словарь колонок
+        analysis = pd.DataFrame(result_json.get('analysis') or [])
+        for column in analysis.columns:
+            if analysis[column].dtype == object:
+                analysis[column] = analysis[column].astype('float64')
+
+        summary = summarize(analysis)
+        summary['prediction_score'] = result_json.get('prediction_score')
+
+        history.features_path = save_features(analysis)
+        history.model_version = result_json.get('model_version') or ''
+        history.result = ''
+        for field, value in summary.items():
+            setattr(history, field, value)
+
+        history.save(update_fields=['features_path', 'model_version', 'result', *summary.keys()])
+
+
+def restore_results(apps, schema_editor):
+    DeviceAnalyzeHistory = apps.get_model('manager', 'DeviceAnalyzeHistory')
+
+    # До миграции файлов признаков не было: после восстановления result ссылка на файл и сам файл удаляются.
+    # Переиспользованные анализы делят один файл, поэтому файлы удаляются после обхода всех записей
+    histories = DeviceAnalyzeHistory.objects.filter(result='').exclude(features_path='').only(
+        'pk', 'features_path', 'prediction_score', 'model_version'
+    )
+    restored_paths = set()
+    for history in histories.iterator(chunk_size=100):
+        try:
+            analysis = load_features(history.features_path)
+        except OSError:
+            continue
+
+        restored_paths.add(history.features_path)
+        history.result = dump_result(analysis, history.prediction_score, history.model_version)
+        history.features_path = ''
+        history.save(update_fields=['result', 'features_path'])
+
+    for features_path in restored_paths:
+        (get_storage_dir() / features_path).unlink(missing_ok=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0005_deviceanalyzehistory_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_results, restore_results),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.6 on 2026-10-17 17:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    DeviceAnalyzeHistory = apps.get_model('manager', 'DeviceAnalyzeHistory')
+    DeviceAnalysisStats = apps.get_model('manager', 'DeviceAnalysisStats')
+
+    device_stats = DeviceAnalyzeHistory.objects.values('device_id').annotate(
+        analysis_count=models.Count('id'),
+        prediction_score_sum=models.functions.Coalesce(models.Sum('prediction_score'), 0.0),
+        prediction_score_count=models.Count('prediction_score'),
+        payload_count=models.functions.Coalesce(models.Sum('payload_count'), 0),
+        bytes_total=models.functions.Coalesce(models.Sum('bytes_total'), 0),
+    ).order_by()
+
+    DeviceAnalysisStats.objects.bulk_create([DeviceAnalysisStats(**stats) for stats in device_stats])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0006_deviceanalyzehistory_summary_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceAnalysisStats',
+            fields=[
+                ('device', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='analysis_stats',
+                    serialize=False, to='manager.device', verbose_name='Device',
+                )),
+                ('analysis_count', models.IntegerField(default=0, verbose_name='Analysis count')),
+                ('prediction_score_sum', models.FloatField(default=0, verbose_name='Prediction score sum')),
+                ('prediction_score_count', models.IntegerField(default=0, verbose_name='Prediction score count')),
+                ('payload_count', models.BigIntegerField(default=0, verbose_name='File payload count')),
+                ('bytes_total', models.BigIntegerField(default=0, verbose_name='Traffic volume, bytes')),
+            ],
+            options={
+                'verbose_name': 'IoT Device Analysis Stats',
+                'verbose_name_plural': 'IoT Device Analysis Stats',
+            },
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.6 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0007_deviceanalysisstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='profile',
+            field=models.BooleanField(default=False, verbose_name='Capture cProfile'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Pipeline metrics'),
+        ),
+        migrations.CreateModel(
+            name='PipelineMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, verbose_name='Metric name')),
+                ('stage', models.CharField(blank=True, default='', max_length=32, verbose_name='Pipeline stage')),
+                ('value', models.FloatField(default=0, verbose_name='Value')),
+            ],
+            options={
+                'verbose_name': 'Pipeline Metric',
+                'verbose_name_plural': 'Pipeline Metrics',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='pipelinemetric',
+            constraint=models.UniqueConstraint(fields=('name', 'stage'), name='unique_pipeline_metric'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.6 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0008_pipeline_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Capture SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='deviceanalyzehistory',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Capture SHA-256'),
+        ),
+        migrations.AddIndex(
+            model_name='deviceanalyzehistory',
+            index=models.Index(fields=['content_hash', 'model_version'], name='manager_dev_content_8c00ed_idx'),
+        ),
+    ]
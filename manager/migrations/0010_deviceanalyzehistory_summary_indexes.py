@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0009_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deviceanalyzehistory',
+            name='bytes_total',
+            field=models.BigIntegerField(db_index=True, default=0, verbose_name='Traffic volume, bytes'),
+        ),
+        migrations.AlterField(
+            model_name='deviceanalyzehistory',
+            name='packet_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='Packet count'),
+        ),
+        migrations.AlterField(
+            model_name='deviceanalyzehistory',
+            name='payload_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='File payload count'),
+        ),
+    ]
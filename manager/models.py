@@ -1,8 +1,32 @@
-import json
+from typing import TYPE_CHECKING, Iterator, Optional
 
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest
 from django.utils.translation import gettext_lazy as _
 
+from core.analyzer.metrics import STAGE_DB_INSERT, STAGE_SERIALIZE, PipelineMetrics
+from manager import storage
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+
+def get_analysis_stats_aggregates(prefix: str = '') -> dict:
+    return {
+        'analysis_count': models.Count(f'{prefix}id'),
+        'prediction_score_avg': models.Avg(f'{prefix}prediction_score'),
+        'payload_count': Coalesce(models.Sum(f'{prefix}payload_count'), 0),
+        'bytes_total': Coalesce(models.Sum(f'{prefix}bytes_total'), 0),
+    }
+
+
+class DeviceQuerySet(models.QuerySet):
+
+    def with_analysis_stats(self):
+        # Статистика считается в БД одним запросом с GROUP BY, без загрузки истории анализов
+        return self.annotate(**get_analysis_stats_aggregates('deviceanalyzehistory__'))
+
 
 class Device(models.Model):
 
@@ -10,6 +34,8 @@ class Device(models.Model):
     ipv4 = models.GenericIPAddressField(protocol='IPv4', verbose_name=_('IPv4 address'))
     created_date = models.DateTimeField(auto_now_add=True, verbose_name=_('Created datetime'))
 
+    objects = DeviceQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'IoT Device'
         verbose_name_plural = 'IoT Devices'
@@ -24,22 +50,16 @@ class Device(models.Model):
             'created_date': self.created_date,
         }
 
-        device_history = DeviceAnalyzeHistory.objects.filter(device_id=self.pk)
-        stats = {
-            'prediction_score_sum': 0,
-            'prediction_score_count': 0,
-            'payload_count': 0,
-            'packet_length': 0,
-            'analysis_count': 0,
-        }
-        for history in device_history:  # type: DeviceAnalyzeHistory
-            history.analyze_history(stats)
+        if hasattr(self, 'analysis_count'):
+            stats = {key: getattr(self, key) for key in get_analysis_stats_aggregates()}
+        else:
+            stats = DeviceAnalyzeHistory.objects.filter(device_id=self.pk).aggregate(
+                **get_analysis_stats_aggregates()
+            )
 
-        if stats['prediction_score_count'] > 0:
+        if stats['prediction_score_avg'] is not None:
             device_stat = {
-                'prediction_score_avg': round(
-                    stats['prediction_score_sum'] / stats['prediction_score_count'], 3
-                ),
+                'prediction_score_avg': round(stats['prediction_score_avg'], 3),
                 'payload_count': stats['payload_count'],
             }
         else:
@@ -48,7 +68,7 @@ class Device(models.Model):
                 'payload_count': 0
             }
 
-        device_stat['packet_length'] = stats['packet_length']
+        device_stat['packet_length'] = stats['bytes_total'] // 10 ** 6
         device_stat['analysis_count'] = stats['analysis_count']
         result.update(device_stat)
         return result
@@ -57,31 +77,208 @@ class Device(models.Model):
 class DeviceAnalyzeHistory(models.Model):
 
     device = models.ForeignKey(Device, on_delete=models.CASCADE, verbose_name=_('Device'))
-    result = models.TextField(verbose_name=_('Analysis result'))
+    # Устаревшее хранение всего анализа в JSON, после миграции 0006 остается пустым
+    result = models.TextField(blank=True, default='', verbose_name=_('Analysis result'))
+    packet_count = models.PositiveIntegerField(default=0, db_index=True, verbose_name=_('Packet count'))
+    bytes_total = models.BigIntegerField(default=0, db_index=True, verbose_name=_('Traffic volume, bytes'))
+    payload_count = models.PositiveIntegerField(default=0, db_index=True, verbose_name=_('File payload count'))
+    prediction_score = models.FloatField(null=True, blank=True, db_index=True, verbose_name=_('Prediction score'))
+    score_histogram = models.JSONField(default=list, blank=True, verbose_name=_('Prediction score histogram'))
+    protocol_breakdown = models.JSONField(default=dict, blank=True, verbose_name=_('Protocol breakdown'))
+    port_breakdown = models.JSONField(default=dict, blank=True, verbose_name=_('Destination port breakdown'))
+    model_version = models.CharField(max_length=32, blank=True, default='', verbose_name=_('Model version'))
+    features_path = models.CharField(max_length=255, blank=True, default='', verbose_name=_('Packet features file'))
+    metrics = models.JSONField(default=dict, blank=True, verbose_name=_('Pipeline metrics'))
+    content_hash = models.CharField(max_length=64, blank=True, default='', verbose_name=_('Capture SHA-256'))
     created_date = models.DateTimeField(auto_now_add=True, verbose_name=_('Create datetime'))
 
     class Meta:
         verbose_name = 'IoT Network Analysis'
         verbose_name_plural = 'IoT Network Analysis'
+        indexes = [
+            models.Index(fields=['device', 'created_date']),
+            models.Index(fields=['content_hash', 'model_version']),
+        ]
 
     def __str__(self):
         return f'Analysis: {self.device}'
 
+    @classmethod
+    def create_from_history(cls, source: 'DeviceAnalyzeHistory', device_id: int):
+        # Файл признаков общий и не копируется: он удаляется вместе с последней ссылающейся на него записью
+        return cls.objects.create(
+            device_id=device_id,
+            packet_count=source.packet_count,
+            bytes_total=source.bytes_total,
+            payload_count=source.payload_count,
+            prediction_score=source.prediction_score,
+            score_histogram=source.score_histogram,
+            protocol_breakdown=source.protocol_breakdown,
+            port_breakdown=source.port_breakdown,
+            model_version=source.model_version,
+            features_path=source.features_path,
+            content_hash=source.content_hash,
+            metrics={'reused_from': source.pk},
+        )
+
+    @classmethod
+    def create_from_analysis(cls, device_id: int, analysis: 'pd.DataFrame', predictions: 'np.ndarray',
+                             probabilities: Optional['np.ndarray'] = None, model_version: str = '',
+                             metrics: Optional[PipelineMetrics] = None, content_hash: str = '',
+                             history_metrics: Optional[dict] = None):
+        metrics = metrics or PipelineMetrics()
+        with metrics.stage(STAGE_SERIALIZE):
+            features_path = storage.save_features(analysis)
+            summary = storage.summarize(analysis, predictions, probabilities)
+
+        return cls.create_from_summary(device_id, features_path, summary, model_version=model_version,
+                                       metrics=metrics, content_hash=content_hash, history_metrics=history_metrics)
+
+    @classmethod
+    def create_from_summary(cls, device_id: int, features_path: str, summary: dict, model_version: str = '',
+                            metrics: Optional[PipelineMetrics] = None, content_hash: str = '',
+                            history_metrics: Optional[dict] = None):
+        metrics = metrics or PipelineMetrics()
+        with metrics.stage(STAGE_DB_INSERT):
+            return cls.objects.create(
+                device_id=device_id,
+                features_path=features_path,
+                model_version=model_version or '',
+                content_hash=content_hash,
+                metrics=history_metrics or {},
+                **summary,
+            )
+
+    def load_features(self) -> Optional['pd.DataFrame']:
+        if not self.features_path:
+            return None
+
+        return storage.load_features(self.features_path)
+
+    def iter_features(self, chunk_rows: int) -> Iterator['pd.DataFrame']:
+        if self.features_path:
+            yield from storage.iter_features(self.features_path, chunk_rows)
+
     def analyze_history(self, stats: dict):
-        result = self.result
         stats['analysis_count'] += 1
 
-        try:
-            result_json = json.loads(result)
-            stats['prediction_score_sum'] += result_json.get('prediction_score', 0)
+        if self.prediction_score is not None:
+            stats['prediction_score_sum'] += self.prediction_score
             stats['prediction_score_count'] += 1
-            stats['payload_count'] = sum(
-                1 for i in result_json.get('analysis', list()) if i.get('has_file_payload')
-            )
-            stats['packet_length'] += sum(
-                i.get('packet_length', 0) for i in result_json.get('analysis', list())
-            ) // 10 ** 6
-        except:  # noqa
-            pass
+
+        stats['payload_count'] += self.payload_count
+        stats['packet_length'] += self.bytes_total // 10 ** 6
 
         return stats
+
+
+class DeviceAnalysisStats(models.Model):
+
+    device = models.OneToOneField(Device, primary_key=True, on_delete=models.CASCADE, related_name='analysis_stats',
+                                  verbose_name=_('Device'))
+    analysis_count = models.IntegerField(default=0, verbose_name=_('Analysis count'))
+    prediction_score_sum = models.FloatField(default=0, verbose_name=_('Prediction score sum'))
+    prediction_score_count = models.IntegerField(default=0, verbose_name=_('Prediction score count'))
+    payload_count = models.BigIntegerField(default=0, verbose_name=_('File payload count'))
+    bytes_total = models.BigIntegerField(default=0, verbose_name=_('Traffic volume, bytes'))
+
+    class Meta:
+        verbose_name = 'IoT Device Analysis Stats'
+        verbose_name_plural = 'IoT Device Analysis Stats'
+
+    def __str__(self):
+        return f'Analysis stats: {self.device_id}'
+
+    @classmethod
+    def apply_history(cls, history: DeviceAnalyzeHistory, sign: int = 1):
+        # Счетчики меняются атомарным UPDATE с F-выражениями, параллельные воркеры не теряют обновления
+        if sign > 0:
+            cls.objects.get_or_create(device_id=history.device_id)
+
+        has_score = history.prediction_score is not None
+        cls.objects.filter(device_id=history.device_id).update(
+            analysis_count=models.F('analysis_count') + sign,
+            prediction_score_sum=models.F('prediction_score_sum') + sign * (history.prediction_score or 0),
+            prediction_score_count=models.F('prediction_score_count') + sign * int(has_score),
+            payload_count=models.F('payload_count') + sign * history.payload_count,
+            bytes_total=models.F('bytes_total') + sign * history.bytes_total,
+        )
+
+    def get_overall_stats(self) -> dict:
+        prediction_score_avg = 'Undef.'
+        if self.prediction_score_count > 0:
+            prediction_score_avg = round(self.prediction_score_sum / self.prediction_score_count, 2)
+
+        return {
+            'analysis_count': self.analysis_count,
+            'payload_count': self.payload_count,
+            'packet_length': self.bytes_total // 10 ** 6,
+            'prediction_score_avg': prediction_score_avg,
+        }
+
+
+class AnalysisJob(models.Model):
+
+    STATE_QUEUED = 'queued'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+    STATES = (
+        (STATE_QUEUED, _('Queued')),
+        (STATE_RUNNING, _('Running')),
+        (STATE_DONE, _('Done')),
+        (STATE_FAILED, _('Failed')),
+    )
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, verbose_name=_('Device'))
+    pcap_file = models.FileField(upload_to='analysis_jobs/', verbose_name=_('PCAP file'))
+    profile = models.BooleanField(default=False, verbose_name=_('Capture cProfile'))
+    content_hash = models.CharField(max_length=64, blank=True, default='', verbose_name=_('Capture SHA-256'))
+    state = models.CharField(max_length=10, choices=STATES, default=STATE_QUEUED, db_index=True,
+                             verbose_name=_('State'))
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name=_('Progress, %'))
+    error = models.TextField(blank=True, default='', verbose_name=_('Error'))
+    history = models.ForeignKey(DeviceAnalyzeHistory, null=True, blank=True, on_delete=models.SET_NULL,
+                                verbose_name=_('Analysis result'))
+    created_date = models.DateTimeField(auto_now_add=True, verbose_name=_('Create datetime'))
+    updated_date = models.DateTimeField(auto_now=True, verbose_name=_('Update datetime'))
+
+    class Meta:
+        verbose_name = 'IoT Network Analysis Job'
+        verbose_name_plural = 'IoT Network Analysis Jobs'
+
+    def __str__(self):
+        return f'Analysis job: {self.device} ({self.state})'
+
+
+class PipelineMetric(models.Model):
+
+    # Накопленные метрики конвейера всех воркеров для /metrics: счетчик или максимум по стадии
+    name = models.CharField(max_length=64, verbose_name=_('Metric name'))
+    stage = models.CharField(max_length=32, blank=True, default='', verbose_name=_('Pipeline stage'))
+    value = models.FloatField(default=0, verbose_name=_('Value'))
+
+    class Meta:
+        verbose_name = 'Pipeline Metric'
+        verbose_name_plural = 'Pipeline Metrics'
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'stage'], name='unique_pipeline_metric'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{{{self.stage}}} = {self.value}'
+
+    @classmethod
+    def apply_metrics(cls, metrics: dict):
+        # Как и DeviceAnalysisStats, значения меняются атомарным UPDATE - воркеры не теряют обновления
+        values = [('analysis', '', 1, False), ('peak_rss_mb', '', metrics.get('peak_rss_mb', 0), True)]
+        for stage, stage_metrics in metrics.get('stages', {}).items():
+            values.append(('stage_wall_seconds', stage, stage_metrics['wall_seconds'], False))
+            values.append(('stage_cpu_seconds', stage, stage_metrics['cpu_seconds'], False))
+        values.extend((name, '', value, False) for name, value in metrics.get('counters', {}).items())
+
+        for name, stage, value, is_max in values:
+            new_value = Greatest(models.F('value'), value) if is_max else models.F('value') + value
+            if not cls.objects.filter(name=name, stage=stage).update(value=new_value):
+                cls.objects.get_or_create(name=name, stage=stage)
+                cls.objects.filter(name=name, stage=stage).update(value=new_value)
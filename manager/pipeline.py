@@ -0,0 +1,83 @@
+import importlib
+import sys
+import time
+from typing import Dict, List, Optional
+
+from core import DatasetType
+
+
+# Анализатор и ML-стек (scapy, pandas, numpy, sklearn) импортируются при первом обращении к атрибуту модуля:
+# процессам, которые ничего не анализируют (check, migrate, страницы без анализа), они не нужны
+LAZY_ATTRIBUTES = {
+    'NetworkAnalyzer': 'core.analyzer.network',
+    'NetworkUtilsService': 'core.analyzer.network',
+    'Predictor': 'core.ml.predictor',
+    'ModelRegistry': 'core.ml.registry',
+    'DatasetStore': 'core.ml.store',
+    'pd': 'pandas',
+    'np': 'numpy',
+}
+MODULE_ALIASES = ('pd', 'np')
+
+HEAVY_MODULES = ('numpy', 'pandas', 'scapy', 'sklearn', 'core.analyzer.network', 'core.ml.predictor')
+
+
+def __getattr__(name: str):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    return load(name)
+
+
+def load(name: str):
+    if name in globals():
+        return globals()[name]
+
+    module = importlib.import_module(LAZY_ATTRIBUTES[name])
+    value = module if name in MODULE_ALIASES else getattr(module, name)
+    # Следующие обращения идут мимо __getattr__
+    globals()[name] = value
+    return value
+
+
+def get_loaded_heavy_modules() -> List[str]:
+    return [module for module in HEAVY_MODULES if module in sys.modules]
+
+
+def warm_up(model: bool = True, mac_vendors: bool = True, ip_tables: bool = True) -> Dict[str, Optional[float]]:
+    # Загружает все, что иначе грузится на первом анализе. Вызывается до приема трафика:
+    # в родителе перед fork воркеров страницы памяти делятся между процессами
+    timings = {}
+
+    started_at = time.perf_counter()
+    for name in LAZY_ATTRIBUTES:
+        load(name)
+    timings['imports'] = time.perf_counter() - started_at
+
+    if ip_tables:
+        started_at = time.perf_counter()
+        load('NetworkUtilsService').get_suspicious_ip_ranges()
+        timings['ip_tables'] = time.perf_counter() - started_at
+
+    if mac_vendors:
+        started_at = time.perf_counter()
+        load('NetworkUtilsService').get_mac_vendor_index()
+        timings['mac_vendors'] = time.perf_counter() - started_at
+
+    if model:
+        timings['model'] = warm_up_model()
+
+    return timings
+
+
+def warm_up_model() -> Optional[float]:
+    started_at = time.perf_counter()
+    try:
+        predictor = load('Predictor')(DatasetType.NETWORK, output_feature='is_malicious')
+    except (FileNotFoundError, OSError):
+        # Модель еще не обучена - прогревать нечего
+        return None
+
+    # Пустая строка проходит весь путь предсказания и подтягивает страницы отображенной в память модели
+    predictor.predict_batch(load('np').full((1, len(predictor.features)), float('nan')))
+    return time.perf_counter() - started_at
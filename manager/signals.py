@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from manager import storage
+from manager.models import DeviceAnalysisStats, DeviceAnalyzeHistory
+
+
+@receiver(post_save, sender=DeviceAnalyzeHistory)
+def add_history_to_stats(sender, instance: DeviceAnalyzeHistory, created: bool, **kwargs):
+    if created:
+        DeviceAnalysisStats.apply_history(instance)
+
+
+@receiver(post_delete, sender=DeviceAnalyzeHistory)
+def remove_history_from_stats(sender, instance: DeviceAnalyzeHistory, **kwargs):
+    DeviceAnalysisStats.apply_history(instance, sign=-1)
+
+
+@receiver(post_delete, sender=DeviceAnalyzeHistory)
+def delete_history_features(sender, instance: DeviceAnalyzeHistory, **kwargs):
+    features_path = instance.features_path
+    if not features_path:
+        return
+
+    # Переиспользованные анализы делят файл признаков - он удаляется вместе с последней ссылающейся записью
+    def delete_unreferenced():
+        if not DeviceAnalyzeHistory.objects.filter(features_path=features_path).exists():
+            storage.delete_features(features_path)
+
+    transaction.on_commit(delete_unreferenced)
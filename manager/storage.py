@@ -0,0 +1,193 @@
+import shutil
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List, Optional, Set
+
+from django.conf import settings
+
+from manager import pipeline
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+
+SCORE_HISTOGRAM_BINS = 10
+TOP_PORTS_COUNT = 10
+PROTOCOL_NAMES = {1: 'icmp', 6: 'tcp', 17: 'udp'}
+# Признаки, из которых строится сводка истории: извлекаются, даже если модели они не нужны
+SUMMARY_FEATURES = ('packet_length', 'has_file_payload', 'proto', 'dest_port')
+FEATURES_SUFFIX = '.data'
+LEGACY_FEATURES_SUFFIX = '.npz'
+FEATURES_GRACE_SECONDS = 60 * 60
+
+
+def get_storage_dir() -> Path:
+    return Path(getattr(settings, 'ANALYSIS_STORAGE_DIR', Path(settings.MEDIA_ROOT) / 'analysis'))
+
+
+def get_stored_features(required_features: List[str]) -> Optional[List[str]]:
+    # Анализ извлекает только признаки модели и сводки, остальных колонок в сохраненных признаках нет.
+    # ANALYSIS_PRUNE_FEATURES = False возвращает полный набор
+    if not getattr(settings, 'ANALYSIS_PRUNE_FEATURES', True):
+        return None
+
+    return list(required_features) + [feature for feature in SUMMARY_FEATURES if feature not in required_features]
+
+
+class FeatureWriter:
+
+    # Признаки пишутся батчами в колоночное хранилище (каталог с .npy по шардам): в памяти только текущий батч,
+    # а читать их можно кусками через отображение в память
+    SHARD_ROWS = 100000
+
+    def __init__(self):
+        self.features_path = f'{uuid.uuid4().hex}{FEATURES_SUFFIX}'
+        self._writer = None
+
+    def write(self, analysis: 'pd.DataFrame'):
+        if self._writer is None:
+            store = pipeline.DatasetStore(get_storage_dir() / self.features_path)
+            store.create([(column, str(dtype)) for column, dtype in analysis.dtypes.items()])
+            self._writer = store.writer(shard_rows=self.SHARD_ROWS)
+
+        self._writer.write(analysis)
+
+    def close(self) -> str:
+        if self._writer is not None:
+            self._writer.flush()
+        return self.features_path
+
+    def discard(self):
+        self._writer = None
+        shutil.rmtree(get_storage_dir() / self.features_path, ignore_errors=True)
+
+
+class SummaryAccumulator:
+
+    # Сводка истории по батчам: хранятся только счетчики, итог совпадает с summarize по всему анализу
+    def __init__(self):
+        self.packet_count = 0
+        self._bytes_total = 0
+        self._payload_count = 0
+        self._protocols = Counter()
+        self._ports = Counter()
+        self._predictions_sum = 0.
+        self._predictions_count = 0
+        self._histogram = None
+
+    def add(self, analysis: 'pd.DataFrame', predictions: Optional['np.ndarray'] = None,
+            probabilities: Optional['np.ndarray'] = None):
+        self.packet_count += len(analysis)
+        if 'packet_length' in analysis:
+            self._bytes_total += int(analysis['packet_length'].sum())
+        if 'has_file_payload' in analysis:
+            self._payload_count += int(analysis['has_file_payload'].sum())
+
+        if 'proto' in analysis:
+            for proto, count in analysis['proto'].value_counts(dropna=False).items():
+                name = 'non_ip' if pipeline.pd.isna(proto) else PROTOCOL_NAMES.get(int(proto), str(int(proto)))
+                self._protocols[name] += int(count)
+
+        if 'dest_port' in analysis:
+            ports = analysis['dest_port'].value_counts()
+            self._ports.update({str(int(port)): int(count) for port, count in ports.items()})
+
+        if predictions is not None and len(predictions):
+            self._predictions_sum += float(pipeline.np.sum(predictions))
+            self._predictions_count += len(predictions)
+
+        if probabilities is not None and len(probabilities):
+            histogram, _ = pipeline.np.histogram(probabilities, bins=SCORE_HISTOGRAM_BINS, range=(0, 1))
+            self._histogram = histogram if self._histogram is None else self._histogram + histogram
+
+    def result(self) -> dict:
+        summary = {
+            'packet_count': self.packet_count,
+            'bytes_total': self._bytes_total,
+            'payload_count': self._payload_count,
+            'protocol_breakdown': dict(self._protocols.most_common()),
+            'port_breakdown': dict(self._ports.most_common(TOP_PORTS_COUNT)),
+            'score_histogram': [] if self._histogram is None else self._histogram.tolist(),
+        }
+        if self._predictions_count:
+            summary['prediction_score'] = self._predictions_sum / self._predictions_count
+
+        return summary
+
+
+def save_features(analysis: 'pd.DataFrame') -> str:
+    writer = FeatureWriter()
+    writer.write(analysis)
+    return writer.close()
+
+
+def delete_features(features_path: str):
+    path = get_storage_dir() / features_path
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def cleanup_features(referenced_paths: Set[str], max_age: float = FEATURES_GRACE_SECONDS) -> List[Path]:
+    # Файлы признаков без записи истории: оставшиеся после удаления записей, отката миграции или падения воркера.
+    # Свежие файлы не трогаем - их может еще дописывать анализ, запись истории для которого пока не создана
+    storage_dir = get_storage_dir()
+    if not storage_dir.exists():
+        return []
+
+    removed = []
+    expire_before = time.time() - max_age
+    for path in storage_dir.iterdir():
+        if path.suffix not in (FEATURES_SUFFIX, LEGACY_FEATURES_SUFFIX) or path.name in referenced_paths:
+            continue
+        if path.stat().st_mtime >= expire_before:
+            continue
+        delete_features(path.name)
+        removed.append(path)
+
+    return removed
+
+
+def save_profile(profiler) -> str:
+    storage_dir = get_storage_dir()
+    storage_dir.mkdir(parents=True, exist_ok=True)
+
+    # Файл pstats: открывается через python -m pstats или snakeviz
+    profile_path = f'{uuid.uuid4().hex}.prof'
+    profiler.dump_stats(str(storage_dir / profile_path))
+
+    return profile_path
+
+
+def load_features(features_path: str) -> 'pd.DataFrame':
+    # Записи до перехода на колоночное хранилище ссылаются на сжатый .npz
+    if features_path.endswith(LEGACY_FEATURES_SUFFIX):
+        with pipeline.np.load(get_storage_dir() / features_path) as features:
+            return pipeline.pd.DataFrame({column: features[column] for column in features.files})
+
+    return pipeline.DatasetStore(get_storage_dir() / features_path).read()
+
+
+def iter_features(features_path: str, chunk_rows: int) -> Iterator['pd.DataFrame']:
+    # Колонки отображаются в память, в каждый кусок копируются только его строки
+    if features_path.endswith(LEGACY_FEATURES_SUFFIX):
+        # Сжатый .npz так читать нельзя - старые записи загружаются целиком
+        analysis = load_features(features_path)
+        for start in range(0, len(analysis), chunk_rows):
+            yield analysis.iloc[start:start + chunk_rows]
+        return
+
+    store = pipeline.DatasetStore(get_storage_dir() / features_path)
+    for chunk in store.iter_column_chunks(store.columns, chunk_rows):
+        yield pipeline.pd.DataFrame(chunk)
+
+
+def summarize(analysis: 'pd.DataFrame', predictions: Optional['np.ndarray'] = None,
+              probabilities: Optional['np.ndarray'] = None) -> dict:
+    accumulator = SummaryAccumulator()
+    accumulator.add(analysis, predictions, probabilities)
+    return accumulator.result()
@@ -1,3 +1,1019 @@
-from django.test import TestCase
+import functools
+import json
+import pickle
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from typing import Optional
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from scapy.layers.inet import IP, TCP, UDP, ICMP
+from scapy.layers.inet6 import IPv6
+from scapy.layers.l2 import ARP, Dot1Q, Dot3, Ether, LLC
+from scapy.packet import Raw
+from scapy.utils import wrpcap, wrpcapng
+from sklearn import tree
+
+from core.analyzer.addresses import IPv4RangeSet
+from core.analyzer.base import ExtractorPipeline, dump_analysis
+from core.analyzer.cache import FeatureCache
+from core.analyzer.decoder import PcapFrameReader, PcapTailReader
+from core.analyzer.flows import FlowAnalyzer
+from core.analyzer.network import NetworkAnalyzer, NetworkUtilsService
+from core.analyzer.synthetic import SyntheticPcapWriter
+from core.analyzer.vendors import MacVendorIndex
+from core.management.analyze_and_train import analyze_capture, build_dataset
+from core.ml.compiled import CompiledTreeModel
+from core.ml.dataset import DataSetMixin
+from core.ml.evaluation import Evaluator
+from core.ml.predictor import Predictor
+from core.ml.registry import ModelRegistry
+from core.ml.sampling import StratifiedReservoir
+from core.ml.store import DatasetStore
+from core.ml.trainer import Trainer
+from manager import benchmarks, ingest, jobs, pipeline, storage
+from manager.live import LIVE_WINDOW_METRIC, DeviceWindow, LiveMonitor
+from manager.models import AnalysisJob, Device, DeviceAnalyzeHistory
+from manager.views import DevicePage, HistoryAnalysisView
+
+
+def build_test_packets():
+    http_response = b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<html>body</html>'
+    return [
+        Ether(src='00:00:0c:01:02:03') / IP(src='192.168.1.5', dst='8.8.8.8') /
+        TCP(sport=80, dport=40000, flags='PA') / Raw(http_response),
+        Ether() / IP(src='10.0.0.1', dst='172.16.5.4') / TCP(sport=1234, dport=8080, flags='S'),
+        Ether() / IP(src='10.0.0.1', dst='8.8.8.8') / UDP(sport=5353, dport=53) / Raw(b'x' * 40),
+        Ether() / IP(src='1.2.3.4', dst='5.6.7.8') / TCP(sport=443, dport=5555) / Raw(b'\x16\x03\x01' * 10),
+        Ether() / IP(dst='127.0.0.1') / ICMP(),
+        Ether() / ARP(),
+        Ether() / Dot1Q() / IP(frag=5) / TCP(),
+        Ether() / IP() / IP() / UDP(),
+        Ether() / IPv6() / TCP(sport=80) / Raw(b'HTTP/1.1 200 OK\r\n\r\nbody'),
+        Ether() / IP() / TCP(dport=80) / Raw(b'HTTP/1.1 204 No Content\r\nServer: test\r\n\r\n'),
+        Dot3() / LLC(),
+    ]
+
+
+class NetworkAnalyzerEngineTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+
+    def _write(self, name: str, writer) -> str:
+        path = str(Path(self._tmp_dir.name) / name)
+        writer(path, build_test_packets())
+        return path
+
+    def test_raw_engine_matches_scapy_engine(self):
+        for path in (self._write('test.pcap', wrpcap), self._write('test.pcapng', wrpcapng)):
+            with self.subTest(path=path):
+                expected = NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_SCAPY).analyze(path)
+                actual = NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_RAW).analyze(path)
+
+                self.assertEqual(len(expected), len(build_test_packets()) - 1)
+                self.assertEqual(expected, actual)
+
+    def test_raw_engine_matches_scapy_engine_on_tunnelled_ipv4(self):
+        path = str(Path(self._tmp_dir.name) / 'tunnel.pcap')
+        wrpcap(path, [
+            Ether() / IPv6() / IP(src='10.0.0.1', dst='8.8.8.8', ttl=7) / UDP(sport=5353, dport=53) / Raw(b'abc'),
+            Ether() / IPv6() / IPv6() / IP(src='8.8.8.8', dst='192.168.1.2') / TCP(sport=443, dport=50000),
+            Ether() / IP(src='10.0.0.1') / IPv6() / IP(src='8.8.8.8', ttl=3) / UDP(),
+        ])
+        expected = NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_SCAPY).analyze(path)
+        actual = NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_RAW).analyze(path)
+
+        self.assertEqual([row['ttl'] for row in expected], [7, 64, 64])
+        self.assertEqual(expected, actual)
+
+    def test_raw_engine_reads_file_objects(self):
+        path = self._write('test.pcap', wrpcap)
+        with open(path, 'rb') as f:
+            actual = NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_RAW).analyze(f)
+
+        self.assertEqual(NetworkAnalyzer().analyze(path), actual)
+
+    def test_iter_analyze_yields_bounded_batches(self):
+        path = self._write('test.pcap', wrpcap)
+        batches = list(NetworkAnalyzer(batch_size=3).iter_analyze(path))
+
+        self.assertTrue(all(len(batch) <= 3 for batch in batches))
+        self.assertEqual(sum(batches, []), NetworkAnalyzer().analyze(path))
+
+    def test_analyze_columnar_follows_feature_schema(self):
+        path = self._write('test.pcap', wrpcap)
+        rows = NetworkAnalyzer().analyze(path)
+        frame = NetworkAnalyzer().analyze_columnar(path)
+
+        self.assertEqual(list(frame.columns), NetworkAnalyzer.get_feature_names())
+        self.assertEqual(len(frame), len(rows))
+        self.assertEqual(frame['packet_length'].tolist(), [row['packet_length'] for row in rows])
+        self.assertEqual(frame['src_port'].isna().tolist(), ['src_port' not in row for row in rows])
+
+    def test_payload_features_for_both_engines(self):
+        packets = [
+            Ether() / IP() / TCP(sport=80, flags='PA') / Raw(b'HTTP/1.1 200 OK\r\nServer: x\r\n\r\n%PDF-1.7 ...'),
+            Ether() / IP() / UDP(dport=9999) / Raw(b'\x7fELF' + bytes(range(256)) * 4),
+            Ether() / IP() / TCP(flags='S'),
+        ]
+        path = str(Path(self._tmp_dir.name) / 'payload.pcap')
+        wrpcap(path, packets)
+
+        for engine in NetworkAnalyzer.ENGINES:
+            with self.subTest(engine=engine):
+                http, udp, syn = NetworkAnalyzer(engine=engine).analyze(path)
+
+                self.assertEqual(http['payload_magic'], 3)
+                self.assertTrue(http['has_file_payload'])
+                self.assertEqual(http['payload_printable_ratio'], 1.0)
+                self.assertEqual((udp['payload_magic'], udp['payload_length']), (2, 1028))
+                # Разбирается только начало нагрузки: 4 байта сигнатуры и 508 байт 0..255
+                self.assertAlmostEqual(udp['payload_entropy'], 7.994, places=3)
+                self.assertEqual(syn['payload_length'], 0)
+                self.assertNotIn('payload_entropy', syn)
+
+    def test_extractors_are_selected_by_required_features(self):
+        path = self._write('test.pcap', wrpcap)
+        full = NetworkAnalyzer().analyze_columnar(path)
+
+        for engine in NetworkAnalyzer.ENGINES:
+            with self.subTest(engine=engine):
+                analyzer = NetworkAnalyzer(engine=engine, features=['ttl', 'is_src_suspicious'])
+                frame = analyzer.analyze_columnar(path)
+
+                self.assertEqual(analyzer._extractor_pipeline.names,
+                                 ['layers', 'ip_header', 'ip_addresses', 'ip_suspicious'])
+                self.assertEqual(list(frame.columns), analyzer.get_selected_feature_names())
+                self.assertNotIn('payload_entropy', frame)
+                pd.testing.assert_frame_equal(frame, full[frame.columns])
+
+        rows = NetworkAnalyzer(features=['packet_length']).analyze(path)
+        self.assertEqual(rows, [{'packet_length': row['packet_length']} for row in NetworkAnalyzer().analyze(path)])
+
+    def test_extractor_dependencies_must_be_registered(self):
+        with self.assertRaises(ValueError):
+            ExtractorPipeline(NetworkAnalyzer.EXTRACTORS[2:], features=['ttl'])
+
+
+class FlowAnalyzerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+
+    def _write(self, packets: list, timestamps: Optional[list] = None) -> str:
+        for packet, timestamp in zip(packets, timestamps or range(len(packets))):
+            packet.time = 1700000000 + timestamp
+        path = str(Path(self._tmp_dir.name) / 'flows.pcap')
+        wrpcap(path, packets)
+        return path
+
+    def test_packets_are_grouped_by_bidirectional_five_tuple(self):
+        client = Ether() / IP(src='192.168.1.5', dst='8.8.8.8')
+        server = Ether() / IP(src='8.8.8.8', dst='192.168.1.5')
+        path = self._write([
+            client / TCP(sport=40000, dport=443, flags='S'),
+            server / TCP(sport=443, dport=40000, flags='SA'),
+            client / TCP(sport=40000, dport=443, flags='PA') / Raw(b'x' * 100),
+            client / UDP(sport=5353, dport=53) / Raw(b'query'),
+            Ether() / ARP(),
+        ])
+
+        flows = sorted(FlowAnalyzer().analyze(path), key=lambda flow: flow['proto'])
+
+        self.assertEqual(len(flows), 2)
+        tcp_flow, udp_flow = flows
+        self.assertEqual((tcp_flow['src_port'], tcp_flow['dest_port']), (40000, 443))
+        self.assertEqual((tcp_flow['fwd_packet_count'], tcp_flow['bwd_packet_count']), (2, 1))
+        self.assertEqual((tcp_flow['syn_count'], tcp_flow['ack_count'], tcp_flow['psh_count']), (2, 2, 1))
+        self.assertEqual(tcp_flow['payload_byte_count'], 100)
+        self.assertAlmostEqual(tcp_flow['duration'], 2)
+        self.assertAlmostEqual(tcp_flow['iat_mean'], 1)
+        self.assertTrue(tcp_flow['is_src_ip_private'])
+        self.assertEqual(udp_flow['packet_count'], 1)
+        self.assertNotIn('iat_mean', udp_flow)
+
+    def test_flows_are_split_by_timeouts_and_table_size(self):
+        packets = [Ether() / IP(src='10.0.0.1', dst='10.0.0.2') / UDP(sport=1000, dport=2000) for _ in range(4)]
+        path = self._write(packets, timestamps=[0, 1, 100, 101])
+
+        self.assertEqual([flow['packet_count'] for flow in FlowAnalyzer(idle_timeout=10).analyze(path)], [2, 2])
+        self.assertEqual(len(FlowAnalyzer(idle_timeout=1000, active_timeout=1).analyze(path)), 4)
+
+        path = self._write([Ether() / IP() / UDP(sport=port) for port in range(10)])
+        flows = FlowAnalyzer(max_flows=3, batch_size=2).iter_analyze(path)
+        batches = list(flows)
+        self.assertEqual(sum(len(batch) for batch in batches), 10)
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+
+    def test_analyze_columnar_follows_feature_schema(self):
+        path = self._write(build_test_packets())
+        frame = FlowAnalyzer().analyze_columnar(path)
+
+        self.assertEqual(list(frame.columns), FlowAnalyzer.get_feature_names())
+        self.assertEqual(frame['packet_count'].sum(), len(build_test_packets()) - 2)
+
+
+class FeatureCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+        self.cache_dir = str(Path(self._tmp_dir.name) / 'cache')
+
+        # Анализатор подменен: вместо разбора захвата - строка с размером файла
+        analyze = mock.patch.object(
+            NetworkAnalyzer, 'analyze_columnar', autospec=True,
+            side_effect=lambda analyzer, path: analyzer.to_columnar([{'packet_length': Path(path).stat().st_size}]),
+        )
+        self.analyze = analyze.start()
+        self.addCleanup(analyze.stop)
+
+    def _write_capture(self, name: str, size: int) -> str:
+        path = Path(self._tmp_dir.name) / name
+        path.write_bytes(b'x' * size)
+        return str(path)
+
+    def _build(self, paths: list) -> list:
+        return [analyze_capture(path, cache_dir=self.cache_dir)['packet_length'].tolist() for path in paths]
+
+    def test_only_new_captures_are_analyzed(self):
+        paths = [self._write_capture('a.pcap', 60), self._write_capture('b.pcap', 70)]
+        self.assertEqual(self._build(paths), [[60], [70]])
+        self.assertEqual(self._build(paths), [[60], [70]])
+        self.assertEqual(self.analyze.call_count, 2)
+
+        paths.append(self._write_capture('c.pcap', 80))
+        self.assertEqual(self._build(paths), [[60], [70], [80]])
+        self.assertEqual([call.args[1] for call in self.analyze.call_args_list], paths)
+
+    def test_schema_version_bump_invalidates_entries(self):
+        paths = [self._write_capture('a.pcap', 60)]
+        self._build(paths)
+        stale_dirs = list(Path(self.cache_dir).iterdir())
+
+        with mock.patch.object(NetworkAnalyzer, 'SCHEMA_VERSION', NetworkAnalyzer.SCHEMA_VERSION + 1):
+            FeatureCache(self.cache_dir, NetworkAnalyzer()).prune()
+            self.assertEqual(self._build(paths), [[60]])
+
+        self.assertEqual(self.analyze.call_count, 2)
+        self.assertEqual(len(stale_dirs), 1)
+        self.assertFalse(stale_dirs[0].exists())
+        self.assertEqual(len(list(Path(self.cache_dir).iterdir())), 1)
+
+
+class DatasetStoreTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+        self.store = DatasetStore(Path(self._tmp_dir.name) / 'network.data')
+        self.store.create([('has_file_payload', 'bool'), ('packet_length', 'int64'), ('src_port', 'float64'),
+                           ('is_malicious', 'int8')], schema_version=3)
+
+    def test_batches_are_appended_with_schema_dtypes(self):
+        batch = pd.DataFrame({'has_file_payload': [True, False], 'packet_length': [60, 1500]})
+        with self.store.writer() as writer:
+            writer.write(batch, is_malicious=1)
+
+        # Новый писатель дописывает шарды, ранее записанные строки сохраняются
+        with DatasetStore(self.store.path).writer(shard_rows=1) as writer:
+            writer.write(batch.assign(src_port=[80.0, 53.0]), is_malicious=0)
+            writer.write(batch.head(1).assign(src_port=[443.0]), is_malicious=0)
+
+        store = DatasetStore(self.store.path)
+        data = store.read()
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.schema_version, 3)
+        self.assertEqual(data.dtypes.astype(str).tolist(), ['bool', 'int64', 'float64', 'int8'])
+        self.assertEqual(data['is_malicious'].tolist(), [1, 1, 0, 0, 0])
+        self.assertEqual(data['src_port'].isna().tolist(), [True, True, False, False, False])
+        self.assertEqual([len(shard) for shard in store.iter_shards(['packet_length'])], [2, 2, 1])
+
+    def test_missing_required_column_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.store.writer().write(pd.DataFrame({'packet_length': [60]}), is_malicious=1)
+
+    def test_dump_analysis_appends_to_csv(self):
+        dataset_path = str(Path(self._tmp_dir.name) / 'network.csv')
+        dump_analysis([{'packet_length': 60}], dataset_path, is_malicious=1)
+        dump_analysis([{'packet_length': 70}], dataset_path, is_malicious=0, append=True)
+
+        data = pd.read_csv(dataset_path, sep=';')
+        self.assertEqual(data.to_dict('list'), {'packet_length': [60, 70], 'is_malicious': [1, 0]})
+
+    def _write_captures(self, packet_counts: list) -> list:
+        captures = []
+        for index, count in enumerate(packet_counts):
+            path = str(Path(self._tmp_dir.name) / f'capture-{index}.pcap')
+            wrpcap(path, [Ether() / IP() / UDP() / Raw(b'x' * index)] * count)
+            captures.append((path, index % 2))
+
+        return captures
+
+    def test_dataset_is_built_in_capture_order(self):
+        # Большие захваты идут первыми и завершаются последними; файлов больше, чем окно задач
+        captures = self._write_captures([400, 1, 200, 3, 2, 1])
+        dataset_path = str(Path(self._tmp_dir.name) / 'built.csv')
+
+        self.assertEqual(build_dataset(captures, dataset_path, workers=2), [])
+        data = DatasetStore(DatasetStore.get_store_path(dataset_path)).read()
+        first_rows = data.drop_duplicates('packet_length')
+        self.assertEqual(len(data), 607)
+        self.assertEqual(first_rows['packet_length'].tolist(), [42 + index for index in range(6)])
+        self.assertEqual(first_rows['is_malicious'].tolist(), [0, 1, 0, 1, 0, 1])
+
+    def test_failed_capture_is_reported_and_skipped(self):
+        captures = self._write_captures([5, 1, 2])
+        Path(captures[1][0]).write_bytes(b'not a capture')
+        dataset_path = str(Path(self._tmp_dir.name) / 'built.csv')
+
+        self.assertEqual(build_dataset(captures, dataset_path, workers=2), [captures[1][0]])
+        data = DatasetStore(DatasetStore.get_store_path(dataset_path)).read()
+        self.assertEqual(data['packet_length'].tolist(), [42] * 5 + [44] * 2)
+
+
+class TrainerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+        dataset_path = Path(self._tmp_dir.name) / 'network-test.csv'
+        dataset_paths = mock.patch.object(DataSetMixin, 'get_dataset_path', return_value=dataset_path)
+        dataset_paths.start()
+        self.addCleanup(dataset_paths.stop)
+        self.addCleanup(ModelRegistry.clear)
+
+        rng = np.random.default_rng(0)
+        ttl = rng.integers(0, 128, 20000)
+        store = DatasetStore(DatasetStore.get_store_path(dataset_path))
+        store.create([('ttl', 'float64'), ('packet_length', 'int64'), ('is_malicious', 'int8')])
+        with store.writer(shard_rows=5000) as writer:
+            writer.write(pd.DataFrame({'ttl': ttl, 'packet_length': rng.integers(60, 1500, 20000)}),
+                         is_malicious=(ttl < 32).astype('int8'))
+
+    def _train(self, **kwargs) -> dict:
+        return Trainer(None, output_feature='is_malicious', variant='test', random_state=0, **kwargs).train()
+
+    def test_reservoir_keeps_class_proportions(self):
+        reservoir = StratifiedReservoir(1000, {0: 9000, 1: 1000}, 1, random_state=0)
+        data = np.arange(10000, dtype=np.float32).reshape(-1, 1)
+        labels = (np.arange(10000) % 10 == 0).astype(int)
+        for start in range(0, 10000, 700):
+            reservoir.add(data[start:start + 700], labels[start:start + 700])
+
+        sample, sample_labels = reservoir.result()
+        self.assertEqual(np.bincount(sample_labels).tolist(), [900, 100])
+        self.assertEqual(len(np.unique(sample)), 1000)
+        self.assertTrue(np.all(labels[sample[:, 0].astype(int)] == sample_labels))
+        self.assertGreater(sample.max(), 9000)
+
+    def test_memory_budget_limits_training_sample(self):
+        report = self._train(memory_budget_mb=0.1)
+
+        self.assertEqual(report['rows_total'], 20000)
+        self.assertLess(report['rows_used'], 3000)
+        # Дерево и служебные структуры не помещаются в 0.1 MB
+        self.assertTrue(report['over_budget'])
+        predictor = Predictor(None, output_feature='is_malicious', variant='test')
+        self.assertEqual(predictor.features, ['ttl', 'packet_length'])
+        self.assertEqual(
+            predictor.predict(pd.DataFrame({'ttl': [10, 100], 'packet_length': [60, 60]})).tolist(), [1, 0]
+        )
+
+    def test_incremental_and_forest_classifiers(self):
+        for classifier in (Trainer.CLASSIFIER_SGD, Trainer.CLASSIFIER_FOREST):
+            with self.subTest(classifier=classifier):
+                report = self._train(classifier=classifier, n_jobs=2)
+                predictor = Predictor(None, output_feature='is_malicious', variant='test')
+                predictions, probabilities = predictor.predict_batch(
+                    pd.DataFrame({'ttl': [1, 120], 'packet_length': [None, 60]})
+                )
+
+                self.assertGreater(report['rows_used'], 10000)
+                self.assertEqual(predictions.tolist(), [1, 0])
+                self.assertEqual(probabilities.shape, (2,))
+
+    def test_split_is_persisted_and_excluded_from_training(self):
+        split = Evaluator(None, output_feature='is_malicious', variant='test').get_split()
+        self.assertEqual((len(split), int(split.test_mask.sum())), (20000, 5000))
+
+        report = self._train()
+        self.assertEqual(report['rows_used'], 15000)
+        self.assertFalse(report['over_budget'])
+        reloaded = Trainer(None, output_feature='is_malicious', variant='test').get_split()
+        self.assertTrue(np.array_equal(reloaded.test_mask, split.test_mask))
+
+    def test_candidates_are_compared_on_held_out_split(self):
+        evaluator = Evaluator(None, output_feature='is_malicious', variant='test')
+        results = evaluator.compare({
+            'tree': dict(random_state=0),
+            'tree-length': dict(features=['packet_length'], random_state=0),
+        })
+
+        self.assertEqual(results['candidate'].tolist(), ['tree', 'tree-length'])
+        self.assertEqual(results['test_rows'].tolist(), [5000, 5000])
+        self.assertEqual(results.loc[0, 'accuracy'], 1.0)
+        self.assertLess(results.loc[1, 'f1'], 0.5)
+        self.assertTrue((results['model_size_kb'] > 0).all())
+
+        evaluator.compare({'sgd': dict(classifier=Trainer.CLASSIFIER_SGD)})
+        table = pd.read_csv(evaluator.get_results_path(), sep=';')
+        self.assertEqual(table['candidate'].tolist(), ['tree', 'tree-length', 'sgd'])
+
+    def test_required_features_are_the_ones_used_in_splits(self):
+        self._train()
+        predictor = Predictor(None, output_feature='is_malicious', variant='test')
+
+        self.assertEqual(predictor.get_required_features(), ['ttl'])
+        self.assertEqual(predictor.get_required_features(min_importance=0.99), ['ttl'])
+
+    def test_registry_reloads_a_replaced_artifact(self):
+        self._train()
+        first = ModelRegistry.get(None, output_feature='is_malicious', variant='test')
+        self.assertIs(ModelRegistry.get(None, output_feature='is_malicious', variant='test'), first)
+
+        model = tree.DecisionTreeClassifier().fit(np.array([[0., 60.], [100., 60.]]), [0, 1])
+        with mock.patch('core.ml.registry.time.strftime', return_value='29991231000000'):
+            ModelRegistry.dump(model, None, ['ttl', 'packet_length'], 'is_malicious', variant='test')
+
+        # Новый артефакт подхватывается по mtime, датасет при этом не читается и модель не обучается
+        with mock.patch.object(pd, 'read_csv', side_effect=AssertionError), \
+                mock.patch.object(DatasetStore, 'read', side_effect=AssertionError), \
+                mock.patch.object(Trainer, 'fit', side_effect=AssertionError):
+            second = ModelRegistry.get(None, output_feature='is_malicious', variant='test')
+            predictor = Predictor(None, output_feature='is_malicious', variant='test')
+
+        self.assertNotEqual(second.mtime, first.mtime)
+        self.assertEqual(second.version, '29991231000000')
+        self.assertEqual(predictor.model_version, '29991231000000')
+        self.assertEqual(predictor.predict(np.array([[0., 60.], [100., 60.]])).tolist(), [0, 1])
+
+    def test_version_is_read_without_loading_the_model(self):
+        self._train()
+        version = ModelRegistry.get(None, output_feature='is_malicious', variant='test').version
+        ModelRegistry.clear()
+
+        with mock.patch.object(pickle, 'load') as load, mock.patch.object(CompiledTreeModel, 'load') as load_compiled:
+            self.assertEqual(ModelRegistry.get_version(None, 'test'), version)
+        self.assertFalse(load.called or load_compiled.called)
+
+    def test_batch_and_chunked_predictions_match_the_model(self):
+        self._train()
+        with open(ModelRegistry.get_artifact_path(None, 'test'), 'rb') as f:
+            model = pickle.load(f)['model']
+
+        rng = np.random.default_rng(2)
+        data = pd.DataFrame({'ttl': rng.integers(0, 128, 1000).astype(float), 'packet_length': 60})
+        data.loc[::9, 'ttl'] = np.nan
+        predictor = Predictor(None, output_feature='is_malicious', variant='test')
+        predictions, probabilities = predictor.predict_batch(data)
+
+        self.assertEqual(predictions.tolist(), model.predict(data.to_numpy()).tolist())
+        self.assertEqual(predictor.predict(data.to_dict('records')).tolist(), predictions.tolist())
+        self.assertTrue(np.allclose(probabilities, model.predict_proba(data.to_numpy())[:, 1]))
+
+        chunks = list(predictor.predict_chunks(data.iloc[start:start + 300] for start in range(0, 1000, 300)))
+        self.assertEqual([len(chunk_predictions) for chunk_predictions, _ in chunks], [300, 300, 300, 100])
+        self.assertTrue(np.array_equal(np.concatenate([chunk for chunk, _ in chunks]), predictions))
+        self.assertTrue(np.array_equal(np.concatenate([chunk for _, chunk in chunks]), probabilities))
+
+    def test_single_class_model_scores_zero_probability(self):
+        model = tree.DecisionTreeClassifier().fit(np.zeros((4, 1)), [0, 0, 0, 0])
+        predictions, probabilities = Predictor.predict_matrix(model, np.zeros((3, 1)))
+
+        self.assertEqual(predictions.tolist(), [0, 0, 0])
+        self.assertEqual(probabilities.tolist(), [0, 0, 0])
+
+    def test_compiled_trees_match_sklearn(self):
+        rng = np.random.default_rng(1)
+        data = np.column_stack([rng.integers(0, 128, 5000), rng.integers(60, 1500, 5000)]).astype(np.float32)
+        data[::7, 0] = np.nan
+        data[:128, 0] = np.arange(128) - 0.5
+
+        for classifier in (Trainer.CLASSIFIER_TREE, Trainer.CLASSIFIER_FOREST):
+            with self.subTest(classifier=classifier):
+                self._train(classifier=classifier)
+                with open(ModelRegistry.get_artifact_path(None, 'test'), 'rb') as f:
+                    model = pickle.load(f)['model']
+
+                compiled = Predictor(None, output_feature='is_malicious', variant='test')._model
+                self.assertIsInstance(compiled, CompiledTreeModel)
+                self.assertIsInstance(compiled.feature, np.memmap)
+                self.assertTrue(np.array_equal(compiled.predict_proba(data), model.predict_proba(data)))
+                self.assertEqual(compiled.predict(data).tolist(), model.predict(data).tolist())
+
+
+class NetworkUtilsServiceTestCase(SimpleTestCase):
+
+    def test_private_ip_uses_cidr_ranges(self):
+        for ip_address in ('10.1.2.3', '172.16.0.1', '172.31.255.255', '192.168.0.1', '127.0.0.1'):
+            self.assertTrue(NetworkUtilsService.is_private_ip(ip_address), ip_address)
+
+        for ip_address in ('172.100.0.1', '172.32.0.1', '172.2.0.1', '8.8.8.8', '192.169.0.1'):
+            self.assertFalse(NetworkUtilsService.is_private_ip(ip_address), ip_address)
+
+    def test_suspicious_ip_list_is_loaded_from_file(self):
+        self.assertTrue(NetworkUtilsService.is_suspicious_ip('185.220.100.251'))
+        self.assertFalse(NetworkUtilsService.is_suspicious_ip('185.220.100.252'))
+
+    def test_range_set_merges_networks(self):
+        ranges = IPv4RangeSet(['10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25', '1.1.1.1', 'not an address'])
+
+        self.assertEqual(len(ranges), 2)
+        self.assertIn('10.0.1.255', ranges)
+        self.assertIn('1.1.1.1', ranges)
+        self.assertNotIn('10.0.2.0', ranges)
+        self.assertNotIn('1.1.1.2', ranges)
+
+    def test_mac_oui_lookup_uses_index(self):
+        self.assertTrue(NetworkUtilsService.is_authorized_mac_oui('00:00:0c:12:34:56'))
+        self.assertTrue(NetworkUtilsService.is_authorized_mac_oui(b'\x00\x00\x0c\x12\x34\x56'))
+        self.assertEqual(NetworkUtilsService.get_mac_vendor('00-00-0C-12-34-56'), 'Cisco')
+
+        # Вендоры и соседние строки файла больше не дают ложных совпадений
+        self.assertFalse(NetworkUtilsService.is_authorized_mac_oui('Cisco'))
+        self.assertIsNone(NetworkUtilsService.get_mac_vendor('ff:ff:ff:ff:ff:ff'))
+
+    def test_mac_vendor_index_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_path = Path(tmp_dir) / 'vendors.txt'
+            source_path.write_text('00000C\tCisco\nACDE48\tPrivate\n')
+            cache_path = Path(tmp_dir) / 'cache' / 'vendors.marshal'
+
+            index = MacVendorIndex.load(str(source_path), cache_path=str(cache_path))
+            self.assertTrue(cache_path.exists())
+            cached_index = MacVendorIndex.load(str(source_path), cache_path=str(cache_path))
+
+        self.assertEqual(len(cached_index), 2)
+        self.assertEqual(cached_index.get_vendor(0xacde48), 'Private')
+        self.assertEqual(index.get_vendor('ac:de:48:00:11:22'), 'Private')
+
+
+class LiveMonitorTestCase(TestCase):
+
+    def setUp(self):
+        self._media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._media_dir.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self._media_dir.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.device = Device.objects.create(name='camera', ipv4='192.168.1.10')
+        self.predictor = mock.Mock(model_version='test')
+        self.predictor.get_required_features.return_value = ['ttl']
+        self.predictor.predict_batch.side_effect = lambda analysis: (
+            np.zeros(len(analysis)), np.full(len(analysis), .25)
+        )
+
+    def _write_capture(self, count: int = 25) -> str:
+        packets = []
+        for index in range(count):
+            packets.append(Ether() / IP(src='192.168.1.10', dst='8.8.8.8') / UDP(sport=5353, dport=53))
+            packets.append(Ether() / IP(src='10.0.0.1', dst='8.8.8.8') / UDP(sport=5353, dport=53))
+            packets[-2].time = packets[-1].time = 1700000000 + index
+
+        path = str(Path(self._media_dir.name) / 'live.pcap')
+        wrpcap(path, packets)
+        return path
+
+    def _run(self, frames, **kwargs) -> LiveMonitor:
+        monitor = LiveMonitor(frames, predictor=self.predictor, report=lambda line: None, **kwargs)
+        monitor.run()
+        return monitor
+
+    def test_device_windows_are_scored_and_stored(self):
+        monitor = self._run(PcapFrameReader(self._write_capture()), window=10)
+
+        histories = DeviceAnalyzeHistory.objects.filter(device=self.device).order_by('pk')
+        self.assertEqual([history.packet_count for history in histories], [10, 10, 5])
+        self.assertEqual(histories[0].model_version, 'test')
+        self.assertEqual((monitor.stats.scored, monitor.stats.unrouted), (25, 25))
+
+    def test_sliding_windows_overlap(self):
+        self._run(PcapFrameReader(self._write_capture()), window=10, step=5)
+
+        histories = DeviceAnalyzeHistory.objects.filter(device=self.device).order_by('pk')
+        self.assertEqual([history.packet_count for history in histories], [10, 10, 10, 10, 5])
+
+    def test_window_history_past_retention_is_deleted(self):
+        analysis = NetworkAnalyzer.to_columnar([{'packet_length': 60}])
+        old_window = DeviceAnalyzeHistory.create_from_analysis(
+            self.device.pk, analysis, np.zeros(1), history_metrics={LIVE_WINDOW_METRIC: True}
+        )
+        uploaded = DeviceAnalyzeHistory.create_from_analysis(self.device.pk, analysis, np.zeros(1))
+        DeviceAnalyzeHistory.objects.update(created_date=timezone.now() - timedelta(days=2))
+
+        monitor = self._run(PcapFrameReader(self._write_capture()), window=10, retention=24 * 3600)
+
+        histories = DeviceAnalyzeHistory.objects.filter(device=self.device)
+        self.assertFalse(histories.filter(pk=old_window.pk).exists())
+        self.assertTrue(histories.filter(pk=uploaded.pk).exists())
+        self.assertEqual(histories.filter(metrics__live_window=True).count(), 3)
+        self.assertEqual((monitor.stats.windows, monitor.stats.expired), (3, 1))
+
+    def test_window_jumps_over_capture_gap(self):
+        window = DeviceWindow(window=10, step=5)
+        timestamps = np.array([0., 1., 1000003.])
+        window.add(timestamps, pd.DataFrame({'ttl': [64, 64, 32]}), np.zeros(3), np.zeros(3))
+
+        # Без прыжка здесь было бы 200 тысяч пустых окон
+        ready = window.pop_ready(now=1000004.)
+        self.assertEqual([len(analysis) for analysis, _, _ in ready], [2])
+        self.assertEqual(window.window_end, 1000005.)
+
+        ready = window.pop_ready(now=1000020.)
+        self.assertEqual([len(analysis) for analysis, _, _ in ready], [1, 1])
+        self.assertIsNone(window.window_end)
+
+    def test_late_packets_are_shed(self):
+        path = self._write_capture()
+        monitor = self._run(PcapFrameReader(path), max_latency=-1)
+        self.assertEqual((monitor.stats.dropped, monitor.stats.scored), (50, 0))
+
+        monitor = self._run(PcapFrameReader(path), max_latency=-1, overflow='sample', sample_rate=5)
+        self.assertEqual(monitor.stats.scored + monitor.stats.unrouted, 10)
+
+    def test_tail_reader_follows_growing_file(self):
+        path = self._write_capture(count=2)
+        with open(path, 'rb') as f:
+            content = f.read()
+        with open(path, 'wb') as f:
+            # Файл оборван посередине записи - ридер ждет ее окончания
+            f.write(content[:-10])
+
+        def append_rest():
+            time.sleep(.2)
+            with open(path, 'ab') as f:
+                f.write(content[-10:])
+
+        writer = threading.Thread(target=append_rest)
+        writer.start()
+        frames = list(PcapTailReader(path, poll_interval=.05, idle_timeout=1))
+        writer.join()
+
+        self.assertEqual(len(frames), 4)
+
+
+class BenchmarksTestCase(TestCase):
+
+    def test_synthetic_capture_is_reproducible_and_parsable(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        first, second = Path(tmp_dir.name) / 'first.pcap', Path(tmp_dir.name) / 'second.pcap'
+        SyntheticPcapWriter(protocol_mix={'http': 1, 'arp': 1}, seed=3).write(str(first), 200)
+        SyntheticPcapWriter(protocol_mix={'http': 1, 'arp': 1}, seed=3).write(str(second), 200)
+
+        self.assertEqual(first.read_bytes(), second.read_bytes())
+        analysis = NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_RAW).analyze(str(first))
+        self.assertEqual(analysis, NetworkAnalyzer(engine=NetworkAnalyzer.ENGINE_SCAPY).analyze(str(first)))
+        self.assertEqual(len(analysis), 200)
+        self.assertTrue(any(row['has_file_payload'] for row in analysis))
+
+    def test_regressions_follow_metric_direction(self):
+        baseline = {'analyzer': {'packets_per_second': 1000, 'peak_rss_mb': 100, 'packets': 10}}
+        results = {'analyzer': {'packets_per_second': 700, 'peak_rss_mb': 110, 'packets': 5}}
+
+        regressions = benchmarks.find_regressions(results, baseline, threshold=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('analyzer.packets_per_second'))
+        self.assertEqual(benchmarks.find_regressions(results, baseline, threshold=0.5), [])
+
+    def test_pages_are_measured_on_seeded_history(self):
+        results = benchmarks.bench_views(devices=3, history=20, repeat=1)
+
+        self.assertEqual(DeviceAnalyzeHistory.objects.count(), 60)
+        self.assertEqual(results['dashboard_page']['page_queries'], 1)
+        self.assertGreater(results['device_page']['latency_p50_ms'], 0)
+
+    def test_startup_does_not_import_the_analysis_stack(self):
+        stats = benchmarks.measure_startup()
+
+        self.assertEqual(stats['heavy_modules'], [])
+        self.assertGreater(stats['process_seconds'], stats['check_seconds'])
+
+    def test_warm_up_skips_untrained_model(self):
+        with mock.patch.object(pipeline, 'Predictor', side_effect=FileNotFoundError):
+            timings = pipeline.warm_up(mac_vendors=False)
+
+        self.assertEqual(list(timings), ['imports', 'ip_tables', 'model'])
+        self.assertIsNone(timings['model'])
+        self.assertIs(pipeline.NetworkAnalyzer, NetworkAnalyzer)
+        with self.assertRaises(AttributeError):
+            pipeline.Trainer
+
+
+class AnalysisJobTestCase(TestCase):
+
+    def setUp(self):
+        self._media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._media_dir.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self._media_dir.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.device = Device.objects.create(name='camera', ipv4='192.168.1.10')
+
+    def _create_job(self, content: bytes = b'not a capture') -> AnalysisJob:
+        return AnalysisJob.objects.create(
+            device=self.device, pcap_file=SimpleUploadedFile('capture.pcap', content)
+        )
+
+    def test_job_is_claimed_once_in_queue_order(self):
+        first, second = self._create_job(), self._create_job()
+
+        self.assertEqual(jobs.claim_next_job(), first)
+        self.assertEqual(jobs.claim_next_job(), second)
+        self.assertIsNone(jobs.claim_next_job())
+        self.assertEqual(AnalysisJob.objects.filter(state=AnalysisJob.STATE_RUNNING).count(), 2)
+
+    def test_stale_running_job_is_requeued(self):
+        job = self._create_job()
+        self.assertEqual(jobs.claim_next_job(), job)
+        self.assertIsNone(jobs.claim_next_job())
+
+        # Воркер пропал, не продлив аренду
+        AnalysisJob.objects.filter(pk=job.pk).update(updated_date=timezone.now() - timedelta(hours=1))
+        with override_settings(ANALYSIS_JOB_LEASE_SECONDS=3600 * 2):
+            self.assertIsNone(jobs.claim_next_job())
+        self.assertEqual(jobs.claim_next_job(), job)
+        self.assertEqual(AnalysisJob.objects.get(pk=job.pk).state, AnalysisJob.STATE_RUNNING)
+
+    def test_failed_analysis_marks_job_failed(self):
+        self._create_job()
+
+        jobs.run_worker(exit_when_idle=True)
+
+        job = AnalysisJob.objects.get()
+        self.assertEqual(job.state, AnalysisJob.STATE_FAILED)
+        self.assertTrue(job.error)
+        self.assertIsNone(job.history)
+
+    def test_known_capture_is_reused_for_the_same_model_version(self):
+        capture = Path(self._media_dir.name) / 'capture.pcap'
+        wrpcap(str(capture), build_test_packets())
+        other_device = Device.objects.create(name='sensor', ipv4='192.168.1.11')
+
+        predictor = mock.Mock(model_version='v1')
+        predictor.get_required_features.return_value = ['ttl']
+        predictor.predict_batch.side_effect = lambda analysis: (np.zeros(len(analysis)), np.zeros(len(analysis)))
+        with mock.patch.object(pipeline, 'Predictor', return_value=predictor), \
+                mock.patch.object(ingest, 'get_model_version', return_value='v1'), \
+                override_settings(ANALYSIS_STORAGE_DIR=self._media_dir.name):
+            first = ingest.submit_capture(self.device.pk, SimpleUploadedFile('a.pcap', capture.read_bytes()))
+            self.assertEqual(first.state, AnalysisJob.STATE_QUEUED)
+            jobs.run_worker(exit_when_idle=True)
+
+            second = ingest.submit_capture(other_device.pk, SimpleUploadedFile('b.pcap', capture.read_bytes()))
+
+        first.refresh_from_db()
+        self.assertEqual(second.state, AnalysisJob.STATE_DONE)
+        self.assertEqual(second.content_hash, first.content_hash)
+        self.assertEqual(second.history.device, other_device)
+        self.assertEqual(second.history.features_path, first.history.features_path)
+        self.assertEqual(second.history.packet_count, first.history.packet_count)
+        self.assertEqual(predictor.predict_batch.call_count, 1)
+        self.assertEqual(len(list(ingest.get_spool_dir().iterdir())), 1)
+
+        # Другая версия модели - захват анализируется заново
+        with mock.patch.object(ingest, 'get_model_version', return_value='v2'):
+            third = ingest.submit_capture(other_device.pk, SimpleUploadedFile('c.pcap', capture.read_bytes()))
+        self.assertEqual(third.state, AnalysisJob.STATE_QUEUED)
+
+    def test_capture_is_predicted_and_stored_batch_by_batch(self):
+        capture = Path(self._media_dir.name) / 'capture.pcap'
+        wrpcap(str(capture), build_test_packets())
+        job = self._create_job(capture.read_bytes())
+
+        predictor = mock.Mock(model_version='test')
+        predictor.get_required_features.return_value = ['ttl']
+        predictor.predict_batch.side_effect = lambda analysis: (np.ones(len(analysis)), np.full(len(analysis), .9))
+        small_batches = functools.partial(NetworkAnalyzer, batch_size=3)
+        with mock.patch.object(pipeline, 'Predictor', return_value=predictor), \
+                mock.patch.object(pipeline, 'NetworkAnalyzer', small_batches), \
+                override_settings(ANALYSIS_STORAGE_DIR=self._media_dir.name):
+            jobs.run_worker(exit_when_idle=True)
+            history = AnalysisJob.objects.get(pk=job.pk).history
+            analysis = history.load_features()
+
+        self.assertGreater(predictor.predict_batch.call_count, 1)
+        self.assertEqual(len(analysis), history.packet_count)
+        summary = storage.summarize(analysis, np.ones(len(analysis)), np.full(len(analysis), .9))
+        self.assertEqual([getattr(history, field) for field in summary], list(summary.values()))
+
+    def test_spool_cleanup_keeps_captures_of_pending_jobs(self):
+        queued = ingest.submit_capture(self.device.pk, SimpleUploadedFile('a.pcap', b'queued capture'))
+        done = ingest.submit_capture(self.device.pk, SimpleUploadedFile('b.pcap', b'done capture'))
+        AnalysisJob.objects.filter(pk=done.pk).update(state=AnalysisJob.STATE_DONE)
+
+        self.assertEqual(ingest.cleanup_spool(), [])
+        removed = ingest.cleanup_spool(max_age=-1)
+
+        self.assertEqual([path.name for path in removed], [Path(done.pcap_file.name).name])
+        self.assertEqual([path.name for path in ingest.get_spool_dir().iterdir()], [Path(queued.pcap_file.name).name])
+
+    def test_pipeline_metrics_are_recorded_and_exposed(self):
+        capture = Path(self._media_dir.name) / 'capture.pcap'
+        wrpcap(str(capture), build_test_packets())
+        job = self._create_job(capture.read_bytes())
+        AnalysisJob.objects.filter(pk=job.pk).update(profile=True)
+        self._create_job(capture.read_bytes())
+
+        predictor = mock.Mock(model_version='test')
+        predictor.get_required_features.return_value = ['ttl']
+        predictor.predict_batch.side_effect = lambda analysis: (np.zeros(len(analysis)), np.zeros(len(analysis)))
+        with mock.patch.object(pipeline, 'Predictor', return_value=predictor), \
+                override_settings(ANALYSIS_STORAGE_DIR=self._media_dir.name):
+            jobs.run_worker(exit_when_idle=True)
+
+        history = AnalysisJob.objects.get(pk=job.pk).history
+        metrics = history.metrics
+        self.assertEqual(
+            set(metrics['stages']), {'parse', 'extract', 'model_load', 'predict', 'serialize', 'db_insert'}
+        )
+        self.assertEqual(metrics['counters']['packets_parsed'], len(build_test_packets()))
+        self.assertEqual(metrics['counters']['packets_parsed'] - metrics['counters']['packets_skipped'],
+                         history.packet_count)
+        self.assertEqual(metrics['counters']['rows_predicted'], history.packet_count)
+        self.assertTrue((Path(self._media_dir.name) / metrics['profile_path']).exists())
+        self.assertTrue(metrics['profile_top'])
+
+        response = self.client.get(reverse('manager:metrics'))
+        content = response.content.decode()
+        self.assertIn('iot_analysis_total 2.0', content)
+        self.assertIn(f'iot_analysis_packets_parsed_total {2.0 * len(build_test_packets())}', content)
+        self.assertIn('iot_analysis_stage_wall_seconds_total{stage="parse"}', content)
+        self.assertIn('iot_analysis_jobs{state="done"} 2', content)
+
+
+class DeviceAnalyzeHistoryTestCase(TestCase):
+
+    def setUp(self):
+        self._storage_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._storage_dir.cleanup)
+        storage_settings = override_settings(ANALYSIS_STORAGE_DIR=self._storage_dir.name)
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+        self.device = Device.objects.create(name='camera', ipv4='192.168.1.10')
+
+    def test_summary_is_stored_with_features_side_file(self):
+        analysis = NetworkAnalyzer.to_columnar([
+            {'ether_src': True, 'ether_dst': False, 'proto': 6, 'dest_port': 80, 'packet_length': 100,
+             'has_file_payload': True},
+            {'ether_src': True, 'ether_dst': False, 'proto': 17, 'dest_port': 53, 'packet_length': 60,
+             'has_file_payload': False},
+            {'ether_src': False, 'ether_dst': False, 'packet_length': 42, 'has_file_payload': False},
+        ])
+
+        history = DeviceAnalyzeHistory.create_from_analysis(
+            self.device.pk, analysis, np.array([1, 0, 0]), np.array([0.95, 0.1, 0.3]), model_version='1'
+        )
+        history.refresh_from_db()
+
+        self.assertEqual(history.packet_count, 3)
+        self.assertEqual(history.bytes_total, 202)
+        self.assertEqual(history.payload_count, 1)
+        self.assertAlmostEqual(history.prediction_score, 1 / 3)
+        self.assertEqual(history.protocol_breakdown, {'tcp': 1, 'udp': 1, 'non_ip': 1})
+        self.assertEqual(history.port_breakdown, {'80': 1, '53': 1})
+        self.assertEqual(sum(history.score_histogram), 3)
+        self.assertEqual(history.result, '')
+        pd.testing.assert_frame_equal(history.load_features(), analysis)
+
+    def test_features_are_deleted_with_the_last_history(self):
+        analysis = NetworkAnalyzer.to_columnar([{'packet_length': 60}])
+        history = DeviceAnalyzeHistory.create_from_analysis(self.device.pk, analysis, np.zeros(1))
+        reused = DeviceAnalyzeHistory.create_from_history(history, self.device.pk)
+        features_dir = Path(self._storage_dir.name) / history.features_path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            history.delete()
+        self.assertTrue(features_dir.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reused.delete()
+        self.assertFalse(features_dir.exists())
+
+    def test_unreferenced_features_are_cleaned_up(self):
+        analysis = NetworkAnalyzer.to_columnar([{'packet_length': 60}])
+        kept = DeviceAnalyzeHistory.create_from_analysis(self.device.pk, analysis, np.zeros(1))
+        orphan = storage.save_features(analysis)
+        (Path(self._storage_dir.name) / 'orphan.npz').write_bytes(b'')
+        (Path(self._storage_dir.name) / 'run.prof').write_bytes(b'')
+
+        call_command('cleanup_features', stdout=StringIO())
+        self.assertTrue((Path(self._storage_dir.name) / orphan).exists())
+
+        call_command('cleanup_features', min_age_hours=-1, stdout=StringIO())
+        remaining = sorted(path.name for path in Path(self._storage_dir.name).iterdir())
+        self.assertEqual(remaining, sorted([kept.features_path, 'run.prof']))
+
+
+class DashboardPageTestCase(TestCase):
+
+    def _create_devices(self, count: int):
+        for index in range(count):
+            device = Device.objects.create(name=f'device {index}', ipv4=f'10.0.0.{index + 1}')
+            for score in (0.2, 0.4):
+                DeviceAnalyzeHistory.objects.create(
+                    device=device, prediction_score=score, payload_count=2, bytes_total=3 * 10 ** 6
+                )
+
+    def _count_dashboard_queries(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('manager:dashboard_page'))
+
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_device_count(self):
+        self._create_devices(2)
+        queries_for_few_devices = self._count_dashboard_queries()
+
+        self._create_devices(20)
+        queries_for_many_devices = self._count_dashboard_queries()
+
+        self.assertEqual(queries_for_few_devices, queries_for_many_devices)
+        self.assertLessEqual(queries_for_many_devices, 1)
+
+    def test_device_stats_are_aggregated(self):
+        self._create_devices(1)
+        Device.objects.create(name='idle', ipv4='10.0.1.1')
+
+        response = self.client.get(reverse('manager:dashboard_page'))
+        stats = {device['name']: device for device in response.context['devices'].values()}
+
+        self.assertEqual(stats['device 0']['prediction_score_avg'], 0.3)
+        self.assertEqual(stats['device 0']['payload_count'], 4)
+        self.assertEqual(stats['device 0']['packet_length'], 6)
+        self.assertEqual(stats['device 0']['analysis_count'], 2)
+        self.assertEqual(stats['idle']['prediction_score_avg'], 'Undef.')
+        self.assertEqual(stats['idle']['analysis_count'], 0)
+
+
+class DevicePageTestCase(TestCase):
+
+    def setUp(self):
+        self._storage_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._storage_dir.cleanup)
+        storage_settings = override_settings(ANALYSIS_STORAGE_DIR=self._storage_dir.name)
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+        self.device = Device.objects.create(name='camera', ipv4='192.168.1.10')
+
+    def test_history_is_paginated_and_stats_come_from_rollup(self):
+        for index in range(DevicePage.HISTORY_PAGE_SIZE + 3):
+            DeviceAnalyzeHistory.objects.create(
+                device=self.device, prediction_score=0.5, payload_count=1, bytes_total=10 ** 6
+            )
+        DeviceAnalyzeHistory.objects.order_by('pk').first().delete()
+
+        url = reverse('manager:device_page', kwargs={'pk': self.device.pk})
+        first_page = self.client.get(url)
+        second_page = self.client.get(url, {'before': first_page.context['history_next_before']})
+
+        self.assertEqual(len(first_page.context['history']), DevicePage.HISTORY_PAGE_SIZE)
+        self.assertEqual(len(second_page.context['history']), 2)
+        self.assertIsNone(second_page.context['history_next_before'])
+        self.assertEqual(first_page.context['overall_stats']['analysis_count'], DevicePage.HISTORY_PAGE_SIZE + 2)
+        self.assertEqual(first_page.context['overall_stats']['packet_length'], DevicePage.HISTORY_PAGE_SIZE + 2)
+
+    def test_analysis_is_streamed_in_chunks(self):
+        analysis = NetworkAnalyzer.to_columnar([
+            {'ether_src': True, 'ether_dst': False, 'packet_length': length, 'has_file_payload': False}
+            for length in range(60, 65)
+        ])
+        # Признаки записаны двумя шардами, куски отдаются по каждому шарду отдельно
+        with mock.patch.object(storage.FeatureWriter, 'SHARD_ROWS', 3):
+            writer = storage.FeatureWriter()
+            writer.write(analysis.iloc[:3])
+            writer.write(analysis.iloc[3:])
+        history = DeviceAnalyzeHistory.create_from_summary(
+            self.device.pk, writer.close(), storage.summarize(analysis, np.zeros(5))
+        )
+
+        # Признаки целиком в память не загружаются
+        with mock.patch.object(HistoryAnalysisView, 'CHUNK_ROWS', 2), \
+                mock.patch.object(storage, 'load_features', side_effect=AssertionError):
+            response = self.client.get(reverse(
+                'manager:history_analysis', kwargs={'pk': self.device.pk, 'history_pk': history.pk}
+            ))
+            records = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual([record['packet_length'] for record in records], list(range(60, 65)))
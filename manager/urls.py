@@ -10,4 +10,7 @@ urlpatterns = [
     path('logout/', views.logout_action, name='logout'),
     path('dashboard/', views.DashboardPage.as_view(), name='dashboard_page'),
     path('devices/<int:pk>/', views.DevicePage.as_view(), name='device_page'),
+    path('devices/<int:pk>/history/<int:history_pk>/analysis/', views.HistoryAnalysisView.as_view(),
+         name='history_analysis'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
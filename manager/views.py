@@ -1,18 +1,15 @@
-import json
 import traceback
-from copy import deepcopy
 
 from django.contrib import messages
 from django.contrib.auth import login, logout, authenticate
-from django.shortcuts import redirect
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
-from django.views.generic.base import TemplateView
+from django.views.generic.base import TemplateView, View
 
-from core import DatasetType
-from core.analyzer.network import NetworkAnalyzer
-from core.ml.predictor import Predictor
+from manager import ingest, metrics
 from manager.forms import DeviceForm, AnalysisForm
-from manager.models import Device, DeviceAnalyzeHistory
+from manager.models import AnalysisJob, Device, DeviceAnalysisStats, DeviceAnalyzeHistory
 
 
 class IndexPage(TemplateView):
@@ -52,7 +49,7 @@ class DashboardPage(TemplateView):
         ctx = super().get_context_data(**kwargs)
 
         devices = {}
-        for device in Device.objects.all():
+        for device in Device.objects.with_analysis_stats():
             device_stat = device.analyze_history()
             devices[device.pk] = device_stat
 
@@ -79,51 +76,54 @@ class DevicePage(TemplateView):
     template_name = 'manager/device_page.html'
     form = AnalysisForm
 
+    HISTORY_PAGE_SIZE = 12
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
 
-        history = DeviceAnalyzeHistory.objects.filter(
-            device_id=kwargs['pk']
-        ).order_by('-pk').select_related('device')
+        device = get_object_or_404(Device, pk=kwargs['pk'])
 
-        history_data = {}
-        overall_stats = {
-            'prediction_score_sum': 0,
-            'prediction_score_count': 0,
-            'payload_count': 0,
-            'packet_length': 0,
-            'analysis_count': 0,
-            'prediction_score_avg': 0,
-        }
+        # Постраничный вывод по ключу: следующая страница - записи с pk меньше последнего показанного
+        history = DeviceAnalyzeHistory.objects.filter(device_id=device.pk).defer('result').order_by('-pk')
+        before = self.request.GET.get('before', '')
+        if before.isdigit():
+            history = history.filter(pk__lt=int(before))
+        history = list(history[:self.HISTORY_PAGE_SIZE + 1])
+        has_next_page = len(history) > self.HISTORY_PAGE_SIZE
+        history = history[:self.HISTORY_PAGE_SIZE]
 
+        history_data = {}
         for history_obj in history:  # type: DeviceAnalyzeHistory
-            history_obj_stat = deepcopy(overall_stats)
-            history_obj_stat = history_obj.analyze_history(history_obj_stat)
-            history_obj_stat.update(dict(
-                created_date=history_obj.created_date,
-                result=history_obj.result,
-            ))
+            history_obj_stat = history_obj.analyze_history({
+                'prediction_score_sum': 0,
+                'prediction_score_count': 0,
+                'payload_count': 0,
+                'packet_length': 0,
+                'analysis_count': 0,
+            })
 
             prediction_score_avg = 'Undef.'
-            if history_obj_stat.get('prediction_score_count') > 0:
+            if history_obj_stat['prediction_score_count'] > 0:
                 prediction_score_avg = round(
-                    history_obj_stat.get('prediction_score_sum', 0) /
-                    history_obj_stat.get('prediction_score_count'), 2
+                    history_obj_stat['prediction_score_sum'] / history_obj_stat['prediction_score_count'], 2
                 )
-            history_obj_stat['prediction_score_avg'] = prediction_score_avg
+            history_obj_stat.update(dict(
+                created_date=history_obj.created_date,
+                prediction_score_avg=prediction_score_avg,
+            ))
 
             history_data[history_obj.pk] = history_obj_stat
 
-        for stat in history_data.values():
-            for stat_key, stat_val in stat.items():
-                if isinstance(stat_val, (int, float)):
-                    overall_stats[stat_key] += stat_val
-
-        if history:
-            overall_stats['created_date'] = history.first().device.created_date
+        stats = DeviceAnalysisStats.objects.filter(device_id=device.pk).first() or DeviceAnalysisStats(device=device)
+        overall_stats = stats.get_overall_stats()
+        if stats.analysis_count:
+            overall_stats['created_date'] = device.created_date
 
         ctx['history'] = history_data
+        ctx['history_next_before'] = history[-1].pk if has_next_page else None
+        ctx['history_is_first_page'] = not before.isdigit()
         ctx['overall_stats'] = overall_stats
+        ctx['jobs'] = AnalysisJob.objects.filter(device_id=kwargs['pk']).order_by('-pk')[:10]
         return ctx
 
     def post(self, request, *args, **kwargs):
@@ -131,25 +131,14 @@ class DevicePage(TemplateView):
         form = self.form(request.POST, request.FILES)
         if form.is_valid():
             try:
-                analyzer = NetworkAnalyzer()
-                analysis = analyzer.analyze(form.cleaned_data['pcap_file'])
-
-                predictor = Predictor(DatasetType.NETWORK, output_feature='is_malicious')
-                prediction = list(predictor.predict(analysis))
-
-                score = sum(prediction) / len(prediction)
-
-                result = {
-                    'analysis': analysis,
-                    'prediction_score': score,
-                }
-
-                DeviceAnalyzeHistory.objects.create(
-                    device_id=kwargs['pk'],
-                    result=json.dumps(result)
+                job = ingest.submit_capture(
+                    kwargs['pk'], form.cleaned_data['pcap_file'], profile=form.cleaned_data['profile']
                 )
 
-                messages.info(request, 'Analysis is ready to check')
+                if job.state == AnalysisJob.STATE_DONE:
+                    messages.info(request, 'This capture was already analyzed with the current model')
+                else:
+                    messages.info(request, 'Analysis is queued, its status is shown below')
             except:  # noqa
                 traceback.print_exc()
                 messages.error(request, 'Something went wrong in processing. Try again later!')
@@ -157,3 +146,38 @@ class DevicePage(TemplateView):
             messages.error(request, 'Form is invalid')
 
         return redirect(reverse('manager:device_page', kwargs=kwargs))
+
+
+class HistoryAnalysisView(View):
+
+    CHUNK_ROWS = 10000
+
+    def get(self, request, *args, **kwargs):
+        history = get_object_or_404(DeviceAnalyzeHistory, pk=kwargs['history_pk'], device_id=kwargs['pk'])
+
+        if history.features_path:
+            content = self._stream_records(history)
+        elif history.result:
+            content = [history.result]
+        else:
+            raise Http404('Analysis features are not stored')
+
+        response = StreamingHttpResponse(content, content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="analysis_{history.pk}.json"'
+        return response
+
+    def _stream_records(self, history: DeviceAnalyzeHistory):
+        # Признаки читаются с диска кусками по CHUNK_ROWS пакетов и сразу отдаются частями JSON-массива:
+        # в памяти только текущий кусок, сколько бы пакетов ни было в истории
+        yield '['
+        separator = ''
+        for chunk in history.iter_features(self.CHUNK_ROWS):
+            yield separator + chunk.to_json(orient='records')[1:-1]
+            separator = ','
+        yield ']'
+
+
+class MetricsView(View):
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
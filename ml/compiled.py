@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+class CompiledTreeModel:
+
+    # Дерево или лес деревьев, развернутые в плоские массивы узлов: для предсказания нужен только numpy.
+    # Узлы всех деревьев лежат подряд, листья замкнуты сами на себя; обход идет по уровням
+    # сразу для всех строк, без ветвлений в Python
+    FORMAT_VERSION = 1
+    METADATA_FILE = 'model.json'
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'missing_left', 'proba', 'roots')
+    CHUNK_ROWS = 65536
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray, right: np.ndarray,
+                 missing_left: np.ndarray, proba: np.ndarray, roots: np.ndarray, classes: np.ndarray,
+                 max_depth: int, is_ensemble: bool, metadata: Optional[dict] = None,
+                 feature_importances: Optional[np.ndarray] = None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.proba = proba
+        self.roots = roots
+        self.classes_ = classes
+        self.max_depth = max_depth
+        self.is_ensemble = is_ensemble
+        self.metadata = metadata or {}
+        self.feature_importances_ = feature_importances
+
+    @staticmethod
+    def supports(model) -> bool:
+        from sklearn import ensemble, tree
+
+        if isinstance(model, (ensemble.RandomForestClassifier, ensemble.ExtraTreesClassifier)):
+            return model.n_outputs_ == 1
+        return isinstance(model, tree.DecisionTreeClassifier) and model.n_outputs_ == 1
+
+    @classmethod
+    def from_sklearn(cls, model) -> 'CompiledTreeModel':
+        if not cls.supports(model):
+            raise ValueError(f'Model {type(model).__name__} can not be compiled')
+
+        is_ensemble = hasattr(model, 'estimators_')
+        trees = [estimator.tree_ for estimator in model.estimators_] if is_ensemble else [model.tree_]
+
+        arrays = {name: [] for name in cls.ARRAYS if name != 'roots'}
+        roots = []
+        offset = 0
+        for tree_ in trees:
+            is_leaf = tree_.children_left == -1
+            nodes = np.arange(tree_.node_count, dtype=np.int32)
+
+            # Лист ссылается сам на себя, поэтому лишние шаги обхода его не покидают
+            arrays['feature'].append(np.where(is_leaf, 0, tree_.feature).astype(np.int32))
+            arrays['threshold'].append(np.where(is_leaf, np.inf, cls._round_thresholds(tree_.threshold)))
+            arrays['left'].append(np.where(is_leaf, nodes, tree_.children_left).astype(np.int32) + offset)
+            arrays['right'].append(np.where(is_leaf, nodes, tree_.children_right).astype(np.int32) + offset)
+            arrays['missing_left'].append(np.asarray(tree_.missing_go_to_left, dtype=bool))
+            arrays['proba'].append(cls._get_leaf_proba(tree_.value[:, 0, :]))
+
+            roots.append(offset)
+            offset += tree_.node_count
+
+        compiled = {name: np.concatenate(values) for name, values in arrays.items()}
+        compiled['threshold'] = compiled['threshold'].astype(np.float32)
+        return cls(
+            roots=np.asarray(roots, dtype=np.int32), classes=np.asarray(model.classes_),
+            max_depth=max(tree_.max_depth for tree_ in trees), is_ensemble=is_ensemble,
+            feature_importances=np.asarray(model.feature_importances_), **compiled,
+        )
+
+    @staticmethod
+    def _round_thresholds(threshold: np.ndarray) -> np.ndarray:
+        # sklearn сравнивает float32-признак с float64-порогом. Для float32 x условие x <= t равносильно
+        # x <= наибольшего float32, не превышающего t, поэтому порог округляется вниз и сравнение идет во float32
+        rounded = threshold.astype(np.float32)
+        too_high = rounded.astype(np.float64) > threshold
+        rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+        return rounded
+
+    @staticmethod
+    def _get_leaf_proba(value: np.ndarray) -> np.ndarray:
+        # Та же нормировка, что в DecisionTreeClassifier.predict_proba, но один раз на узел, а не на строку
+        proba = np.array(value, dtype=np.float64)
+        normalizer = proba.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        proba /= normalizer
+        return proba
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def get_used_features(self) -> np.ndarray:
+        # Индексы признаков, по которым есть хотя бы одно разбиение; остальные на предсказание не влияют
+        is_split = self.left != np.arange(len(self.left))
+        return np.unique(self.feature[is_split])
+
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        # Номер листа для каждой строки и каждого дерева: матрица (строки, деревья).
+        # Пары (строка, дерево), дошедшие до листа, выбывают - глубокие ветви проходит только их хвост
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        n_rows, n_features = data.shape
+        values = data.reshape(-1)
+
+        nodes = np.tile(self.roots, n_rows)
+        row_offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * n_features, self.n_trees)
+        active = np.arange(len(nodes))
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            node_values = values[row_offsets[active] + self.feature[current]]
+            go_left = node_values <= self.threshold[current]
+            is_missing = np.isnan(node_values)
+            if is_missing.any():
+                go_left[is_missing] = self.missing_left[current[is_missing]]
+
+            following = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = following
+            active = active[following != current]
+            if not len(active):
+                break
+
+        return nodes.reshape(n_rows, self.n_trees)
+
+    def predict_proba(self, data: np.ndarray) -> np.ndarray:
+        data = np.asarray(data)
+        proba = np.empty((len(data), len(self.classes_)), dtype=np.float64)
+        for start in range(0, len(data), self.CHUNK_ROWS):
+            proba[start:start + self.CHUNK_ROWS] = self._predict_proba_chunk(data[start:start + self.CHUNK_ROWS])
+
+        return proba
+
+    def _predict_proba_chunk(self, data: np.ndarray) -> np.ndarray:
+        leaves = self.apply(data)
+        if not self.is_ensemble:
+            return self.proba[leaves[:, 0]]
+
+        # Как в RandomForestClassifier: сумма вероятностей деревьев по порядку, затем деление на их число
+        proba = np.zeros((len(data), len(self.classes_)), dtype=np.float64)
+        for tree_index in range(self.n_trees):
+            proba += self.proba[leaves[:, tree_index]]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, data: np.ndarray) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(data), axis=1))
+
+    def dump(self, path: str, **metadata):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Каталог собирается рядом и подменяет старый целиком, читатель не увидит смесь версий
+        tmp_dir = Path(tempfile.mkdtemp(dir=path.parent, suffix='.tmp'))
+        for name in self.ARRAYS:
+            np.save(tmp_dir / f'{name}.npy', getattr(self, name), allow_pickle=False)
+
+        self.metadata = dict(metadata)
+        importances = None if self.feature_importances_ is None else self.feature_importances_.tolist()
+        with open(tmp_dir / self.METADATA_FILE, 'w') as f:
+            json.dump({
+                'format_version': self.FORMAT_VERSION,
+                'classes': self.classes_.tolist(),
+                'max_depth': self.max_depth,
+                'is_ensemble': self.is_ensemble,
+                'feature_importances': importances,
+                'metadata': self.metadata,
+            }, f, indent=2)
+
+        if path.exists():
+            shutil.rmtree(path)
+        os.replace(tmp_dir, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'CompiledTreeModel':
+        path = Path(path)
+        with open(path / cls.METADATA_FILE, 'r') as f:
+            header = json.load(f)
+
+        if header['format_version'] != cls.FORMAT_VERSION:
+            raise ValueError(f'Unsupported compiled model format version: {header["format_version"]}')
+
+        # Массивы отображаются в память: процессы с одной моделью делят страницы, загрузка мгновенная
+        arrays = {name: np.load(path / f'{name}.npy', mmap_mode='r' if mmap else None) for name in cls.ARRAYS}
+        importances = header.get('feature_importances')
+        return cls(
+            classes=np.asarray(header['classes']), max_depth=header['max_depth'],
+            is_ensemble=header['is_ensemble'], metadata=header['metadata'],
+            feature_importances=None if importances is None else np.asarray(importances), **arrays,
+        )
@@ -1,21 +1,135 @@
-from typing import Optional
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
 from core import DatasetType
+from core.ml.split import DatasetSplit
+from core.ml.store import DatasetStore
 
 
 class DataSetMixin:
 
     DEFAULT_OUTPUT_FEATURE = 'not_identified_feature'
+    CHUNK_ROWS = 100000
 
-    def __init__(self, dataset_type: DatasetType, output_feature: Optional[str] = None, *args, **kwargs):
+    def __init__(self, dataset_type: DatasetType, output_feature: Optional[str] = None, *args,
+                 variant: Optional[str] = None, dataset_path: Optional[str] = None, **kwargs):
         super().__init__(*args, **kwargs)
 
         if not output_feature:
             output_feature = self.DEFAULT_OUTPUT_FEATURE
 
-        dataset_path = DatasetType.get_dataset_path(dataset_type)
-        self._data = pd.read_csv(dataset_path, sep=';')
+        self._dataset_path = Path(dataset_path) if dataset_path else self.get_dataset_path(dataset_type, variant)
+        self._dataset = None
         self._output_feature = output_feature
         self._dataset_type = dataset_type
+        self._variant = variant
+
+    @staticmethod
+    def get_dataset_path(dataset_type: DatasetType, variant: Optional[str] = None) -> Path:
+        # Вариант датасета (например, потоки вместо пакетов) лежит рядом с основным: network-flow.csv
+        dataset_path = Path(DatasetType.get_dataset_path(dataset_type))
+        if not variant:
+            return dataset_path
+
+        return dataset_path.with_name(f'{dataset_path.stem}-{variant}{dataset_path.suffix}')
+
+    @property
+    def _data(self) -> pd.DataFrame:
+        # Датасет читается только при первом обращении - предсказанию он не нужен
+        if self._dataset is None:
+            store = self._store
+            if store.exists():
+                self._dataset = store.read()
+            else:
+                self._dataset = pd.read_csv(self._dataset_path, sep=';')
+
+        return self._dataset
+
+    @property
+    def _store(self) -> DatasetStore:
+        return DatasetStore(DatasetStore.get_store_path(self._dataset_path))
+
+    def get_input_features(self) -> List[str]:
+        store = self._store
+        columns = store.columns if store.exists() else pd.read_csv(self._dataset_path, sep=';', nrows=0).columns
+        return [column for column in columns if column != self._output_feature]
+
+    def _iter_chunks(self, features: List[str], chunk_rows: Optional[int] = None,
+                     mask: Optional[np.ndarray] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        # Датасет читается кусками сразу в float32-матрицу признаков и вектор меток, без общего DataFrame.
+        # mask - булева маска по всем строкам датасета (например, обучающая часть разбиения)
+        chunk_rows = chunk_rows or self.CHUNK_ROWS
+        offset = 0
+        for data, labels in self._iter_raw_chunks(features, chunk_rows):
+            rows = len(labels)
+            if mask is not None:
+                data, labels = data[mask[offset:offset + rows]], labels[mask[offset:offset + rows]]
+            offset += rows
+            yield data, labels
+
+    def _iter_raw_chunks(self, features: List[str], chunk_rows: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        store = self._store
+        if store.exists():
+            for chunk in store.iter_column_chunks(features + [self._output_feature], chunk_rows):
+                labels = chunk.pop(self._output_feature)
+                data = np.empty((len(labels), len(features)), dtype=np.float32)
+                for index, feature in enumerate(features):
+                    data[:, index] = chunk[feature]
+                yield data, np.asarray(labels)
+            return
+
+        for chunk in pd.read_csv(self._dataset_path, sep=';', chunksize=chunk_rows):
+            yield self.to_feature_matrix(chunk, features), chunk[self._output_feature].to_numpy()
+
+    def _iter_labels(self, chunk_rows: Optional[int] = None,
+                     mask: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+        chunk_rows = chunk_rows or self.CHUNK_ROWS
+        store = self._store
+        if store.exists():
+            chunks = (
+                chunk[self._output_feature] for chunk in store.iter_column_chunks([self._output_feature], chunk_rows)
+            )
+        else:
+            reader = pd.read_csv(self._dataset_path, sep=';', usecols=[self._output_feature], chunksize=chunk_rows)
+            chunks = (chunk[self._output_feature].to_numpy() for chunk in reader)
+
+        offset = 0
+        for labels in chunks:
+            labels = np.asarray(labels)
+            rows = len(labels)
+            if mask is not None:
+                labels = labels[mask[offset:offset + rows]]
+            offset += rows
+            yield labels
+
+    def _get_dataset_fingerprint(self) -> str:
+        store = self._store
+        stat = (store.path / store.METADATA_FILE if store.exists() else Path(self._dataset_path)).stat()
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def get_split(self) -> DatasetSplit:
+        # Разбиение создается один раз на версию датасета и пересоздается только после его пересборки
+        split_path = DatasetSplit.get_path(self._dataset_path)
+        fingerprint = self._get_dataset_fingerprint()
+
+        split = DatasetSplit.load(split_path)
+        if split is None or split.fingerprint != fingerprint:
+            labels = np.concatenate(list(self._iter_labels()) or [np.empty(0)])
+            split = DatasetSplit.create(labels, fingerprint)
+            split.dump(split_path)
+
+        return split
+
+    @staticmethod
+    def to_feature_matrix(data: Union[pd.DataFrame, np.ndarray], features: List[str]) -> np.ndarray:
+        # Отсутствующие признаки остаются NaN, как при обучении на датасете; float32 - тип, с которым
+        # работают деревья sklearn, поэтому повторного преобразования внутри модели не будет
+        if isinstance(data, pd.DataFrame):
+            data = data.reindex(columns=features).to_numpy(dtype=np.float32, na_value=np.nan)
+        elif data.ndim != 2 or data.shape[1] != len(features):
+            raise ValueError(f'Expected a matrix with {len(features)} feature columns, got shape {data.shape}')
+
+        return np.ascontiguousarray(data, dtype=np.float32)
@@ -0,0 +1,81 @@
+import pickle
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+
+from core import DatasetType
+from core.ml.dataset import DataSetMixin
+from core.ml.predictor import Predictor
+from core.ml.trainer import Trainer
+
+
+class Evaluator(DataSetMixin):
+
+    def __init__(self, dataset_type: DatasetType, output_feature: Optional[str] = None,
+                 variant: Optional[str] = None):
+        super().__init__(dataset_type=dataset_type, output_feature=output_feature, variant=variant)
+
+    def get_results_path(self):
+        return self._dataset_path.with_name(f'{self._dataset_path.stem}.evaluation.csv')
+
+    def evaluate(self, model, features: List[str]) -> dict:
+        # Оценка на отложенной части сохраненного разбиения; предсказание кусками, как при анализе
+        split = self.get_split()
+
+        y_true, y_pred = [], []
+        predict_seconds = 0.0
+        for data, labels in self._iter_chunks(features, mask=split.test_mask):
+            started_at = time.perf_counter()
+            predictions, _ = Predictor.predict_matrix(model, data)
+            predict_seconds += time.perf_counter() - started_at
+            y_true.append(labels)
+            y_pred.append(predictions)
+
+        y_true = np.concatenate(y_true) if y_true else np.empty(0)
+        y_pred = np.concatenate(y_pred) if y_pred else np.empty(0)
+        average = 'binary' if set(np.unique(y_true)) <= {0, 1} else 'macro'
+        precision, recall, f1, _ = metrics.precision_recall_fscore_support(
+            y_true, y_pred, average=average, zero_division=0
+        )
+
+        return {
+            'test_rows': len(y_true),
+            'accuracy': round(metrics.accuracy_score(y_true, y_pred), 4) if len(y_true) else None,
+            'precision': round(float(precision), 4),
+            'recall': round(float(recall), 4),
+            'f1': round(float(f1), 4),
+            'rows_per_second': round(len(y_true) / predict_seconds) if predict_seconds > 0 else None,
+            'model_size_kb': round(len(pickle.dumps(model)) / 1024, 1),
+        }
+
+    def compare(self, candidates: Dict[str, dict]) -> pd.DataFrame:
+        # candidates: имя -> параметры Trainer (classifier, features, memory_budget_mb, n_jobs, ...)
+        results = []
+        for name, options in candidates.items():
+            trainer = Trainer(self._dataset_type, output_feature=self._output_feature, variant=self._variant, **options)
+            model, features, report = trainer.fit()
+
+            results.append({
+                'candidate': name,
+                'classifier': report['classifier'],
+                'features': len(features),
+                **self.evaluate(model, features),
+                'train_rows': report['rows_used'],
+                'train_seconds': report['train_seconds'],
+                'peak_memory_mb': report['peak_memory_mb'],
+            })
+
+        results = pd.DataFrame(results)
+        self._dump_results(results)
+        return results
+
+    def _dump_results(self, results: pd.DataFrame):
+        # Таблица результатов дописывается: видно, как менялись модели и признаки между запусками
+        results_path = self.get_results_path()
+        results = results.assign(
+            evaluated_at=time.strftime('%Y-%m-%d %H:%M:%S'), split=self.get_split().fingerprint
+        )
+        results.to_csv(results_path, sep=';', index=False, mode='a', header=not results_path.exists())
@@ -0,0 +1,33 @@
+import resource
+import sys
+import tracemalloc
+
+
+def get_peak_rss_mb() -> float:
+    # Пиковый RSS процесса за все время жизни; в Linux ru_maxrss в килобайтах, в macOS - в байтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class PeakMemoryTracker:
+
+    # Пик памяти, выделенной внутри блока: массивы numpy учитываются tracemalloc, в отличие от RSS
+    # не включает интерпретатор и загруженные библиотеки
+    def __init__(self):
+        self.peak_mb = None
+        self._started = False
+        self._base = 0
+
+    def __enter__(self) -> 'PeakMemoryTracker':
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._base = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak_mb = max(peak - self._base, 0) / 1024 ** 2
+        if self._started:
+            tracemalloc.stop()
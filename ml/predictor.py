@@ -1,27 +1,93 @@
-from typing import Optional, List
+import time
+import warnings
+from typing import Iterable, Iterator, Optional, List, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
 from core import DatasetType
-from core import utils
+from core.ml.compiled import CompiledTreeModel
 from core.ml.dataset import DataSetMixin
+from core.ml.registry import ModelArtifact, ModelRegistry
 
 
 class Predictor(DataSetMixin):
 
-    def __init__(self, dataset_type: DatasetType, output_feature: Optional[str] = None):
-        super().__init__(dataset_type=dataset_type, output_feature=output_feature)
-        self._model = utils.load_model(self._dataset_type)
+    def __init__(self, dataset_type: DatasetType, output_feature: Optional[str] = None, variant: Optional[str] = None,
+                 artifact: Optional[ModelArtifact] = None):
+        super().__init__(dataset_type=dataset_type, output_feature=output_feature, variant=variant)
+        # Готовый артефакт (например, в бенчмарках) подставляется в обход реестра
+        self._artifact = artifact or ModelRegistry.get(
+            self._dataset_type, output_feature=self._output_feature, variant=variant
+        )
+        self._model = self._artifact.model
+        self._rows_per_second = None
 
-    def predict(self, prediction_input: List[dict]):
+    @property
+    def model_version(self) -> str:
+        return self._artifact.version
 
-        trained_dataset_keys = list(self._data.keys())
-        trained_dataset_keys.remove(self._output_feature)
+    @property
+    def features(self) -> List[str]:
+        return list(self._artifact.features)
 
-        data = []
-        for row in prediction_input:
-            data.append(pd.Series(row, index=trained_dataset_keys))
+    def get_required_features(self, min_importance: Optional[float] = None) -> List[str]:
+        # Признаки, от которых зависит предсказание: у деревьев - участвующие хотя бы в одном разбиении,
+        # их отбор не меняет результат. С порогом отбрасываются и признаки с важностью не выше него -
+        # быстрее, но предсказания могут измениться. Для прочих моделей нужны все признаки
+        model = self._model
+        if not isinstance(model, CompiledTreeModel) and CompiledTreeModel.supports(model):
+            model = CompiledTreeModel.from_sklearn(model)
+        if not isinstance(model, CompiledTreeModel):
+            return self.features
 
-        predictions = self._model.predict(data)
+        used = set(model.get_used_features().tolist())
+        if min_importance is not None and model.feature_importances_ is not None:
+            used = {index for index in used if model.feature_importances_[index] > min_importance}
+
+        return [feature for index, feature in enumerate(self.features) if index in used]
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        return self._rows_per_second
+
+    def predict(self, prediction_input: Union[pd.DataFrame, np.ndarray, List[dict]]):
+        if isinstance(prediction_input, list):
+            prediction_input = pd.DataFrame(prediction_input, columns=self.features)
+
+        predictions, _ = self.predict_batch(prediction_input)
 
         return predictions
+
+    def predict_batch(self, prediction_input: Union[pd.DataFrame, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        started_at = time.perf_counter()
+
+        data = self.to_feature_matrix(prediction_input, self.features)
+        predictions, probabilities = self.predict_matrix(self._model, data)
+
+        elapsed = time.perf_counter() - started_at
+        if elapsed > 0:
+            self._rows_per_second = len(data) / elapsed
+
+        return predictions, probabilities
+
+    @staticmethod
+    def predict_matrix(model, data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        with warnings.catch_warnings():
+            # Модель обучена на DataFrame, а сюда приходит матрица с тем же порядком колонок
+            warnings.filterwarnings('ignore', message='X does not have valid feature names')
+            probabilities = model.predict_proba(data)
+
+        # Так же, как model.predict, но без второго прохода по дереву
+        predictions = model.classes_.take(np.argmax(probabilities, axis=1))
+
+        # Вероятность класса 1 ищется по classes_: модель, обученная на одном классе, возвращает одну колонку
+        positive = np.flatnonzero(model.classes_ == 1)
+        if not len(positive):
+            return predictions, np.zeros(len(probabilities))
+
+        return predictions, probabilities[:, positive[0]]
+
+    def predict_chunks(self, chunks: Iterable[Union[pd.DataFrame, np.ndarray]]) -> Iterator[tuple]:
+        for chunk in chunks:
+            yield self.predict_batch(chunk)
@@ -0,0 +1,167 @@
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from core import DatasetType
+from core import utils
+from core.ml.compiled import CompiledTreeModel
+from core.ml.dataset import DataSetMixin
+from core.ml.store import DatasetStore
+
+
+ModelArtifact = namedtuple('ModelArtifact', ['model', 'features', 'output_feature', 'version', 'mtime'])
+
+
+class ModelRegistry:
+
+    LEGACY_VERSION = 'legacy'
+
+    # Модели живут все время жизни процесса, при каждом обращении проверяется только mtime файла
+    _artifacts: Dict[Tuple[DatasetType, Optional[str]], ModelArtifact] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_artifact_path(dataset_type: DatasetType, variant: Optional[str] = None) -> Path:
+        dataset_path = DataSetMixin.get_dataset_path(dataset_type, variant)
+        return dataset_path.with_name(f'{dataset_path.stem}.model')
+
+    @classmethod
+    def get_compiled_path(cls, dataset_type: DatasetType, variant: Optional[str] = None) -> Path:
+        return cls.get_artifact_path(dataset_type, variant).with_suffix('.tree')
+
+    @classmethod
+    def get_metadata_path(cls, dataset_type: DatasetType, variant: Optional[str] = None) -> Path:
+        artifact_path = cls.get_artifact_path(dataset_type, variant)
+        return artifact_path.with_name(f'{artifact_path.name}.json')
+
+    @classmethod
+    def dump(cls, model, dataset_type: DatasetType, features: List[str], output_feature: str,
+             variant: Optional[str] = None) -> str:
+        version = time.strftime('%Y%m%d%H%M%S')
+        artifact_path = cls.get_artifact_path(dataset_type, variant)
+
+        fd, tmp_path = tempfile.mkstemp(dir=artifact_path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({
+                'model': model,
+                'features': list(features),
+                'output_feature': output_feature,
+                'version': version,
+            }, f)
+        os.replace(tmp_path, artifact_path)
+        metadata = dict(features=list(features), output_feature=output_feature, version=version,
+                        source_mtime=artifact_path.stat().st_mtime_ns)
+
+        # Версию и схему можно узнать, не распаковывая модель
+        fd, tmp_path = tempfile.mkstemp(dir=artifact_path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(tmp_path, cls.get_metadata_path(dataset_type, variant))
+
+        # Деревья дополнительно выгружаются в массивы numpy: для предсказания не нужны ни sklearn, ни pickle.
+        # Сборка привязана к mtime файла модели и без него не используется
+        if CompiledTreeModel.supports(model):
+            CompiledTreeModel.from_sklearn(model).dump(cls.get_compiled_path(dataset_type, variant), **metadata)
+
+        # Старый формат хранения есть только у основной модели
+        if not variant:
+            utils.dump_model(model, dataset_type)
+        return version
+
+    @classmethod
+    def get(cls, dataset_type: DatasetType, output_feature: Optional[str] = None,
+            variant: Optional[str] = None) -> ModelArtifact:
+        key = (dataset_type, variant)
+        mtime = cls._get_mtime(dataset_type, variant)
+
+        artifact = cls._artifacts.get(key)
+        if artifact is not None and artifact.mtime == mtime:
+            return artifact
+
+        with cls._lock:
+            artifact = cls._artifacts.get(key)
+            if artifact is None or artifact.mtime != mtime:
+                artifact = cls._load(dataset_type, output_feature, mtime, variant)
+                cls._artifacts[key] = artifact
+
+        return artifact
+
+    @classmethod
+    def get_version(cls, dataset_type: DatasetType, variant: Optional[str] = None) -> Optional[str]:
+        mtime = cls._get_mtime(dataset_type, variant)
+        if mtime is None:
+            return None if variant else cls.LEGACY_VERSION
+
+        artifact = cls._artifacts.get((dataset_type, variant))
+        if artifact is not None and artifact.mtime == mtime:
+            return artifact.version
+
+        metadata_path = cls.get_metadata_path(dataset_type, variant)
+        if metadata_path.exists():
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+            if metadata.get('source_mtime') == mtime:
+                return metadata['version']
+
+        # Модель сохранена до появления файла метаданных
+        return cls.get(dataset_type, variant=variant).version
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._artifacts.clear()
+
+    @classmethod
+    def _get_mtime(cls, dataset_type: DatasetType, variant: Optional[str] = None) -> Optional[int]:
+        try:
+            return cls.get_artifact_path(dataset_type, variant).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def _load_compiled(cls, dataset_type: DatasetType, variant: Optional[str],
+                       mtime: int) -> Optional[CompiledTreeModel]:
+        compiled_path = cls.get_compiled_path(dataset_type, variant)
+        if not (compiled_path / CompiledTreeModel.METADATA_FILE).exists():
+            return None
+
+        compiled = CompiledTreeModel.load(compiled_path)
+        return compiled if compiled.metadata.get('source_mtime') == mtime else None
+
+    @classmethod
+    def _load(cls, dataset_type: DatasetType, output_feature: Optional[str], mtime: Optional[int],
+              variant: Optional[str] = None) -> ModelArtifact:
+        artifact_path = cls.get_artifact_path(dataset_type, variant)
+        if mtime is not None:
+            compiled = cls._load_compiled(dataset_type, variant, mtime)
+            if compiled is not None:
+                metadata = compiled.metadata
+                return ModelArtifact(compiled, metadata['features'], metadata['output_feature'], metadata['version'],
+                                     mtime)
+
+            with open(artifact_path, 'rb') as f:
+                artifact = pickle.load(f)
+
+            return ModelArtifact(mtime=mtime, **artifact)
+
+        if variant:
+            raise FileNotFoundError(f'Model is not trained yet: {artifact_path}')
+
+        # Модель обучена до появления реестра: схему берем из модели или из заголовка датасета
+        model = utils.load_model(dataset_type)
+        features = getattr(model, 'feature_names_in_', None)
+        if features is None:
+            dataset_path = DatasetType.get_dataset_path(dataset_type)
+            store = DatasetStore(DatasetStore.get_store_path(dataset_path))
+            features = store.columns if store.exists() else pd.read_csv(dataset_path, sep=';', nrows=0).columns
+
+        features = [feature for feature in features if feature != output_feature]
+        return ModelArtifact(model, features, output_feature, cls.LEGACY_VERSION, mtime)
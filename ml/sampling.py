@@ -0,0 +1,46 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+class StratifiedReservoir:
+
+    # Равномерная выборка без возвращения за один проход (алгоритм R) отдельно по каждому классу.
+    # Размер выборки класса пропорционален его доле, поэтому соотношение классов сохраняется
+    def __init__(self, capacity: int, class_counts: Dict[int, int], n_features: int, random_state=None):
+        total = sum(class_counts.values())
+        self._rng = np.random.default_rng(random_state)
+
+        self._sizes, self._offsets, self._seen = {}, {}, {}
+        offset = 0
+        for label, count in sorted(class_counts.items()):
+            size = count if capacity >= total else min(count, max(int(capacity * count / total), 1))
+            self._sizes[label], self._offsets[label], self._seen[label] = size, offset, 0
+            offset += size
+
+        # Все классы лежат в одной заранее выделенной матрице - итоговая выборка не копируется
+        self._data = np.empty((offset, n_features), dtype=np.float32)
+        self._labels = np.empty(offset, dtype=np.int64)
+        for label, size in self._sizes.items():
+            self._labels[self._offsets[label]:self._offsets[label] + size] = label
+
+    def add(self, data: np.ndarray, labels: np.ndarray):
+        for label in np.unique(labels):
+            rows = data[labels == label]
+            size, offset, seen = self._sizes[int(label)], self._offsets[int(label)], self._seen[int(label)]
+
+            # Пока резервуар не заполнен, строки просто дописываются
+            fill = min(max(size - seen, 0), len(rows))
+            self._data[offset + seen:offset + seen + fill] = rows[:fill]
+
+            rest = rows[fill:]
+            if len(rest):
+                positions = np.arange(seen + fill + 1, seen + len(rows) + 1)
+                slots = (self._rng.random(len(rest)) * positions).astype(np.int64)
+                accepted = slots < size
+                self._data[offset + slots[accepted]] = rest[accepted]
+
+            self._seen[int(label)] = seen + len(rows)
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._data, self._labels
@@ -0,0 +1,51 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+class DatasetSplit:
+
+    # Отложенная выборка хранится рядом с датасетом: все модели обучаются и проверяются на одних и тех же строках.
+    # Маска упакована по биту на строку, поэтому помещается в память даже для очень больших датасетов
+    TEST_SIZE = 0.25
+    RANDOM_STATE = 0
+
+    def __init__(self, test_mask: np.ndarray, fingerprint: str):
+        self.test_mask = test_mask
+        self.train_mask = ~test_mask
+        self.fingerprint = fingerprint
+
+    def __len__(self) -> int:
+        return len(self.test_mask)
+
+    @staticmethod
+    def get_path(dataset_path) -> Path:
+        dataset_path = Path(dataset_path)
+        return dataset_path.with_name(f'{dataset_path.stem}.split.npz')
+
+    @classmethod
+    def create(cls, labels: np.ndarray, fingerprint: str, test_size: float = TEST_SIZE,
+               random_state: Optional[int] = RANDOM_STATE) -> 'DatasetSplit':
+        # Стратификация: из каждого класса в отложенную часть попадает одна и та же доля строк
+        rng = np.random.default_rng(random_state)
+        test_mask = np.zeros(len(labels), dtype=bool)
+        for label in np.unique(labels):
+            indices = np.flatnonzero(labels == label)
+            test_mask[rng.choice(indices, size=int(round(len(indices) * test_size)), replace=False)] = True
+
+        return cls(test_mask, fingerprint)
+
+    @classmethod
+    def load(cls, path) -> Optional['DatasetSplit']:
+        if not Path(path).exists():
+            return None
+
+        with np.load(path) as split:
+            rows = int(split['rows'])
+            test_mask = np.unpackbits(split['test_mask'], count=rows).astype(bool)
+            return cls(test_mask, str(split['fingerprint']))
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, test_mask=np.packbits(self.test_mask), rows=len(self.test_mask), fingerprint=self.fingerprint)
@@ -0,0 +1,179 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class DatasetStore:
+
+    # Колоночный датасет: каталог с метаданными и шардами, в шарде по одному .npy на колонку.
+    # Типы колонок фиксированы схемой, дописывание - это новые шарды, старые данные не перезаписываются
+    FORMAT_VERSION = 1
+    METADATA_FILE = 'dataset.json'
+    SHARD_ROWS = 1000000
+
+    def __init__(self, path: str):
+        self._path = Path(path)
+        self._metadata = None
+
+    @staticmethod
+    def get_store_path(dataset_path: str) -> Path:
+        # Хранилище лежит рядом с CSV-датасетом: network.csv -> network.data
+        return Path(dataset_path).with_suffix('.data')
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def exists(self) -> bool:
+        return (self._path / self.METADATA_FILE).exists()
+
+    @property
+    def metadata(self) -> dict:
+        if self._metadata is None:
+            with open(self._path / self.METADATA_FILE, 'r') as f:
+                self._metadata = json.load(f)
+
+            if self._metadata['format_version'] != self.FORMAT_VERSION:
+                raise ValueError(f'Unsupported dataset format version: {self._metadata["format_version"]}')
+
+        return self._metadata
+
+    @property
+    def schema(self) -> List[Tuple[str, str]]:
+        return [(column, dtype) for column, dtype in self.metadata['columns']]
+
+    @property
+    def columns(self) -> List[str]:
+        return [column for column, _ in self.schema]
+
+    @property
+    def schema_version(self) -> Optional[int]:
+        return self.metadata.get('schema_version')
+
+    def __len__(self) -> int:
+        return sum(shard['rows'] for shard in self.metadata['shards'])
+
+    def create(self, schema: Sequence[Tuple[str, str]], schema_version: Optional[int] = None):
+        if self._path.exists():
+            shutil.rmtree(self._path)
+        self._path.mkdir(parents=True)
+
+        self._metadata = {
+            'format_version': self.FORMAT_VERSION,
+            'schema_version': schema_version,
+            'columns': [[column, dtype] for column, dtype in schema],
+            'shards': [],
+        }
+        self._dump_metadata()
+
+    def writer(self, shard_rows: int = SHARD_ROWS) -> 'DatasetWriter':
+        return DatasetWriter(self, shard_rows=shard_rows)
+
+    def append_shard(self, frame: pd.DataFrame):
+        frame = self.cast(frame)
+        shard_name = f'{len(self.metadata["shards"]):05d}'
+
+        # Шард собирается во временном каталоге и появляется целиком; метаданные обновляются последними
+        tmp_dir = Path(tempfile.mkdtemp(dir=self._path, suffix='.tmp'))
+        for column in self.columns:
+            np.save(tmp_dir / f'{column}.npy', frame[column].to_numpy(), allow_pickle=False)
+        os.replace(tmp_dir, self._path / shard_name)
+
+        self.metadata['shards'].append({'name': shard_name, 'rows': len(frame)})
+        self._dump_metadata()
+
+    def cast(self, frame: pd.DataFrame) -> pd.DataFrame:
+        columns = {}
+        for column, dtype in self.schema:
+            if column in frame:
+                values = frame[column].to_numpy()
+            elif dtype == 'float64':
+                values = np.full(len(frame), np.nan)
+            else:
+                raise ValueError(f'Column {column} is missing in the dataset batch')
+
+            columns[column] = values.astype(dtype, copy=False)
+
+        return pd.DataFrame(columns)
+
+    def iter_shards(self, columns: Optional[List[str]] = None, mmap: bool = True) -> Iterator[pd.DataFrame]:
+        columns = columns or self.columns
+        for shard in self.metadata['shards']:
+            shard_dir = self._path / shard['name']
+            yield pd.DataFrame({
+                column: np.load(shard_dir / f'{column}.npy', mmap_mode='r' if mmap else None)
+                for column in columns
+            })
+
+    def iter_column_chunks(self, columns: List[str], chunk_rows: int) -> Iterator[Dict[str, np.ndarray]]:
+        # Срезы отображенных в память колонок: в память попадает только то, что вызывающий код скопирует
+        for shard in self.metadata['shards']:
+            shard_dir = self._path / shard['name']
+            arrays = {column: np.load(shard_dir / f'{column}.npy', mmap_mode='r') for column in columns}
+            for start in range(0, shard['rows'], chunk_rows):
+                yield {column: values[start:start + chunk_rows] for column, values in arrays.items()}
+
+    def read(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        columns = columns or self.columns
+        dtypes = dict(self.schema)
+        shards = self.metadata['shards']
+
+        # Каждая колонка читается в заранее выделенный массив без промежуточных копий и разбора текста
+        data = {}
+        for column in columns:
+            values = np.empty(len(self), dtype=dtypes[column])
+            offset = 0
+            for shard in shards:
+                values[offset:offset + shard['rows']] = np.load(
+                    self._path / shard['name'] / f'{column}.npy', mmap_mode='r'
+                )
+                offset += shard['rows']
+            data[column] = values
+
+        return pd.DataFrame(data, copy=False)
+
+    def _dump_metadata(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self._path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._metadata, f, indent=2)
+        os.replace(tmp_path, self._path / self.METADATA_FILE)
+
+
+class DatasetWriter:
+
+    def __init__(self, store: DatasetStore, shard_rows: int = DatasetStore.SHARD_ROWS):
+        self._store = store
+        self._shard_rows = shard_rows
+        self._batches = []
+        self._buffered_rows = 0
+
+    def __enter__(self) -> 'DatasetWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def write(self, frame: pd.DataFrame, **constants):
+        # Константные колонки (например, метка is_malicious) добавляются ко всему батчу
+        if constants:
+            frame = frame.assign(**constants)
+
+        self._batches.append(self._store.cast(frame))
+        self._buffered_rows += len(frame)
+        if self._buffered_rows >= self._shard_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered_rows:
+            self._batches = []
+            return
+
+        self._store.append_shard(pd.concat(self._batches, ignore_index=True))
+        self._batches = []
+        self._buffered_rows = 0
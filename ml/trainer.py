@@ -1,28 +1,133 @@
-from typing import Optional
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
 
-from sklearn import tree
-from sklearn import model_selection
+import numpy as np
+from sklearn import base, ensemble, impute, linear_model, pipeline, preprocessing, tree
 
 from core import DatasetType
-from core import utils
 from core.ml.dataset import DataSetMixin
+from core.ml.memory import PeakMemoryTracker, get_peak_rss_mb
+from core.ml.registry import ModelRegistry
+from core.ml.sampling import StratifiedReservoir
 
 
 class Trainer(DataSetMixin):
 
     DEFAULT_OUTPUT_FEATURE = 'is_malware'
 
-    def __init__(self, dataset_type: DatasetType, output_feature: Optional[str] = None):
-        super().__init__(dataset_type=dataset_type, output_feature=output_feature)
-        self._classifier = tree.DecisionTreeClassifier
+    CLASSIFIER_TREE = 'tree'
+    CLASSIFIER_FOREST = 'forest'
+    CLASSIFIER_SGD = 'sgd'
+    CLASSIFIERS = (CLASSIFIER_TREE, CLASSIFIER_FOREST, CLASSIFIER_SGD)
 
-    def train(self):
-        x_input = self._data.drop(columns=[self._output_feature])
-        y_output = self._data[self._output_feature]
+    # Доля бюджета памяти под обучающую выборку, остальное - кусок чтения и структуры модели
+    SAMPLE_BUDGET_SHARE = 0.4
 
-        x_train, _, y_train, _ = model_selection.train_test_split(x_input, y_output, test_size=0.25)
+    def __init__(self, dataset_type: DatasetType, output_feature: Optional[str] = None, variant: Optional[str] = None,
+                 classifier=CLASSIFIER_TREE, memory_budget_mb: Optional[float] = None, n_jobs: int = -1,
+                 random_state=None, features: Optional[List[str]] = None):
+        super().__init__(dataset_type=dataset_type, output_feature=output_feature, variant=variant)
+        # Вместо имени можно передать любой классификатор sklearn - он обучается на выборке в памяти
+        if isinstance(classifier, str) and classifier not in self.CLASSIFIERS:
+            raise ValueError(f'Unknown classifier: {classifier}')
 
-        model = self._classifier()
-        model.fit(x_train, y_train)
+        self._classifier = classifier
+        self._features = features
+        self._memory_budget_mb = memory_budget_mb
+        self._n_jobs = n_jobs
+        self._random_state = random_state
 
-        utils.dump_model(model, self._dataset_type)
+    def train(self) -> dict:
+        model, features, report = self.fit()
+        report['version'] = ModelRegistry.dump(
+            model, self._dataset_type, features, self._output_feature, variant=self._variant
+        )
+
+        return report
+
+    def fit(self) -> Tuple[object, List[str], dict]:
+        # Модель обучается только на обучающей части сохраненного разбиения, отложенная часть - для оценки
+        with PeakMemoryTracker() as memory:
+            started_at = time.perf_counter()
+            features = self._features or self.get_input_features()
+            split = self.get_split()
+            class_counts = Counter()
+            for labels in self._iter_labels(mask=split.train_mask):
+                class_counts.update(labels.tolist())
+
+            if self._classifier == self.CLASSIFIER_SGD:
+                model, rows_used = self._fit_incremental(features, sorted(class_counts), split.train_mask)
+            else:
+                model, rows_used = self._fit_in_memory(features, class_counts, split.train_mask)
+            train_seconds = time.perf_counter() - started_at
+
+        report = {
+            'classifier': self._classifier if isinstance(self._classifier, str) else type(self._classifier).__name__,
+            'rows_total': len(split),
+            'rows_used': rows_used,
+            'train_seconds': round(train_seconds, 3),
+            'peak_memory_mb': round(memory.peak_mb, 1),
+            'peak_rss_mb': round(get_peak_rss_mb(), 1),
+            'memory_budget_mb': self._memory_budget_mb,
+        }
+        # Бюджет ограничивает выборку, но не структуры самого классификатора - превышение только отмечается
+        report['over_budget'] = bool(self._memory_budget_mb and report['peak_memory_mb'] > self._memory_budget_mb)
+
+        return model, features, report
+
+    def _get_chunk_rows(self, n_features: int) -> int:
+        if not self._memory_budget_mb:
+            return self.CHUNK_ROWS
+
+        # Кусок чтения занимает не больше десятой части бюджета
+        row_bytes = n_features * 4 + 8
+        return max(int(self._memory_budget_mb * 1024 ** 2 * 0.1 / row_bytes), 1000)
+
+    def _get_sample_capacity(self, n_features: int, rows_total: int) -> int:
+        if not self._memory_budget_mb:
+            return rows_total
+
+        row_bytes = n_features * 4 + 8
+        return int(self._memory_budget_mb * 1024 ** 2 * self.SAMPLE_BUDGET_SHARE / row_bytes)
+
+    def _make_classifier(self):
+        if not isinstance(self._classifier, str):
+            return base.clone(self._classifier)
+        if self._classifier == self.CLASSIFIER_FOREST:
+            return ensemble.RandomForestClassifier(n_jobs=self._n_jobs, random_state=self._random_state)
+
+        return tree.DecisionTreeClassifier(random_state=self._random_state)
+
+    def _fit_in_memory(self, features: list, class_counts: Counter, train_mask: np.ndarray):
+        # Датасет больше бюджета - обучаемся на стратифицированной выборке, иначе на всех строках
+        rows_total = sum(class_counts.values())
+        reservoir = StratifiedReservoir(
+            self._get_sample_capacity(len(features), rows_total), class_counts, len(features),
+            random_state=self._random_state,
+        )
+        for data, labels in self._iter_chunks(features, self._get_chunk_rows(len(features)), mask=train_mask):
+            reservoir.add(data, labels)
+        x_input, y_output = reservoir.result()
+
+        model = self._make_classifier()
+        model.fit(x_input, y_output)
+        return model, len(y_output)
+
+    def _fit_incremental(self, features: list, classes: list, train_mask: np.ndarray):
+        # partial_fit по кускам датасета: в памяти только текущий кусок, размер датасета не ограничен
+        imputer = impute.SimpleImputer(strategy='constant', fill_value=0, keep_empty_features=True)
+        scaler = preprocessing.StandardScaler()
+        classifier = linear_model.SGDClassifier(loss='log_loss', random_state=self._random_state)
+
+        chunk_rows = self._get_chunk_rows(len(features))
+        for data, _ in self._iter_chunks(features, chunk_rows, mask=train_mask):
+            scaler.partial_fit(np.nan_to_num(data, nan=0))
+
+        rows_used = 0
+        for data, labels in self._iter_chunks(features, chunk_rows, mask=train_mask):
+            classifier.partial_fit(scaler.transform(np.nan_to_num(data, nan=0)), labels, classes=classes)
+            rows_used += len(labels)
+
+        imputer.fit(np.zeros((1, len(features)), dtype=np.float32))
+        return pipeline.Pipeline([('imputer', imputer), ('scaler', scaler), ('classifier', classifier)]), rows_used